@@ -0,0 +1,69 @@
+"""Helpers shared by the benchmarks in this folder. They are not part of the package"""
+import random
+import time
+from pathlib import Path
+from typing import Callable, List
+
+from globality_black.reformat_text import COMPILED
+from globality_black.tests.fixtures import get_fixture_path
+
+
+FIXTURE_FEATURES = ["blank_lines", "fmt_off", "comprehensions", "dotted_chains", "tuples"]
+
+
+def get_build() -> str:
+    """Build of globality-black being benchmarked, see compiled.py"""
+    return "compiled (mypyc)" if COMPILED else "pure Python"
+
+
+def get_fixture_inputs() -> List[str]:
+    return [
+        get_fixture_path(f"{feature}_input.txt").read_text()
+        for feature in FIXTURE_FEATURES
+    ]
+
+
+def build_big_file(copies: int) -> str:
+    """Concatenate all fixture inputs `copies` times, to simulate a big file"""
+    return "\n\n".join(get_fixture_inputs() * copies)
+
+
+def build_synthetic_repo(root: Path, files: int, seed: int = 0, files_per_package: int = 50):
+    """
+    Write `files` modules under `root`, in packages of `files_per_package`. Each module is a
+    random mix of fixture inputs (needing globality-black) and outputs (already formatted), i.e.
+    comprehensions, dotted chains, blank lines, tuples and fmt: off regions. Deterministic for a
+    given seed
+    """
+
+    snippets = get_fixture_inputs() + [
+        get_fixture_path(f"{feature}_output.txt").read_text()
+        for feature in FIXTURE_FEATURES
+    ]
+    generator = random.Random(seed)
+
+    for index in range(files):
+        package_path = root / f"package_{index // files_per_package}"
+        package_path.mkdir(parents=True, exist_ok=True)
+        module_snippets = generator.choices(snippets, k=generator.randint(1, 6))
+        module_code = f'"""Synthetic module {index}"""\n\n' + "\n\n".join(module_snippets)
+        (package_path / f"module_{index}.py").write_text(module_code)
+
+
+def read_sources(paths: List[Path]) -> List[str]:
+    sources = []
+    for path in paths:
+        files = sorted(path.glob("**/*.py")) if path.is_dir() else [path]
+        sources.extend(file.read_text() for file in files)
+    return sources
+
+
+def best_of(function: Callable[[], object], repeat: int) -> float:
+    """Minimum wall time (in seconds) over `repeat` runs, the least noisy estimate"""
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
@@ -0,0 +1,70 @@
+"""
+Run a benchmark against both builds of globality-black: pure Python, and with the
+pre/post-processing modules compiled with mypyc (see setup.py)
+
+The repo is copied to a temporary directory, where the modules are compiled in place (mypy must
+be installed), and the benchmark is run from the repo then from the copy, each run reporting its
+build. Arguments after `--` are passed to the benchmark.
+
+Usage (from the root of the repo):
+
+    python -m benchmarks.compiled [BENCHMARK] [-- BENCHMARK_ARGS...]
+
+e.g. `python -m benchmarks.compiled engines -- --copies 20`. BENCHMARK is a module of this
+folder, `engines` by default
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import click
+
+
+# files of the repo needed to build the package and run the benchmarks
+BUILD_FILES = ["setup.py", "setup.cfg", "mypy.ini", "README.md", "HISTORY.rst"]
+BUILD_FOLDERS = ["globality_black", "benchmarks"]
+IGNORED_PATTERNS = ["__pycache__", "*.so", "*.pyd", "coverage", "test-results"]
+
+
+def build_compiled_copy(root: Path, build_path: Path):
+    for name in BUILD_FILES:
+        shutil.copy(str(root / name), str(build_path / name))
+    for name in BUILD_FOLDERS:
+        shutil.copytree(
+            str(root / name),
+            str(build_path / name),
+            ignore=shutil.ignore_patterns(*IGNORED_PATTERNS),
+        )
+
+    subprocess.run(
+        [sys.executable, "setup.py", "--quiet", "build_ext", "--inplace"],
+        cwd=build_path,
+        env={**os.environ, "GLOBALITY_BLACK_USE_MYPYC": "1"},
+        check=True,
+    )
+
+
+@click.command()
+@click.argument("benchmark", default="engines")
+@click.argument("benchmark_args", nargs=-1, type=click.UNPROCESSED)
+def main(benchmark, benchmark_args):
+    root = Path(__file__).resolve().parent.parent
+
+    with tempfile.TemporaryDirectory() as build_dir:
+        click.echo("Compiling with mypyc...")
+        build_compiled_copy(root, Path(build_dir))
+
+        for path in (root, Path(build_dir)):
+            click.echo()
+            subprocess.run(
+                [sys.executable, "-m", f"benchmarks.{benchmark}", *benchmark_args],
+                cwd=path,
+                check=True,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Compare the pre-processing engines (parso vs tokenize) and post-processing engines (parso vs
+black's blib2to3 tree) of reformat_text
+
+Usage (from the root of the repo):
+
+    python -m benchmarks.engines [PATHS...] [--copies 20] [--repeat 5]
+
+Without paths, the fixtures are concatenated `copies` times to build a big file
+"""
+from itertools import product
+from pathlib import Path
+
+import click
+from black import Mode
+
+from benchmarks.common import (
+    best_of,
+    build_big_file,
+    get_build,
+    read_sources,
+)
+from globality_black.constants import (
+    DEFAULT_BLACK_LINE_LENGTH,
+    PostProcessingEngine,
+    PreProcessingEngine,
+)
+from globality_black.reformat_text import reformat_text
+
+
+@click.command()
+@click.argument("paths", nargs=-1, type=click.Path(exists=True))
+@click.option("--copies", type=int, default=20)
+@click.option("--repeat", type=int, default=5)
+def main(paths, copies, repeat):
+    sources = read_sources([Path(path) for path in paths]) if paths else [build_big_file(copies)]
+    black_mode = Mode(line_length=DEFAULT_BLACK_LINE_LENGTH)
+    total_size = sum(len(source) for source in sources)
+    click.echo(
+        f"{len(sources)} sources, {total_size} characters, best of {repeat}, {get_build()} build"
+    )
+
+    outputs, timings = {}, {}
+    for engines in product(PreProcessingEngine, PostProcessingEngine):
+        pre_engine, post_engine = engines
+
+        def run():
+            outputs[engines] = [
+                reformat_text(source, black_mode, post_engine=post_engine, pre_engine=pre_engine)
+                for source in sources
+            ]
+
+        timings[engines] = best_of(run, repeat)
+        click.echo(f"{get_name(engines):>20}: {timings[engines]:.3f}s")
+
+    reference = (PreProcessingEngine.PARSO, PostProcessingEngine.PARSO)
+    baseline = timings[reference]
+    for engines, timing in timings.items():
+        same_output = outputs[engines] == outputs[reference]
+        click.echo(
+            f"{get_name(engines):>20}: {100 * (timing - baseline) / baseline:+.1f}% "
+            f"(same output as {get_name(reference)}: {same_output})"
+        )
+
+
+def get_name(engines) -> str:
+    return " + ".join(engine.value for engine in engines)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,457 @@
+"""
+Performance fuzzing: generate random Python sources, time `reformat_text` on each against a
+budget proportional to its size, and minimize the inputs exceeding it (or crashing)
+
+Usage (from the root of the repo):
+
+    python -m benchmarks.fuzz [--samples 200] [--seed 0] [--budget-factor 10] [--save]
+
+Sources come from a small grammar biased towards what has been slow before: wide lines, deep
+nesting, long dotted chains, big literals, nested comprehensions, blank lines inside brackets and
+fmt: off regions. Each source is defined by a seed and a few size knobs (`Knobs`), so failing
+inputs are first shrunk by halving the knobs while they still fail, and then by stripping the
+indentation inside brackets and replacing subtrees of their syntax tree with `pass` or `x`.
+Sample N is reproduced with `--seed N --samples 1`.
+
+The budget is `--budget-factor` times the time to format the input (or the output, if bigger) at
+FORMAT_BYTES_PER_SECOND (the usual throughput, see executors.py), plus a fixed OVERHEAD_SECONDS.
+Errors raised by globality-black (rather than black) are failures too, e.g. RecursionError.
+
+With --save, minimized inputs are written to globality_black/tests/fixtures/performance, where
+test_performance_fixtures.py checks that they are formatted within budget from then on.
+"""
+import ast
+import hashlib
+import io
+import random
+import time
+import tokenize
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, fields, replace
+from pathlib import Path
+from typing import (
+    Callable,
+    List,
+    NamedTuple,
+    Optional,
+)
+
+import black
+import click
+
+from globality_black.constants import DEFAULT_BLACK_LINE_LENGTH
+from globality_black.executors import FORMAT_BYTES_PER_SECOND
+from globality_black.reformat_text import BlackError, reformat_text
+from globality_black.tests.fixtures import get_fixture_path
+
+
+OVERHEAD_SECONDS = 0.1
+# generated sources stop growing after this many characters (roughly), whatever the knobs
+MAX_CHARACTERS = 200_000
+PERFORMANCE_FIXTURES_PATH = get_fixture_path("performance")
+NAMES = ["x", "value", "df", "items", "result", "key", "self.data"]
+METHODS = ["fillna", "groupby", "sum", "apply", "get", "strip", "reset_index", "merge"]
+
+
+@dataclass(frozen=True)
+class Knobs:
+    """Size knobs of a generated source, shrunk (halved) when minimizing"""
+
+    statements: int
+    depth: int
+    width: int
+    chain: int
+    line_width: int
+
+
+def get_budget(size: int, budget_factor: float) -> float:
+    return budget_factor * size / FORMAT_BYTES_PER_SECOND + OVERHEAD_SECONDS
+
+
+def draw_knobs(seed: int) -> Knobs:
+    """Mostly small sources, with heavy tails on each knob"""
+
+    generator = random.Random(f"knobs-{seed}")
+
+    def heavy(cap: int) -> int:
+        return min(int(generator.paretovariate(0.8)), cap)
+
+    return Knobs(
+        statements=heavy(200),
+        depth=heavy(150),
+        width=heavy(5000),
+        chain=heavy(500),
+        line_width=heavy(2000),
+    )
+
+
+class SourceGenerator:
+    def __init__(self, seed: int, knobs: Knobs):
+        self.generator = random.Random(seed)
+        self.knobs = knobs
+        self.characters = 0
+
+    def __call__(self) -> str:
+        lines = [
+            self.statement(indent=0)
+            for _ in range(self.knobs.statements)
+        ]
+        return "\n".join(lines) + "\n"
+
+    def size(self, cap: int) -> int:
+        return self.generator.randint(0, cap) if self.characters < MAX_CHARACTERS else 0
+
+    def statement(self, indent: int) -> str:
+        pad = " " * indent
+        kind = self.generator.choice(["assign", "assign", "def", "if", "fmt_off", "comment"])
+        if kind == "def" and indent < 40:
+            body = self.statement(indent + 4)
+            return f"{pad}def function(a, b=None):\n{body}\n{pad}    return a\n"
+        if kind == "if" and indent < 40:
+            return f"{pad}if x:\n{self.statement(indent + 4)}\n"
+        if kind == "fmt_off":
+            return f"{pad}# fmt: off\n{pad}x = {self.expression(indent, 1)}\n{pad}# fmt: on\n"
+        assignment = f"{pad}{self.generator.choice(NAMES)} = "
+        if kind == "comment":
+            comment = f"{pad}# {'comment ' * self.size(self.knobs.line_width // 8 + 1)}\n"
+            return comment + assignment + self.atom()
+        return assignment + self.expression(indent, self.knobs.depth)
+
+    def expression(self, indent: int, depth: int) -> str:
+        if depth <= 0 or self.characters >= MAX_CHARACTERS:
+            return self.atom()
+
+        kind = self.generator.choice(
+            ["atom", "literal", "literal", "call", "chain", "comprehension", "tuple", "binary"],
+        )
+        if kind == "literal":
+            return self.literal(indent, depth)
+        if kind == "call":
+            return f"{self.generator.choice(NAMES)}({self.elements(indent, depth)})"
+        if kind == "chain":
+            return self.chain(indent, depth)
+        if kind == "comprehension":
+            return self.comprehension(indent, depth)
+        if kind == "tuple":
+            return f"({self.expression(indent, depth - 1)},)"
+        if kind == "binary":
+            operands = [self.atom() for _ in range(self.size(self.knobs.line_width // 4) + 2)]
+            return " + ".join(operands)
+        return self.atom()
+
+    def atom(self) -> str:
+        kind = self.generator.choice(["name", "number", "string", "long_string"])
+        if kind == "name":
+            atom = self.generator.choice(NAMES)
+        elif kind == "number":
+            atom = str(self.generator.randint(0, 10 ** 6))
+        elif kind == "string":
+            atom = '"text"'
+        else:
+            atom = '"' + "a" * self.size(self.knobs.line_width) + '"'
+        self.characters += len(atom)
+        return atom
+
+    def literal(self, indent: int, depth: int) -> str:
+        opening, closing = self.generator.choice(["[]", "()", "{}"])
+        if opening == "{" and self.generator.random() < 0.5:
+            element_count = self.size(self.knobs.width)
+            items = [
+                f'"{index}": {self.expression(indent + 4, depth - 1)}'
+                for index in range(element_count)
+            ]
+            return opening + self.join(items, indent) + closing
+        return opening + self.elements(indent, depth) + closing
+
+    def elements(self, indent: int, depth: int) -> str:
+        return self.join(
+            [self.expression(indent + 4, depth - 1) for _ in range(self.size(self.knobs.width))],
+            indent,
+        )
+
+    def join(self, elements: List[str], indent: int) -> str:
+        """One line, or exploded with a magic trailing comma and some blank lines"""
+
+        if not elements or self.generator.random() < 0.5:
+            return ", ".join(elements)
+
+        pad = " " * (indent + 4)
+        self.characters += len(pad) * len(elements)
+        separator = f",\n\n{pad}" if self.generator.random() < 0.3 else f",\n{pad}"
+        return f"\n{pad}" + separator.join(elements) + f",\n{' ' * indent}"
+
+    def chain(self, indent: int, depth: int) -> str:
+        calls = []
+        for _ in range(self.size(self.knobs.chain) + 1):
+            method = self.generator.choice(METHODS)
+            self.characters += len(method) + indent + 4
+            calls.append(f".{method}({self.elements(indent + 4, depth - 1)})")
+        if self.generator.random() < 0.5:
+            return "df" + "".join(calls)
+
+        # split in several lines, as covered by dotted_chains.py
+        pad = " " * (indent + 4)
+        return f"(\n{pad}df\n{pad}" + f"\n{pad}".join(calls) + f"\n{' ' * indent})"
+
+    def comprehension(self, indent: int, depth: int) -> str:
+        clauses = [
+            f"for {name} in {self.expression(indent, depth - 1)}"
+            + (" if x" if self.generator.random() < 0.3 else "")
+            for name in ("a", "b", "c")[:self.size(2) + 1]
+        ]
+        return f"[{self.expression(indent, depth - 1)} " + " ".join(clauses) + "]"
+
+
+def generate(seed: int, knobs: Knobs) -> Optional[str]:
+    """Source for the given seed and knobs, None if not valid Python (e.g. nested too deep)"""
+
+    code = SourceGenerator(seed, knobs)()
+    try:
+        ast.parse(code)
+    except (SyntaxError, RecursionError, MemoryError, ValueError):
+        return None
+    return code
+
+
+class Outcome(NamedTuple):
+    seconds: float
+    budget: float
+    # error raised by globality-black (not black), if any
+    error: Optional[str] = None
+
+    @property
+    def failed(self) -> bool:
+        return self.error is not None or self.seconds > self.budget
+
+    def __str__(self) -> str:
+        return self.error or f"{self.seconds:.2f}s > budget {self.budget:.2f}s"
+
+
+def run(code: str, budget_factor: float, repeat: int) -> Outcome:
+    """
+    Best time of `repeat` runs of reformat_text, against the budget for the biggest of the input
+    and the output (black can multiply the size of deeply nested code with indentation)
+
+    We run in a new thread, so that the depth of the stack (hence hitting the recursion limit)
+    does not depend on the caller: inputs minimized here fail wherever they are formatted
+    """
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(_run, code, budget_factor, repeat).result()
+
+
+def _run(code: str, budget_factor: float, repeat: int) -> Outcome:
+    mode = black.Mode(line_length=DEFAULT_BLACK_LINE_LENGTH)
+    timings = []
+    output_code = code
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            output_code = reformat_text(code, mode)
+        except BlackError:
+            # black refusing the input (e.g. too deep) is not our problem
+            pass
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}".splitlines()[0]
+            return Outcome(time.perf_counter() - start, 0.0, error)
+        timings.append(time.perf_counter() - start)
+
+    return Outcome(min(timings), get_budget(max(len(code), len(output_code)), budget_factor))
+
+
+def is_failing(code: str, budget_factor: float) -> bool:
+    outcome = run(code, budget_factor, repeat=1)
+    if not outcome.failed or outcome.error is not None:
+        return outcome.failed
+    # a single run is noisy, confirm with the best of two
+    return run(code, budget_factor, repeat=2).failed
+
+
+def minimize(
+    seed: int,
+    knobs: Knobs,
+    code: str,
+    fails: Callable[[str], bool],
+    deadline: float,
+) -> str:
+    """
+    Smallest variant of `code` that `fails`, found before `deadline`: halve each knob while the
+    regenerated source still fails, then drop the indentation inside brackets and reduce the
+    syntax tree (see `reduce_tree`)
+    """
+
+    shrunk = True
+    while shrunk and time.perf_counter() < deadline:
+        shrunk = False
+        for field in fields(Knobs):
+            value = getattr(knobs, field.name)
+            if value == 0:
+                continue
+            candidate_knobs = replace(knobs, **{field.name: value // 2})
+            candidate = generate(seed, candidate_knobs)
+            if candidate is not None and len(candidate) < len(code) and fails(candidate):
+                knobs, code, shrunk = candidate_knobs, candidate, True
+
+    candidate = strip_indentation_in_brackets(code)
+    if candidate != code and fails(candidate):
+        code = candidate
+
+    return reduce_tree(code, fails, deadline)
+
+
+def strip_indentation_in_brackets(code: str) -> str:
+    """Same code without the indentation of lines inside brackets, which can be huge when nested"""
+
+    lines = code.splitlines(keepends=True)
+    depth = 0
+    for token in tokenize.generate_tokens(io.StringIO(code).readline):
+        if token.type == tokenize.OP and token.string in "([{":
+            depth += 1
+        elif token.type == tokenize.OP and token.string in ")]}":
+            depth -= 1
+        elif token.type == tokenize.NL and depth > 0 and token.start[0] < len(lines):
+            # the next line starts inside brackets
+            lines[token.start[0]] = lines[token.start[0]].lstrip(" ")
+    return "".join(lines)
+
+
+def reduce_tree(code: str, fails: Callable[[str], bool], deadline: float) -> str:
+    """
+    Replace statements by `pass` and expressions by `x` while the source still `fails`, level by
+    level from the top of the syntax tree, i.e. the biggest subtrees first. In each level, we
+    replace chunks of consecutive nodes at once, halving their size (as in delta debugging), so
+    that only the nodes needed to fail are visited one by one
+    """
+
+    depth = 0
+    while time.perf_counter() < deadline:
+        nodes = get_nodes_at_depth(ast.parse(code), depth)
+        if not nodes:
+            break
+        chunk = len(nodes)
+        while chunk >= 1 and time.perf_counter() < deadline:
+            code = replace_chunks(code, depth, chunk, fails, deadline)
+            chunk //= 2
+        depth += 1
+
+    return code
+
+
+def replace_chunks(
+    code: str,
+    depth: int,
+    chunk: int,
+    fails: Callable[[str], bool],
+    deadline: float,
+) -> str:
+    """
+    Replace each chunk of `chunk` consecutive nodes at `depth` if the source still `fails`. Nodes
+    do not overlap, so replacing them from the end of the source does not move those left to visit
+    """
+
+    source = code.encode()
+    # ast offsets are in bytes
+    line_offsets = [0]
+    for line in source.splitlines(keepends=True):
+        line_offsets.append(line_offsets[-1] + len(line))
+
+    edits = []
+    for node in get_nodes_at_depth(ast.parse(code), depth):
+        if isinstance(node, ast.stmt):
+            replacement = b"pass"
+        elif isinstance(node, ast.expr):
+            replacement = b"x"
+        else:
+            continue
+        start = line_offsets[node.lineno - 1] + node.col_offset
+        end = line_offsets[node.end_lineno - 1] + node.end_col_offset
+        if source[start:end] != replacement:
+            edits.append((start, end, replacement))
+
+    for index in reversed(range(0, len(edits), chunk)):
+        if time.perf_counter() > deadline:
+            break
+        candidate = source
+        for start, end, replacement in reversed(edits[index:index + chunk]):
+            candidate = candidate[:start] + replacement + candidate[end:]
+        if is_valid(candidate.decode()) and fails(candidate.decode()):
+            source = candidate
+
+    return source.decode()
+
+
+def get_nodes_at_depth(tree: ast.AST, depth: int) -> List[ast.AST]:
+    """Nodes `depth` levels below the root, in order, not looking into f-strings"""
+
+    nodes = [tree]
+    for _ in range(depth + 1):
+        nodes = [
+            child
+            for node in nodes
+            if not isinstance(node, ast.JoinedStr)
+            for child in ast.iter_child_nodes(node)
+            if not isinstance(child, (ast.expr_context, ast.operator, ast.unaryop, ast.cmpop))
+        ]
+    return nodes
+
+
+def is_valid(code: str) -> bool:
+    try:
+        ast.parse(code)
+    except (SyntaxError, RecursionError, MemoryError, ValueError):
+        return False
+    return True
+
+
+def save_fixture(code: str, output_path: Path) -> Path:
+    output_path.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256(code.encode()).hexdigest()[:12]
+    path = output_path / f"fuzz_{digest}.txt"
+    path.write_text(code)
+    return path
+
+
+@click.command()
+@click.option("--samples", type=int, default=200)
+@click.option("--seed", type=int, default=0)
+@click.option("--budget-factor", type=float, default=10.0)
+@click.option("--minimize-seconds", type=float, default=120.0)
+@click.option("--save/--no-save", default=False)
+@click.option(
+    "--output-path",
+    type=click.Path(file_okay=False),
+    default=str(PERFORMANCE_FIXTURES_PATH),
+)
+def main(samples, seed, budget_factor, minimize_seconds, save, output_path):
+    failures = 0
+
+    for sample_seed in range(seed, seed + samples):
+        knobs = draw_knobs(sample_seed)
+        code = generate(sample_seed, knobs)
+        if code is None:
+            continue
+
+        if not is_failing(code, budget_factor):
+            continue
+
+        failures += 1
+        outcome = run(code, budget_factor, repeat=1)
+        click.echo(f"seed {sample_seed} {knobs}: {outcome} ({len(code)} characters)")
+
+        minimized = minimize(
+            sample_seed,
+            knobs,
+            code,
+            lambda candidate: is_failing(candidate, budget_factor),
+            deadline=time.perf_counter() + minimize_seconds,
+        )
+        outcome = run(minimized, budget_factor, repeat=2)
+        click.echo(f"    minimized to {len(minimized)} characters: {outcome}")
+        if save:
+            click.echo(f"    saved to {save_fixture(minimized, Path(output_path))}")
+
+    click.echo(f"{failures} failing inputs out of {samples} samples")
+
+
+if __name__ == "__main__":
+    main()
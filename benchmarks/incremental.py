@@ -0,0 +1,64 @@
+"""
+Compare formatting a buffer from scratch vs incrementally (with a cache_key), after a one line
+edit, as done by editors or watch mode
+
+Usage (from the root of the repo):
+
+    python -m benchmarks.incremental [PATH] [--copies 20] [--repeat 5]
+
+Without a path, the fixtures are concatenated `copies` times to build a big file
+"""
+from pathlib import Path
+
+import click
+from black import Mode
+
+from benchmarks.common import best_of, build_big_file
+from globality_black.constants import DEFAULT_BLACK_LINE_LENGTH
+from globality_black.parse_cache import PARSE_CACHE
+from globality_black.reformat_text import cover_with_parso, reformat_text
+
+
+@click.command()
+@click.argument("path", required=False, type=click.Path(exists=True, dir_okay=False))
+@click.option("--copies", type=int, default=20)
+@click.option("--repeat", type=int, default=5)
+def main(path, copies, repeat):
+    source = Path(path).read_text() if path else build_big_file(copies)
+    black_mode = Mode(line_length=DEFAULT_BLACK_LINE_LENGTH)
+    lines = source.split("\n")
+    click.echo(f"{len(lines)} lines, best of {repeat}")
+
+    # alternate between two versions differing in one line in the middle of the buffer
+    edited_lines = list(lines)
+    edited_lines.insert(len(lines) // 2, "")
+    versions = ["\n".join(lines), "\n".join(edited_lines)]
+
+    def run(function, cache_key=None):
+        PARSE_CACHE.clear()
+        function(versions[1], cache_key)
+        return best_of(lambda: [function(version, cache_key) for version in versions], repeat)
+
+    def parse(code, cache_key):
+        with PARSE_CACHE.parse(code, cache_key):
+            pass
+
+    for name, function in [
+        ("parse", parse),
+        ("pre-processing", cover_with_parso),
+        ("reformat_text", lambda code, cache_key: reformat_text(
+            code,
+            black_mode,
+            cache_key=cache_key,
+        )),
+    ]:
+        scratch = run(function)
+        incremental = run(function, cache_key="benchmark")
+        click.echo(
+            f"{name:>15}: {scratch:.3f}s from scratch, {incremental:.3f}s incremental "
+            f"({100 * (incremental - scratch) / scratch:+.1f}%)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Formatting a synthetic repo (see `build_synthetic_repo`) on a slow volume, with files read and
+written by the formatting workers vs by the I/O pipeline (see io_pipeline.py)
+
+Network-backed volumes are simulated by adding `--latency-ms` to each read and write (patched
+before the pool of workers is started, hence inherited by the forked workers). We report the
+wall time of each run, and for the pipeline, how much of the I/O overlapped with formatting.
+
+Usage (from the root of the repo):
+
+    python -m benchmarks.io_pipeline [--files 200] [--workers 2] [--io-workers 4]
+        [--latency-ms 20] [--repeat 3]
+"""
+import shutil
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+
+import click
+
+from benchmarks.common import build_synthetic_repo
+from globality_black.cli import iter_results, process_path
+from globality_black.constants import Executor
+from globality_black.io_pipeline import LOOKAHEAD_PER_WORKER, IOPipeline
+
+
+def add_latency(latency: float):
+    """Make Path.read_text and Path.write_text wait `latency` seconds first"""
+
+    def with_latency(function):
+        def slow_function(*args, **kwargs):
+            time.sleep(latency)
+            return function(*args, **kwargs)
+        return slow_function
+
+    Path.read_text = with_latency(Path.read_text)  # type: ignore
+    Path.write_text = with_latency(Path.write_text)  # type: ignore
+
+
+def run(repo_path: Path, run_path: Path, workers: int, io_workers: int):
+    shutil.rmtree(run_path, ignore_errors=True)
+    shutil.copytree(repo_path, run_path)
+    paths = sorted(run_path.glob("**/*.py"))
+    process = partial(process_path, defer_write=io_workers > 0)
+
+    start = time.perf_counter()
+    pipeline = None
+    if io_workers > 0:
+        lookahead = LOOKAHEAD_PER_WORKER * (workers + io_workers)
+        pipeline = IOPipeline(paths, io_workers, lookahead)
+    try:
+        results = list(iter_results(process, paths, False, Executor.FORK, workers, None, pipeline))
+    finally:
+        if pipeline is not None:
+            pipeline.close()
+    seconds = time.perf_counter() - start
+
+    if any(result.is_failed for result in results):
+        raise click.ClickException("Some files failed to format")
+    return seconds, pipeline
+
+
+@click.command()
+@click.option("--files", type=click.IntRange(min=1), default=200)
+@click.option("--workers", type=click.IntRange(min=1), default=2)
+@click.option("--io-workers", type=click.IntRange(min=1), default=4)
+@click.option("--latency-ms", type=click.FloatRange(min=0), default=20.0)
+@click.option("--repeat", type=click.IntRange(min=1), default=3)
+@click.option("--seed", type=int, default=0)
+def main(files, workers, io_workers, latency_ms, repeat, seed):
+    add_latency(latency_ms / 1000)
+
+    with tempfile.TemporaryDirectory() as temp_path_str:
+        repo_path = Path(temp_path_str) / "repo"
+        build_synthetic_repo(repo_path, files, seed)
+        run_path = Path(temp_path_str) / "run"
+        click.echo(f"{files} files, {workers} workers, {latency_ms:g}ms per I/O, best of {repeat}")
+
+        for name, run_io_workers in [("I/O in workers", 0), ("I/O pipeline", io_workers)]:
+            best_seconds, best_pipeline = min(
+                (run(repo_path, run_path, workers, run_io_workers) for _ in range(repeat)),
+                key=lambda timing: timing[0],
+            )
+            click.echo(f"{name:>16}: {best_seconds:.2f}s")
+            if best_pipeline is not None:
+                click.echo(f"{'':>16}  {best_pipeline.stats.get_report()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Cost of the structural predicates finding dotted chains and size one tuples to cover, on inputs
+where serializing subtrees (e.g. with `get_code()`) would be quadratic:
+ - a data literal with `--size` elements, nested in a call
+ - a chain of `--calls` method calls, as in pandas, each with a small chain as argument
+
+Usage (from the root of the repo):
+
+    python -m benchmarks.predicates [--size 10000] [--calls 200] [--repeat 5]
+
+The tree is parsed once, and we time the visit of all candidates with the predicates (without
+covering), and the full cover passes (on a fresh tree, excluding the parse)
+"""
+import time
+
+import click
+import parso
+
+from benchmarks.common import best_of
+from globality_black.common import SyntaxTreeVisitor, find_fmt_off_regions
+from globality_black.constants import ALL_FEATURES, DOTTED_CHAIN_TYPES, TUPLE_TYPES
+from globality_black.dotted_chains import is_dotted_chain
+from globality_black.reformat_text import _cover_with_parso
+from globality_black.tuples import is_size_one_exploded_tuple
+
+
+def build_literal(size: int) -> str:
+    elements = "".join(f"        ({index}, {{'key': [{index}, '{index}']}}),\n" for index in range(size))
+    return f"data = frame(\n    (\n{elements}    ),\n)\n"
+
+
+def build_chain(calls: int) -> str:
+    lines = ["result = (", "    df"]
+    for index in range(calls):
+        lines += [
+            f"    .method_{index}(",
+            "        (",
+            f"            other_{index}",
+            "            .fillna(0)",
+            "            .sum(),",
+            "        ),",
+            "    )",
+        ]
+    return "\n".join(lines + [")", ""])
+
+
+def time_predicates(code: str, repeat: int):
+    module = parso.parse(code)
+    fmt_off_regions = find_fmt_off_regions(module, code)
+
+    def run_predicates():
+        for element in SyntaxTreeVisitor(module, DOTTED_CHAIN_TYPES, fmt_off_regions)(module):
+            is_dotted_chain(element)
+        for element in SyntaxTreeVisitor(module, TUPLE_TYPES, fmt_off_regions)(module):
+            is_size_one_exploded_tuple(element)
+
+    def run_cover():
+        module = parso.parse(code)
+        start = time.perf_counter()
+        _cover_with_parso(module, find_fmt_off_regions(module, code), ALL_FEATURES)
+        return time.perf_counter() - start
+
+    predicates_seconds = best_of(run_predicates, repeat)
+    cover_seconds = min(run_cover() for _ in range(repeat))
+    return predicates_seconds, cover_seconds
+
+
+@click.command()
+@click.option("--size", type=int, default=10_000)
+@click.option("--calls", type=int, default=200)
+@click.option("--repeat", type=int, default=5)
+def main(size, calls, repeat):
+    for name, code in [
+        (f"{size}-element literal", build_literal(size)),
+        (f"{calls}-call chain", build_chain(calls)),
+    ]:
+        predicates_seconds, cover_seconds = time_predicates(code, repeat)
+        click.echo(
+            f"{name:>24}: predicates {predicates_seconds:.4f}s, "
+            f"cover passes {cover_seconds:.4f}s ({len(code)} characters)"
+        )
+
+
+if __name__ == "__main__":
+    main()
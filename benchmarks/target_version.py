@@ -0,0 +1,50 @@
+"""
+Cost of black inferring the target versions of each file, saved by setting `target-version` in
+the `[tool.black]` table of pyproject.toml (or `requires-python`, from which black infers it)
+
+Without target versions, black parses each file with every grammar until one succeeds, and
+visits its tree to find the language features it uses. We time the formatting of the fixture
+inputs, concatenated `--copies` times, with and without target versions, both with black alone
+and with globality-black
+
+Usage (from the root of the repo):
+
+    python -m benchmarks.target_version [--copies 20] [--repeat 5]
+"""
+import black
+import click
+
+from benchmarks.common import best_of, build_big_file
+from globality_black.constants import DEFAULT_BLACK_LINE_LENGTH
+from globality_black.reformat_text import reformat_text
+
+
+@click.command()
+@click.option("--copies", type=click.IntRange(min=1), default=20)
+@click.option("--repeat", type=click.IntRange(min=1), default=5)
+def main(copies, repeat):
+    code = build_big_file(copies)
+    target_versions = {black.TargetVersion.PY38, black.TargetVersion.PY39}
+    inferred_mode = black.Mode(line_length=DEFAULT_BLACK_LINE_LENGTH)
+    explicit_mode = black.Mode(
+        line_length=DEFAULT_BLACK_LINE_LENGTH,
+        target_versions=target_versions,
+    )
+    assert reformat_text(code, inferred_mode) == reformat_text(code, explicit_mode)
+
+    click.echo(f"{len(code)} characters")
+    for name, format_code in [
+        ("black", lambda code, mode: black.format_str(code, mode=mode)),
+        ("globality-black", reformat_text),
+    ]:
+        inferred_seconds = best_of(lambda: format_code(code, inferred_mode), repeat)
+        explicit_seconds = best_of(lambda: format_code(code, explicit_mode), repeat)
+        click.echo(
+            f"{name:>16}: inferred target versions {inferred_seconds:.3f}s, "
+            f"explicit {explicit_seconds:.3f}s "
+            f"({1 - explicit_seconds / inferred_seconds:.1%} saved)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+End-to-end throughput of the CLI, scaling with the number of workers
+
+A synthetic repo (see `build_synthetic_repo`) is formatted by running `globality-black` in a
+subprocess, i.e. including interpreter startup and imports, with 1 to `max-workers` workers, in
+check and write modes. For each run we report:
+ - files per second (wall time)
+ - p50 / p95 per-file latency, i.e. time spent formatting each file, read from the summary
+
+We also time a few files formatted serially vs in a pool of processes, next to the executor
+chosen by the cost model of executors.py, to check it.
+
+Usage (from the root of the repo):
+
+    python -m benchmarks.throughput [--files 2000] [--max-workers N] [--repeat 3]
+        [--output results.json] [--baseline baseline.json] [--tolerance 0.1]
+
+Results are written as JSON with --output. Given the results of a previous run with --baseline,
+runs whose throughput drops, or whose p95 latency grows, by more than --tolerance are reported
+as regressions (with exit code 1)
+"""
+import json
+import multiprocessing as mp
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+import black
+import click
+
+from benchmarks.common import best_of, build_synthetic_repo
+from globality_black.cli import iter_results, process_path
+from globality_black.constants import Executor
+from globality_black.executors import get_process_executor, select_executor
+from globality_black.summary import Summary
+
+
+MODES = ("check", "write")
+THRESHOLD_FILE_COUNTS = (1, 2, 5, 10, 20, 50)
+
+
+@click.command()
+@click.option("--files", type=click.IntRange(min=1), default=2000)
+@click.option("--max-workers", type=click.IntRange(min=1), default=mp.cpu_count())
+@click.option("--repeat", type=click.IntRange(min=1), default=3)
+@click.option("--seed", type=int, default=0)
+@click.option("--output", type=click.Path(dir_okay=False, writable=True), default=None)
+@click.option("--baseline", type=click.Path(exists=True, dir_okay=False), default=None)
+@click.option("--tolerance", type=click.FloatRange(min=0), default=0.1)
+def main(files, max_workers, repeat, seed, output, baseline, tolerance):
+    results = {
+        "metadata": {
+            "files": files,
+            "seed": seed,
+            "repeat": repeat,
+            "cpu_count": mp.cpu_count(),
+            "python": platform.python_version(),
+            "black": black.__version__,
+        },
+        "runs": [],
+        "parallel_threshold": [],
+    }
+
+    with tempfile.TemporaryDirectory() as temp_path_str:
+        repo_path = Path(temp_path_str) / "repo"
+        build_synthetic_repo(repo_path, files, seed)
+        click.echo(f"{files} files, best of {repeat}")
+
+        for mode in MODES:
+            for workers in range(1, max_workers + 1):
+                run = measure_run(repo_path, Path(temp_path_str), mode, workers, repeat)
+                results["runs"].append(run)
+                click.echo(
+                    f"{mode:>5}, {workers:>2} workers: {run['files_per_second']:8.1f} files/s, "
+                    f"p50 {run['p50_ms']:7.1f}ms, p95 {run['p95_ms']:7.1f}ms"
+                )
+
+        click.echo("Serial vs pool, and executor chosen by the cost model")
+        paths = sorted(repo_path.glob("**/*.py"))
+        for file_count in THRESHOLD_FILE_COUNTS:
+            timing = measure_threshold(paths[:file_count], max(max_workers, 2), repeat)
+            results["parallel_threshold"].append(timing)
+            click.echo(
+                f"{file_count:>4} files: serial {timing['serial_seconds']:.3f}s, "
+                f"pool {timing['pool_seconds']:.3f}s, chosen: {timing['selected_executor']}"
+            )
+
+    if output is not None:
+        Path(output).write_text(json.dumps(results, indent=2))
+
+    if baseline is not None:
+        regressions = compare(results, json.loads(Path(baseline).read_text()), tolerance)
+        for regression in regressions:
+            click.echo(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        click.echo(f"No regressions against {baseline} (tolerance {tolerance:.0%})")
+
+
+def measure_run(repo_path: Path, temp_path: Path, mode: str, workers: int, repeat: int) -> Dict:
+    """
+    Run the CLI `repeat` times on a fresh copy of the repo, keeping the fastest run
+    """
+
+    best_seconds, best_durations = float("inf"), []
+    for _ in range(repeat):
+        run_path = temp_path / "run"
+        shutil.rmtree(run_path, ignore_errors=True)
+        shutil.copytree(repo_path, run_path)
+        summary_path = temp_path / "summary.json"
+
+        args = [sys.executable, "-m", "globality_black.cli", str(run_path)]
+        args += ["--workers", str(workers), "--summary-output", str(summary_path)]
+        if workers > 1:
+            # measure the scaling, whatever the choice of the cost model
+            args += ["--executor", get_process_executor().value]
+        if mode == "check":
+            args.append("--check")
+
+        start = time.perf_counter()
+        subprocess.run(args, stdout=subprocess.DEVNULL, check=False)
+        seconds = time.perf_counter() - start
+
+        summary = Summary.read(summary_path)
+        if summary.failed_count:
+            raise click.ClickException(f"{summary.failed_count} files failed to format")
+        if seconds < best_seconds:
+            best_seconds, best_durations = seconds, list(summary.durations.values())
+
+    return {
+        "mode": mode,
+        "workers": workers,
+        "seconds": best_seconds,
+        "files_per_second": len(best_durations) / best_seconds,
+        "p50_ms": 1000 * percentile(best_durations, 50),
+        "p95_ms": 1000 * percentile(best_durations, 95),
+    }
+
+
+def measure_threshold(paths: List[Path], workers: int, repeat: int) -> Dict:
+    """
+    Time checking a few files in the current process vs in a pool of `workers` processes,
+    including the start of the pool
+    """
+
+    process = partial(process_path, check_only_mode=True)
+    process_executor = get_process_executor()
+    selected_executor, _ = select_executor([path.stat().st_size for path in paths], workers)
+
+    def run(executor: Executor):
+        list(iter_results(process, paths, False, executor, workers))
+
+    return {
+        "files": len(paths),
+        "serial_seconds": best_of(lambda: run(Executor.SERIAL), repeat),
+        "pool_seconds": best_of(lambda: run(process_executor), repeat),
+        "selected_executor": selected_executor.value,
+    }
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    Regressions of `results` with respect to `baseline`, comparing runs of the same mode and
+    number of workers
+    """
+
+    baseline_runs: Dict[Tuple[str, int], Dict] = {
+        (run["mode"], run["workers"]): run
+        for run in baseline["runs"]
+    }
+
+    regressions = []
+    for run in results["runs"]:
+        baseline_run: Optional[Dict] = baseline_runs.get((run["mode"], run["workers"]))
+        if baseline_run is None:
+            continue
+
+        name = f"{run['mode']} with {run['workers']} workers"
+        if run["files_per_second"] < baseline_run["files_per_second"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: {run['files_per_second']:.1f} files/s, "
+                f"baseline {baseline_run['files_per_second']:.1f} files/s"
+            )
+        if run["p95_ms"] > baseline_run["p95_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: p95 {run['p95_ms']:.1f}ms, baseline {baseline_run['p95_ms']:.1f}ms"
+            )
+
+    return regressions
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile"""
+
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(int(round(q / 100 * len(ordered))) - 1, 0)
+    return ordered[index]
+
+
+if __name__ == "__main__":
+    main()
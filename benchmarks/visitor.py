@@ -0,0 +1,49 @@
+"""
+Measure the cost per node of traversing a parso tree with SyntaxTreeVisitor, on the fixtures and
+on nested literals of increasing depth
+
+Usage (from the root of the repo):
+
+    python -m benchmarks.visitor [--copies 20] [--repeat 5]
+"""
+import click
+import parso
+
+from benchmarks.common import best_of, build_big_file, get_build
+from globality_black.common import SyntaxTreeVisitor
+from globality_black.constants import BLANK_LINES_TYPES
+
+
+NESTING_DEPTHS = [10, 100, 200, 1000]
+
+
+def build_nested_literals(depth: int, count: int) -> str:
+    """`count` dicts nested `depth` levels each, e.g. `x = {"a": {"a": 1}}` for depth 2"""
+    literal = '{"a": ' * depth + "1" + "}" * depth
+    return "".join(f"x{index} = {literal}\n" for index in range(count))
+
+
+@click.command()
+@click.option("--copies", type=int, default=20)
+@click.option("--repeat", type=int, default=5)
+def main(copies, repeat):
+    click.echo(f"best of {repeat}, {get_build()} build")
+
+    sources = {"fixtures": build_big_file(copies)}
+    for depth in NESTING_DEPTHS:
+        sources[f"nesting {depth}"] = build_nested_literals(depth, count=20_000 // depth)
+
+    for name, source in sources.items():
+        module = parso.parse(source)
+        visitor = SyntaxTreeVisitor(module, BLANK_LINES_TYPES)
+        try:
+            node_count = sum(1 for _ in SyntaxTreeVisitor(module)(module))
+            timing = best_of(lambda: sum(1 for _ in visitor(module)), repeat)
+        except RecursionError:
+            click.echo(f"{name:>12}: RecursionError")
+            continue
+        click.echo(f"{name:>12}: {node_count} nodes, {1e9 * timing / node_count:.0f} ns/node")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,125 @@
+import dataclasses
 from functools import lru_cache
 from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Optional,
+    Tuple,
+)
 
 import black
 
+from globality_black.config import InvalidConfigError
 from globality_black.constants import DEFAULT_BLACK_LINE_LENGTH
 
 
-@lru_cache(maxsize=1)
 def get_black_mode(src: Path) -> black.Mode:
     """Read the black configuration from pyproject.toml"""
 
-    value = black.find_pyproject_toml((str(src),))
+    return read_black_mode(black.find_pyproject_toml((str(src),)) or None)
 
-    if not value:
+
+@lru_cache(maxsize=None)
+def read_black_mode(pyproject_path: Optional[str]) -> black.Mode:
+    """Black mode from the given pyproject.toml, read once per process"""
+
+    if pyproject_path is None:
         return black.Mode(line_length=DEFAULT_BLACK_LINE_LENGTH)
 
-    config = black.parse_pyproject_toml(value)
+    try:
+        config = black.parse_pyproject_toml(pyproject_path)
+    except (OSError, ValueError) as e:
+        raise InvalidConfigError(f"Cannot read {pyproject_path}. {e}")
+
+    try:
+        return parse_black_mode(config)
+    except InvalidConfigError as e:
+        raise InvalidConfigError(f"Invalid [tool.black] table in {pyproject_path}. {e}")
+
+
+def parse_black_mode(config: Dict[str, Any]) -> black.Mode:
+    """
+    Black mode from the options of the `[tool.black]` table, as normalized by black (e.g.
+    `target-version` is read as `target_version`), mapped as black does for its own options
+
+    Options about which files to format (include, exclude, ...) or how to run black are ignored.
+    Note that the target versions are inferred from `requires-python` if not set. With target
+    versions, black does not have to infer the language features used in each file
+    """
+
+    mode_fields = {field.name for field in dataclasses.fields(black.Mode)}
+    kwargs: Dict[str, Any] = {"line_length": DEFAULT_BLACK_LINE_LENGTH}
+
+    for option, value in config.items():
+        if option not in MODE_OPTIONS:
+            continue
+
+        field_name, parse_value = MODE_OPTIONS[option]
+        if field_name not in mode_fields:
+            raise InvalidConfigError(f"{option} is not supported by black {black.__version__}")
+        kwargs[field_name] = parse_value(option, value)
+
+    return black.Mode(**kwargs)
+
+
+def parse_bool(option: str, value: Any) -> bool:
+    if not isinstance(value, bool):
+        raise InvalidConfigError(f"{option} must be true or false, not {value!r}")
+    return value
+
+
+def parse_negated_bool(option: str, value: Any) -> bool:
+    return not parse_bool(option, value)
+
+
+def parse_line_length(option: str, value: Any) -> int:
+    if isinstance(value, bool) or not isinstance(value, int) or value <= 0:
+        raise InvalidConfigError(f"{option} must be a positive integer, not {value!r}")
+    return value
+
+
+def parse_names(option: str, value: Any) -> Tuple[str, ...]:
+    if not isinstance(value, list) or not all(isinstance(name, str) for name in value):
+        raise InvalidConfigError(f"{option} must be a list of strings, not {value!r}")
+    return tuple(value)
+
+
+def parse_target_versions(option: str, value: Any) -> set:
+    names = parse_names(option, value)
+    try:
+        return {black.TargetVersion[name.upper()] for name in names}
+    except KeyError as e:
+        valid_names = ", ".join(version.name.lower() for version in black.TargetVersion)
+        raise InvalidConfigError(f"Unknown {option} {e}, target versions are: {valid_names}")
+
+
+def parse_cell_magics(option: str, value: Any) -> set:
+    return set(parse_names(option, value))
+
+
+def parse_preview_features(option: str, value: Any) -> set:
+    names = parse_names(option, value)
+    try:
+        return {black.mode.Preview[name] for name in names}
+    except KeyError as e:
+        raise InvalidConfigError(f"Unknown {option} {e}")
+
 
-    return black.Mode(**{
-        key: value
-        for key, value in config.items()
-    })
+# options of `[tool.black]` setting the black mode: field of black.Mode they set, and how to parse
+# them. Fields missing in older (newer) versions of black fail when set (are never set)
+MODE_OPTIONS: Dict[str, Tuple[str, Callable[[str, Any], Any]]] = {
+    "line_length": ("line_length", parse_line_length),
+    "target_version": ("target_versions", parse_target_versions),
+    "pyi": ("is_pyi", parse_bool),
+    "ipynb": ("is_ipynb", parse_bool),
+    "python_cell_magics": ("python_cell_magics", parse_cell_magics),
+    "skip_source_first_line": ("skip_source_first_line", parse_bool),
+    "skip_string_normalization": ("string_normalization", parse_negated_bool),
+    "skip_magic_trailing_comma": ("magic_trailing_comma", parse_negated_bool),
+    "experimental_string_processing": ("experimental_string_processing", parse_bool),
+    "preview": ("preview", parse_bool),
+    "unstable": ("unstable", parse_bool),
+    "enable_unstable_feature": ("enabled_features", parse_preview_features),
+}
@@ -0,0 +1,275 @@
+"""
+Post-processing engine working on black's own syntax tree (blib2to3), as an alternative to
+reparsing the output of black with parso
+
+It applies the same post-processing as the parso engine in reformat_text:
+ - explode comprehensions, see comprehensions.py for the rules
+ - uncover the lines protected in pre-processing, see blank_lines.py, dotted_chains.py and
+ tuples.py
+
+Node types are mapped from parso to blib2to3 as follows:
+
+    sync_comp_for   -> comp_for, old_comp_for
+    comp_if         -> comp_if, old_comp_if
+    testlist_comp   -> listmaker, testlist_gexp
+    dictorsetmaker  -> dictsetmaker
+
+blib2to3 keeps the comments found before a dedent in the prefix of zero-width DEDENT leaves,
+whereas parso moves them to the next leaf. Hence, for `fmt: off` / `fmt: on`, we look at the
+prefix of the first leaf of a statement together with the prefixes of the zero-width leaves
+right before it.
+"""
+from bisect import bisect_left
+from typing import (
+    FrozenSet,
+    List,
+    Optional,
+    Tuple,
+)
+
+import black
+from blib2to3 import pygram
+from blib2to3.pgen2 import token
+from blib2to3.pytree import Leaf, Node
+
+from globality_black.blank_lines import remove_token_from_covered_line
+from globality_black.common import get_indent_from_prefix
+from globality_black.constants import (
+    ALL_FEATURES,
+    TAB_CHAR_SIZE,
+    TYPES_TO_CHECK_FMT_ON_OFF,
+    Feature,
+)
+from globality_black.dotted_chains import remove_token_from_covered_dotted_chain_line
+from globality_black.stats import COMPREHENSIONS_EXPLODED, count
+from globality_black.trace import span
+from globality_black.tuples import remove_token_from_covered_tuple
+
+
+SYMBOLS = pygram.python_symbols
+
+COMP_FOR_TYPES = {SYMBOLS.comp_for, SYMBOLS.old_comp_for}
+COMP_IF_TYPES = {SYMBOLS.comp_if, SYMBOLS.old_comp_if}
+LIST_COMP_TYPES = {SYMBOLS.listmaker, SYMBOLS.testlist_gexp}
+COMPREHENSION_TYPES = LIST_COMP_TYPES | {SYMBOLS.dictsetmaker}
+FMT_ON_OFF_TYPES = {
+    number
+    for name, number in pygram.python_grammar.symbol2number.items()
+    if any(type_name in name for type_name in TYPES_TO_CHECK_FMT_ON_OFF)
+}
+
+Position = Tuple[int, int]
+
+
+def postprocess_black_tree(
+    code_after_black: str,
+    black_mode: black.Mode,
+    features: FrozenSet[Feature] = ALL_FEATURES,
+) -> str:
+    """
+    Parse black's output with black's own parser and apply the post-processing steps of the
+    given features on it
+    """
+
+    if not code_after_black:
+        return code_after_black
+
+    with span("reparse"):
+        tree = black.lib2to3_parse(code_after_black, black_mode.target_versions)
+    comp_fors, leaves = find_enabled_nodes(tree, check_fmt_on_off="fmt:" in code_after_black)
+
+    # comprehensions first, so that the prefixes still contain the sentinels (as in parso)
+    if Feature.COMPREHENSIONS in features:
+        with span("explode comprehensions"):
+            line_start_finder = LineStartLeafFinder(tree)
+            for comp_for in comp_fors:
+                reformat_comprehension(comp_for, line_start_finder)
+
+    # uncover lines protected during pre-processing, all features in one pass
+    with span("uncover"):
+        for leaf in leaves:
+            if "#" in leaf.prefix:
+                leaf.prefix = uncover_prefix(leaf.prefix, features)
+
+    return str(tree)
+
+
+def find_enabled_nodes(tree: Node, check_fmt_on_off: bool) -> Tuple[List[Node], List[Leaf]]:
+    """
+    Traverse the tree in pre-order skipping `fmt: off` regions, and return the comprehension
+    candidates and all leaves in order
+    """
+
+    comp_fors, leaves = [], []
+    fmt_off = False
+    stack = [tree]
+
+    while stack:
+        node = stack.pop()
+
+        if check_fmt_on_off and node.type in FMT_ON_OFF_TYPES:
+            prefix = get_prefix_for_fmt_on_off(node)
+            if "fmt: off" in prefix:
+                fmt_off = True
+            if "fmt: on" in prefix:
+                fmt_off = False
+
+        if fmt_off:
+            continue
+
+        if isinstance(node, Leaf):
+            leaves.append(node)
+            continue
+
+        if node.type in COMP_FOR_TYPES:
+            comp_fors.append(node)
+
+        stack.extend(reversed(node.children))
+
+    return comp_fors, leaves
+
+
+def uncover_prefix(prefix: str, features: FrozenSet[Feature] = ALL_FEATURES) -> str:
+    if Feature.BLANK_LINES in features:
+        prefix = remove_token_from_covered_line(prefix)
+    if Feature.DOTTED_CHAINS in features:
+        prefix = remove_token_from_covered_dotted_chain_line(prefix)
+    if Feature.TUPLES in features:
+        prefix = remove_token_from_covered_tuple(prefix)
+    return prefix
+
+
+def reformat_comprehension(comp_for: Node, line_start_finder: "LineStartLeafFinder"):
+    """
+    Same as comprehensions.reformat_comprehension, see the docstring there
+    """
+
+    comp = comp_for.parent
+    is_dict = comp.type == SYMBOLS.dictsetmaker and is_leaf_with_value(comp.children[1], ":")
+    value_is_comprehension = any(
+        child.type in LIST_COMP_TYPES
+        for child in comp.children[0].children
+    )
+    parent_is_for = comp.type in COMP_FOR_TYPES
+
+    last_child = comp_for.children[-1]
+    ends_with_if = last_child.type in COMP_IF_TYPES
+    ends_with_for = last_child.type in COMP_FOR_TYPES
+
+    value_is_ternary_expression = comp.children[0].type == SYMBOLS.test
+
+    nested_comp = comp.parent.parent.type in COMPREHENSION_TYPES
+
+    requirements = is_dict or ends_with_if or ends_with_for
+    requirements = requirements or value_is_ternary_expression or value_is_comprehension
+    can_be_ignored = parent_is_for or nested_comp
+
+    if requirements and not can_be_ignored:
+        _reformat_comprehension(comp_for, line_start_finder)
+
+
+def _reformat_comprehension(comp_for: Node, line_start_finder: "LineStartLeafFinder"):
+    count(COMPREHENSIONS_EXPLODED)
+    comp = comp_for.parent
+    line = get_first_leaf(comp.parent).lineno
+    prefix = line_start_finder.find(line).prefix
+    base_indent = get_indent_from_prefix(prefix)
+    new_prefix = "\n" + base_indent + " " * TAB_CHAR_SIZE
+
+    # indent element of comp
+    set_prefix(comp, new_prefix)
+
+    # indent for in comprehension + all for and if underneath (chained as last children)
+    element = comp_for
+    while True:
+        set_prefix(element, new_prefix)
+        element = element.children[-1]
+        if element.type not in COMP_IF_TYPES | COMP_FOR_TYPES:
+            break
+
+    # set closing bracket
+    set_prefix(comp.parent.children[-1], "\n" + base_indent)
+
+
+def set_prefix(element, prefix: str):
+    leaf = get_first_leaf(element)
+
+    # if there's only space, replace
+    if not leaf.prefix.strip():
+        leaf.prefix = prefix
+
+    # otherwise, add prefix to previous prefix (to keep comments)
+    else:
+        last_eol_position = leaf.prefix.rindex("\n")
+        leaf.prefix = leaf.prefix[:last_eol_position] + prefix
+
+
+class LineStartLeafFinder:
+    """
+    Find the leaf at the start of a given line, i.e. the first leaf ending at or after the start
+    of that line. This is the equivalent of `module.get_leaf_for_position(include_prefixes=True)`
+    as used in common.find_indentation_parent_prefix.
+
+    Positions are those from parsing, i.e. they are not updated when modifying prefixes, as in
+    parso. The index is built lazily, since most files do not have comprehensions to explode.
+    """
+
+    def __init__(self, tree: Node):
+        self.tree = tree
+        self.end_positions: Optional[List[Position]] = None
+        self.leaves: List[Leaf] = []
+
+    def find(self, line: int) -> Leaf:
+        if self.end_positions is None:
+            self.leaves = [
+                leaf
+                for leaf in self.tree.leaves()
+                if leaf.value and leaf.type != token.NEWLINE
+            ]
+            self.end_positions = [get_end_position(leaf) for leaf in self.leaves]
+
+        return self.leaves[bisect_left(self.end_positions, (line, 0))]
+
+
+def get_end_position(leaf: Leaf) -> Position:
+    lines = leaf.value.split("\n")
+    if len(lines) == 1:
+        return leaf.lineno, leaf.column + len(leaf.value)
+    return leaf.lineno + len(lines) - 1, len(lines[-1])
+
+
+def get_first_leaf(node) -> Leaf:
+    while not isinstance(node, Leaf):
+        node = node.children[0]
+    return node
+
+
+def get_previous_leaf(leaf: Leaf) -> Optional[Leaf]:
+    node = leaf
+    while node.prev_sibling is None:
+        node = node.parent
+        if node is None:
+            return None
+
+    node = node.prev_sibling
+    while not isinstance(node, Leaf):
+        node = node.children[-1]
+    return node
+
+
+def get_prefix_for_fmt_on_off(node: Node) -> str:
+    """
+    Prefix of the first leaf, including those of the zero-width leaves (INDENT / DEDENT) before it
+    """
+
+    leaf = get_first_leaf(node)
+    prefix = leaf.prefix
+    previous = get_previous_leaf(leaf)
+    while previous is not None and not previous.value and previous.type != token.ENDMARKER:
+        prefix = previous.prefix + prefix
+        previous = get_previous_leaf(previous)
+    return prefix
+
+
+def is_leaf_with_value(node, value: str) -> bool:
+    return isinstance(node, Leaf) and node.value == value
@@ -19,15 +19,18 @@ graph.use(
 """
 import re
 
+from parso.python.tree import Module
+from parso.tree import NodeOrLeaf
+
 from globality_black.common import apply_function_to_tree_prefixes
 from globality_black.constants import BLANK_LINE_TOKEN
 
 
-def cover_blank_lines(module, root):
+def cover_blank_lines(module: Module, root: NodeOrLeaf) -> None:
     apply_function_to_tree_prefixes(module, root, add_token_if_line_to_keep)
 
 
-def add_token_if_line_to_keep(prefix):
+def add_token_if_line_to_keep(prefix: str) -> str:
     # Add a token when two or more new lines (optionally with spaces in them)
     # We use " " and not "\s" since the latter denotes any whitespace character, included \r,\n, etc
     return re.sub(
@@ -37,7 +40,7 @@ def add_token_if_line_to_keep(prefix):
     )
 
 
-def uncover_blank_lines(module, root):
+def uncover_blank_lines(module: Module, root: NodeOrLeaf) -> None:
     apply_function_to_tree_prefixes(
         module,
         root,
@@ -45,7 +48,7 @@ def uncover_blank_lines(module, root):
     )
 
 
-def remove_token_from_covered_line(prefix):
+def remove_token_from_covered_line(prefix: str) -> str:
     # Note that black will add spaces before the token
 
     return re.sub(
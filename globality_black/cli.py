@@ -1,37 +1,201 @@
 """Console script for globality_black."""
-import multiprocessing as mp
 import sys
-from functools import partial
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+from contextlib import ExitStack
+from functools import partial, reduce
 from pathlib import Path
-from typing import Tuple
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    cast,
+)
 
 import click
 
 from globality_black.black_handler import get_black_mode
+from globality_black.config import InvalidConfigError, get_features
 from globality_black.constants import (
     ALL_DONE_STRING,
-    NUM_FILES_TO_ENABLE_PARALLELIZATION,
+    DEFAULT_OUTPUT_STORE_MAX_SIZE_MB,
     OH_NO_STRING,
+    Executor,
+    Feature,
+    PostProcessingEngine,
+    PreProcessingEngine,
+)
+from globality_black.diff import format_diff_report, text_diff
+from globality_black.executors import get_process_context, iter_in_threads, resolve_executor
+from globality_black.git_source import (
+    GitBlobReader,
+    GitError,
+    GitFile,
+    list_git_files,
+)
+from globality_black.imports import get_isort_config
+from globality_black.io_pipeline import LOOKAHEAD_PER_WORKER, IOPipeline, Source
+from globality_black.output_store import get_store_key, open_output_store
+from globality_black.reformat_text import BlackError, assert_safe_reformat, reformat_text
+from globality_black.sharding import parse_shard, select_shard
+from globality_black.stats import format_counters, record_counters
+from globality_black.summary import FailureKind, Summary
+from globality_black.trace import (
+    Span,
+    get_worker_id,
+    record_spans,
+    span,
+    write_trace,
 )
-from globality_black.diff import text_diff
-from globality_black.reformat_text import BlackError, reformat_text
+from globality_black.workers import WorkerFailure, WorkerPool
+
+
+# small code going through all steps of reformat_text
+WARM_UP_CODE = "values = [\n    value\n\n    for value in (1,)\n]\n"
+FAILURE_LABELS = {
+    FailureKind.BLACK: "failed to parse (black error)",
+    FailureKind.CONFIG: "failed to load their configuration",
+    FailureKind.READ: "failed to be read",
+    FailureKind.WORKER: "failed in a worker process (timed out, died or raised an error)",
+}
+
+
+class ProcessPathResult(NamedTuple):
+    is_modified: bool
+    is_failed: bool
+    message: str
+    format_seconds: float = 0.0
+    verify_seconds: float = 0.0
+    path: Optional[Path] = None
+    # unified diff, only in diff mode and if modified
+    diff: str = ""
+    # whether the output was found in the output store
+    from_store: bool = False
+    # only with --trace-out, see trace.py
+    spans: Tuple[Span, ...] = ()
+    # reformatted code left to write back, only with --io-workers (see io_pipeline.py)
+    output_code: Optional[str] = None
+    # work counters as (name, value) pairs, only with --stats (see stats.py)
+    counters: Tuple[Tuple[str, int], ...] = ()
+    # why the file failed, if it did (black error by default)
+    failure: Optional[FailureKind] = None
+
+
+def validate_shard(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        return parse_shard(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
 
 
 @click.command()
-@click.argument("path", type=click.Path(readable=True, writable=True, exists=True))
+@click.argument(
+    "paths",
+    nargs=-1,
+    required=True,
+    # validated in main, since with --git-rev paths are pathspecs, not necessarily on disk
+    type=click.Path(),
+)
 @click.option("--check/--no-check", type=bool, default=False)
 @click.option("--verbose/--no-verbose", type=bool, default=False)
 @click.option("--diff/--no-diff", type=bool, default=False)
+@click.option("--diff-output", type=click.Path(dir_okay=False, writable=True), default=None)
+@click.option("--safe/--fast", type=bool, default=False)
+@click.option("--fail-fast/--no-fail-fast", type=bool, default=False)
+@click.option("--shard", type=str, default=None, callback=validate_shard)
+@click.option(
+    "--shard-durations",
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+)
+@click.option(
+    "--summary-output",
+    type=click.Path(dir_okay=False, writable=True),
+    default=None,
+)
+@click.option(
+    "--post-engine",
+    type=click.Choice([engine.value for engine in PostProcessingEngine]),
+    default=PostProcessingEngine.PARSO.value,
+)
+@click.option(
+    "--pre-engine",
+    type=click.Choice([engine.value for engine in PreProcessingEngine]),
+    default=PreProcessingEngine.PARSO.value,
+)
+@click.option(
+    "--store",
+    type=click.Path(dir_okay=False, writable=True),
+    default=None,
+    envvar="GLOBALITY_BLACK_STORE",
+)
+@click.option(
+    "--store-max-size",
+    type=click.IntRange(min=1),
+    default=DEFAULT_OUTPUT_STORE_MAX_SIZE_MB,
+)
+@click.option(
+    "--disable",
+    type=click.Choice([feature.value for feature in Feature]),
+    multiple=True,
+)
+@click.option("--sort-imports", is_flag=True, default=False)
+@click.option("--workers", type=click.IntRange(min=1), default=None)
+@click.option("--timeout-per-file", type=click.FloatRange(min=0, min_open=True), default=None)
+@click.option(
+    "--executor",
+    type=click.Choice([executor.value for executor in Executor]),
+    default=Executor.AUTO.value,
+)
+@click.option("--trace-out", type=click.Path(dir_okay=False, writable=True), default=None)
+@click.option("--io-workers", type=click.IntRange(min=0), default=0)
+@click.option("--git-rev", type=str, default=None)
+@click.option("--stats", is_flag=True, default=False)
 # characters \b needed to avoid click reformatting
 # see https://click.palletsprojects.com/en/7.x/documentation/#preventing-rewrapping
-def main(path, check, diff, verbose):
+def main(
+    paths,
+    check,
+    diff,
+    diff_output,
+    verbose,
+    safe,
+    fail_fast,
+    shard,
+    shard_durations,
+    summary_output,
+    post_engine,
+    pre_engine,
+    store,
+    store_max_size,
+    disable,
+    sort_imports,
+    workers,
+    timeout_per_file,
+    executor,
+    trace_out,
+    io_workers,
+    git_rev,
+    stats,
+):
     """
-    Run globality-black for a given path
+    Run globality-black for the given paths
 
     \b
-    * path:
-        If path is a directory, apply to all .py files in any subdirectory
-        Otherwise, apply just to the given filename.
+    * paths:
+        One or more paths. If a path is a directory, apply to all .py files in any subdirectory.
+        Otherwise, apply just to the given filename. All files are processed in one pool, so
+        prefer a single call with many paths (e.g. from pre-commit or xargs) over one call per file
 
     \b
     * check:
@@ -53,47 +217,608 @@ def main(path, check, diff, verbose):
 
     \b
     * diff:
-        If --diff, do not modify the files and display the changes induced by reformatting
+        If --diff, do not modify the files and display the changes induced by reformatting.
+        Diffs are shown as soon as each file is processed, colored only in a terminal
+
+    \b
+    * diff-output:
+        If --diff-output PATCH_FILE is passed, do not modify the files and write the changes
+        induced by reformatting to PATCH_FILE, as they come. Run `git apply PATCH_FILE` from the
+        same directory to apply them
+
+    \b
+    * safe:
+        If --safe, check that the reformatted code of each file is AST-equivalent to the
+        original code and that reformatting it again leaves it unchanged. Files failing these
+        checks are reported as failed and left untouched.
+        If --fast (default), skip these checks. The time spent formatting and verifying is
+        reported with --verbose, to help choosing between both modes (e.g. --safe in CI)
+
+    \b
+    * fail-fast:
+        If --fail-fast, stop as soon as a file fails or, with --check, would be reformatted,
+        reporting only that file. Useful in CI, where we only need to know whether any file is not
+        correctly formatted
+
+    \b
+    * shard:
+        If --shard i/N is passed, only process the i-th (from 1 to N) of N shards of the files,
+        e.g. to split a full-repo check across N CI jobs. Shards are deterministic and balanced
+        by file size or, with --shard-durations SUMMARY_FILE, by the durations recorded in the
+        summary of a previous run
+
+    \b
+    * summary-output:
+        If --summary-output SUMMARY_FILE is passed, write the summary of the run as JSON. The
+        summaries of several shards can be merged with `globality-black-merge-summaries`
+
+    \b
+    * post-engine:
+        Syntax tree used for post-processing. Both engines produce the same output:
+            - parso (default): reparse the output of black with parso
+            - blib2to3: parse the output of black with black's own (compiled) parser, faster
+
+    \b
+    * pre-engine:
+        How lines to protect from black are found. Both engines produce the same output,
+        except on the few valid files parso mis-parses (e.g. some raw f-strings), where only
+        tokenize protects the lines:
+            - parso (default): build a full parso tree of the input
+            - tokenize: single pass over the tokens of the input, faster. Falls back to parso
+            for code it cannot tokenize, or using syntax that parso does not support
+
+    \b
+    * store:
+        If --store STORE_FILE is passed (or GLOBALITY_BLACK_STORE is set), keep the outputs in
+        STORE_FILE, keyed by the hash of the input code, black mode and formatter version, and
+        reuse them for identical files, whatever their path. The store can be shared by several
+        runs at once and across branches and CI jobs (e.g. as a cache artifact). With --safe,
+        only outputs verified in safe mode are reused.
+        Its size is capped to --store-max-size MB (default 256), dropping the least recently used
+        outputs first
+
+    \b
+    * disable:
+        Features not to apply, e.g. --disable tuples --disable blank-lines, on top of those
+        disabled in the `[tool.globality-black]` table of pyproject.toml with
+        `disable = ["tuples", "blank-lines"]`. Features are:
+            - blank-lines: keep blank lines inside brackets
+            - dotted-chains: keep dotted chains split in several lines
+            - tuples: keep size one tuples in one line
+            - comprehensions: explode comprehensions
+        Disabled features are skipped altogether, i.e. disabling all of them is just black
+
+    \b
+    * sort-imports:
+        If --sort-imports is passed (or `sort-imports = true` is set in the
+        `[tool.globality-black]` table of pyproject.toml), sort imports with isort before black,
+        in the same process. isort must be installed, and is configured as when run on its own
+        (e.g. from `[tool.isort]`). Each file is then read and written once, instead of once
+        per tool
+
+    \b
+    * workers:
+        Number of processes (or threads) formatting files in parallel, by default the number of
+        CPUs minus one (all CPUs for threads). A worker crashing (e.g. out of memory) only fails
+        the file it was formatting, and is replaced
+
+    \b
+    * timeout-per-file:
+        If --timeout-per-file SECONDS is passed, report files taking longer than SECONDS to
+        format as failed, replacing their worker, and go on with the others. Files are then always
+        formatted in worker processes
+
+    \b
+    * executor:
+        How files are formatted:
+            - auto (default): choose from the total size of the files and the number of CPUs,
+            formatting a few small files serially
+            - serial: in the main process
+            - thread: in threads, only faster on free-threaded builds of Python
+            - fork, forkserver, spawn: in worker processes, started with the given method
+        Workers import black and parso and read the configuration when started
+
+    \b
+    * trace-out:
+        If --trace-out TRACE_FILE is passed, write a timeline of the run as Chrome trace events,
+        to be loaded in chrome://tracing or https://ui.perfetto.dev. It has one track per worker,
+        with a span per file (with its path, size and status) split in read, parse, each cover
+        pass, black, reparse, each post-processing pass and write. Gaps show idle workers
+
+    \b
+    * io-workers:
+        If --io-workers N is passed (N > 0), files are read and written by N threads of the main
+        process rather than by the workers: files are read ahead and sent to the workers with
+        their code, and reformatted files are written back while the workers format the next
+        ones. This keeps workers busy on slow (e.g. network-backed) volumes. The time spent on
+        I/O, and how much of it overlapped with formatting, is reported with --verbose. Since
+        forking with I/O threads running is unsafe, worker processes are then started with
+        forkserver rather than fork
+
+    \b
+    * git-rev:
+        If --git-rev REVISION is passed, check the Python files of REVISION (e.g. a commit) in
+        the git repository of the current directory, or of the index (staged files) for
+        --git-rev :, instead of the files on disk, e.g. in a pre-receive hook without worktree.
+        PATHS are pathspecs restricting the files checked, which need not exist on disk, e.g.
+        `--git-rev "$newrev" .` for all of them. Implies --check. Contents are streamed from
+        `git cat-file --batch`, ahead of the workers. The configuration is still read from
+        pyproject.toml on disk, if any
+
+    \b
+    * stats:
+        If --stats is passed, count the work done by the formatter on the files (nodes visited by
+        the syntax tree traversals, sentinels inserted per token, comprehensions exploded, bytes
+        in and out of black, ...), summed over all workers, and show the counters at the end.
+        Files found in the output store count no work
 
     """
 
-    path = Path(path)
-    exit_code = 0
-    if diff:
+    trace_start = time.perf_counter()
+    if diff or diff_output or git_rev is not None:
         check = True
-    if path.is_dir():
-        paths = list(path.glob("**/*.py"))
-    else:
-        paths = [path]
+    if timeout_per_file is not None and executor in ("serial", "thread"):
+        raise click.UsageError(f"Cannot use --timeout-per-file with the {executor} executor")
+    if git_rev is not None and io_workers > 0:
+        raise click.UsageError("Cannot use --io-workers with --git-rev")
+
+    git_files = get_git_files(git_rev, paths) if git_rev is not None else None
+    paths, sizes = select_paths(paths, git_files, shard, shard_durations)
+    executor, workers = resolve_executor(
+        Executor(executor),
+        sizes,
+        workers,
+        timeout_per_file,
+        # I/O threads, see open_io_pipeline
+        threads=io_workers > 0 or git_rev is not None,
+    )
+    if verbose:
+        click.echo(f"Formatting {len(paths)} files ({executor.value}, {workers} workers)")
+
+    summary = Summary(check=check)
+    process_path_with_check = partial(
+        process_path,
+        check_only_mode=check,
+        diff_mode=diff or diff_output is not None,
+        safe_mode=safe,
+        post_engine=PostProcessingEngine(post_engine),
+        pre_engine=PreProcessingEngine(pre_engine),
+        store_path=Path(store) if store else None,
+        store_max_size=store_max_size * 2 ** 20,
+        disabled_features=disable,
+        sort_imports=sort_imports,
+        defer_write=io_workers > 0,
+    )
+    process = process_path_with_check
+    if trace_out is not None:
+        process = partial(trace_process, process)
+    if stats:
+        process = partial(count_process, process)
+    trace_spans: List[Span] = []
+    counters: Counter = Counter()
+    color = sys.stdout.isatty()
+
+    format_start = time.perf_counter()
+    with ExitStack() as stack:
+        pipeline = open_io_pipeline(stack, paths, git_files, io_workers, workers, trace_out)
+        patch_file = stack.enter_context(open(diff_output, "w")) if diff_output else None
+        results = iter_results(
+            process,
+            paths,
+            fail_fast,
+            executor,
+            workers,
+            timeout_per_file,
+            pipeline,
+        )
+        for result in results:
+            echo_result(result, verbose, diff, color)
+            if result.diff and patch_file is not None:
+                patch_file.write(result.diff)
+                patch_file.flush()
+
+            summary.add(result)
+            trace_spans.extend(result.spans)
+            counters.update(dict(result.counters))
+
+            if fail_fast and (result.is_failed or check and result.is_modified):
+                break
+
+    summary.skipped_count = len(paths) - summary.processed_count
+    if summary_output is not None:
+        summary.write(Path(summary_output))
+
+    if trace_out is not None:
+        main_worker = get_worker_id()
+        if pipeline is not None:
+            trace_spans += pipeline.spans
+        trace_spans += [
+            Span("collect paths", trace_start, format_start - trace_start, main_worker, {}),
+            Span(
+                "format",
+                format_start,
+                time.perf_counter() - format_start,
+                main_worker,
+                {"files": len(paths), "executor": executor.value, "workers": workers},
+            ),
+        ]
+        write_trace(Path(trace_out), trace_spans, trace_start, main_worker)
+
+    if verbose:
+        echo_timings(summary, safe, store is not None, pipeline)
+    if stats:
+        click.echo(format_counters(counters, summary.processed_count))
+
+    sys.exit(echo_summary(summary))
+
+
+def validate_paths(paths: Iterable[str]) -> List[str]:
+    """
+    Check that the paths exist and are readable and writable, as click.Path would when parsing
+    """
+
+    ctx = click.get_current_context()
+    param = next(param for param in ctx.command.params if param.name == "paths")
+    path_type = click.Path(readable=True, writable=True, exists=True)
+    return [path_type.convert(path, param, ctx) for path in paths]
+
+
+def get_git_files(revision: str, paths: Iterable[str]) -> List[GitFile]:
+    try:
+        return list_git_files(revision, list(paths))
+    except GitError as e:
+        raise click.ClickException(str(e))
 
-    reformatted_count, failed_count = 0, 0
-    process_path_with_check = partial(process_path, check_only_mode=check, diff_mode=diff)
 
-    parallelize = len(paths) > NUM_FILES_TO_ENABLE_PARALLELIZATION
-    if parallelize:
-        with mp.Pool(mp.cpu_count() - 1) as pool:
-            map_result = pool.map(process_path_with_check, paths)
+def select_paths(
+    paths: Iterable[str],
+    git_files: Optional[List[GitFile]],
+    shard: Optional[Tuple[int, int]],
+    shard_durations: Optional[str],
+) -> Tuple[List[Path], List[int]]:
+    """
+    Files to process, on disk or in git if `git_files` are given, in the shard if any, and their
+    sizes
+    """
+
+    git_sizes = {file.path: file.size for file in git_files or ()}
+    if git_files is not None:
+        file_paths = list(git_sizes)
     else:
-        # Do not parallelize if just a few files
-        map_result = map(process_path_with_check, paths)
+        file_paths = collect_paths(validate_paths(paths))
+
+    if shard is not None:
+        durations = Summary.read(Path(shard_durations)).durations if shard_durations else None
+        sizes = git_sizes if git_files is not None else None
+        file_paths = select_shard(file_paths, *shard, durations=durations, sizes=sizes)
+
+    if git_files is not None:
+        return file_paths, [git_sizes[path] for path in file_paths]
+    return file_paths, [path.stat().st_size for path in file_paths]
+
+
+def open_io_pipeline(
+    stack: ExitStack,
+    paths: List[Path],
+    git_files: Optional[List[GitFile]],
+    io_workers: int,
+    workers: int,
+    trace_out: Optional[str],
+) -> Optional[IOPipeline]:
+    """
+    I/O pipeline reading the files from git if `git_files` are given (a single thread reading
+    from `git cat-file`), or from disk with --io-workers, closed with `stack`
+    """
+
+    read_code: Optional[Callable[[Path], str]] = None
+    if git_files is not None:
+        read_code = stack.enter_context(GitBlobReader(git_files)).read
+        io_workers = 1
+    elif io_workers == 0:
+        return None
+
+    lookahead = LOOKAHEAD_PER_WORKER * (workers + io_workers)
+    pipeline = IOPipeline(paths, io_workers, lookahead, trace_out is not None, read_code)
+    return stack.enter_context(pipeline)
+
+
+def collect_paths(paths: Iterable[str]) -> List[Path]:
+    """
+    Files to process, expanding directories to all .py files inside and dropping duplicates
+    """
+
+    file_paths: List[Path] = []
+    for path_str in paths:
+        path = Path(path_str)
+        if path.is_dir():
+            file_paths.extend(path.glob("**/*.py"))
+        else:
+            file_paths.append(path)
 
-    for is_modified, is_failed, message in map_result:
-        if verbose or is_modified or is_failed:
-            click.echo(message)
-        reformatted_count += is_modified
-        failed_count += is_failed
+    return list(dict.fromkeys(file_paths))
 
-    unchanged_count = len(paths) - reformatted_count - failed_count
+
+@click.command()
+@click.argument(
+    "summary_paths",
+    nargs=-1,
+    required=True,
+    type=click.Path(exists=True, dir_okay=False),
+)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False, writable=True),
+    default=None,
+)
+def merge_summaries(summary_paths, output):
+    """
+    Merge the summaries written with --summary-output (e.g. one per shard) into one report, with
+    the same exit code as a single run over all files
+
+    \b
+    * output:
+        If --output SUMMARY_FILE is passed, write the merged summary as JSON, e.g. to balance the
+        shards of the next run with --shard-durations
+    """
+
+    summaries = [Summary.read(Path(summary_path)) for summary_path in summary_paths]
+    try:
+        summary = reduce(Summary.merge, summaries)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+
+    if output is not None:
+        summary.write(Path(output))
+
+    sys.exit(echo_summary(summary))
+
+
+def iter_results(
+    process: Callable[[Path], ProcessPathResult],
+    paths: List[Path],
+    fail_fast: bool,
+    executor: Executor = Executor.SERIAL,
+    workers: int = 1,
+    timeout_per_file: Optional[float] = None,
+    pipeline: Optional[IOPipeline] = None,
+) -> Iterator[ProcessPathResult]:
+    """
+    Process all paths, yielding each result as soon as it is available. Closing the iterator
+    before the end (e.g. with fail_fast) terminates the workers
+
+    With an I/O pipeline, `process` receives the code read ahead by the pipeline, and defers the
+    writes to it (see process_path). Results are yielded once written
+    """
+
+    if pipeline is None:
+        yield from iter_processed(process, paths, fail_fast, executor, workers, timeout_per_file)
+        return
+
+    results = iter_processed(
+        partial(process_source, process),
+        paths,
+        fail_fast,
+        executor,
+        workers,
+        timeout_per_file,
+        prepare=pipeline.read,
+    )
+    yield from iter_written(results, pipeline)
+
+
+def iter_processed(
+    process: Callable,
+    paths: List[Path],
+    fail_fast: bool,
+    executor: Executor,
+    workers: int,
+    timeout_per_file: Optional[float],
+    prepare: Optional[Callable[[Path], Any]] = None,
+) -> Iterator[ProcessPathResult]:
+    """
+    Apply `process` to all paths, or to what `prepare` makes of them if given, see iter_results
+    """
+
+    if prepare is not None and executor in (Executor.SERIAL, Executor.THREAD):
+        process = compose(process, prepare)
+        prepare = None
+
+    if executor == Executor.SERIAL or not paths:
+        yield from map(process, paths)
+        return
+
+    # in order, unless we only look for the first failure
+    ordered = not fail_fast
+    if executor == Executor.THREAD:
+        yield from (result for _, result in iter_in_threads(process, paths, workers, ordered))
+        return
+
+    initializer = partial(warm_up, paths[0])
+    if executor == Executor.FORK:
+        # inherited by the forked workers, including those replacing dead or timed out workers
+        initializer()
+
+    pool = WorkerPool(
+        process,
+        workers,
+        timeout_per_file,
+        context=get_process_context(executor, preload=["globality_black.cli"]),
+        initializer=None if executor == Executor.FORK else initializer,
+    )
+    for path, result in pool.imap(paths, ordered=ordered, prepare=prepare):
+        if isinstance(result, WorkerFailure):
+            result = ProcessPathResult(
+                False,
+                True,
+                f"Failed to reformat {path}. {result.message}",
+                format_seconds=result.seconds,
+                path=path,
+                failure=FailureKind.WORKER,
+            )
+        yield result
+
+
+def compose(outer: Callable, inner: Callable) -> Callable:
+    return lambda item: outer(inner(item))
+
+
+def process_source(process: Callable[..., ProcessPathResult], source: Source) -> ProcessPathResult:
+    """Apply `process` to a file read by the I/O pipeline, see io_pipeline.py"""
+
+    if source.code is None:
+        return ProcessPathResult(
+            False,
+            True,
+            f"Failed to reformat {source.path}. Cannot read it: {source.error}",
+            path=source.path,
+            failure=FailureKind.READ,
+        )
+    return process(source.path, input_code=source.code)
+
+
+def iter_written(
+    results: Iterable[ProcessPathResult],
+    pipeline: IOPipeline,
+) -> Iterator[ProcessPathResult]:
+    """
+    Write back the reformatted code of the results with the I/O pipeline, yielding each result in
+    the same order once its file is written, without waiting for the writes otherwise
+    """
+
+    pending: Deque[Tuple[ProcessPathResult, Optional[Future]]] = deque()
+    for result in results:
+        write = None
+        if result.output_code is not None:
+            write = pipeline.write(cast(Path, result.path), result.output_code)
+        pending.append((result._replace(output_code=None), write))
+
+        while pending and (pending[0][1] is None or pending[0][1].done()):
+            yield get_written_result(pipeline, *pending.popleft())
+
+    while pending:
+        yield get_written_result(pipeline, *pending.popleft())
+
+
+def get_written_result(
+    pipeline: IOPipeline,
+    result: ProcessPathResult,
+    write: Optional[Future],
+) -> ProcessPathResult:
+    if write is not None:
+        try:
+            pipeline.wait(write)
+        except OSError as e:
+            message = f"Failed to reformat {result.path}. Cannot write it: {e}"
+            return result._replace(is_failed=True, message=message)
+    return result
+
+
+def trace_process(
+    process: Callable[..., ProcessPathResult],
+    path: Path,
+    input_code: Optional[str] = None,
+) -> ProcessPathResult:
+    """
+    Apply `process` to `path`, returning the spans recorded meanwhile (see trace.py) in the result
+    """
+
+    size = len(input_code) if input_code is not None else path.stat().st_size
+    with record_spans() as spans:
+        with span("file", path=str(path), size=size) as args:
+            result = process(path, input_code=input_code)
+            args["status"] = get_status(result)
+            args["from_store"] = result.from_store
+    return result._replace(spans=tuple(spans))
+
+
+def count_process(
+    process: Callable[..., ProcessPathResult],
+    path: Path,
+    input_code: Optional[str] = None,
+) -> ProcessPathResult:
+    """
+    Apply `process` to `path`, returning the work counted meanwhile (see stats.py) in the result
+    """
+
+    with record_counters() as counters:
+        result = process(path, input_code=input_code)
+    return result._replace(counters=tuple(counters.items()))
+
+
+def get_status(result: ProcessPathResult) -> str:
+    if result.is_failed:
+        return "failed"
+    return "modified" if result.is_modified else "unchanged"
+
+
+def warm_up(path: Path):
+    """
+    Import and initialize black and parso (e.g. load their grammars) and read the configuration
+    for `path`, so that the first file of each worker does not pay for it
+    """
+
+    try:
+        black_mode = get_black_mode(path)
+        features = get_features(path)
+        isort_config = get_isort_config(path)
+    except InvalidConfigError:
+        # reported when processing the files
+        return
+    reformat_text(
+        WARM_UP_CODE,
+        black_mode,
+        features=features,
+        isort_config=isort_config,
+    )
+
+
+def echo_result(result: ProcessPathResult, verbose: bool, diff: bool, color: bool):
+    if not (verbose or result.is_modified or result.is_failed):
+        return
+
+    message = result.message
+    if diff and not result.is_failed:
+        diff_report = (
+            format_diff_report(cast(Path, result.path), result.diff, color) if result.diff else ""
+        )
+        message = diff_report + "\n" + message
+    click.echo(message)
+
+
+def echo_timings(summary: Summary, safe: bool, with_store: bool, pipeline: Optional[IOPipeline]):
+    mode_string = "safe" if safe else "fast"
+    click.echo(
+        f"Formatting took {summary.format_seconds:.2f}s, "
+        f"verification took {summary.verify_seconds:.2f}s "
+        f"({mode_string} mode, summed over files)"
+    )
+    if with_store:
+        click.echo(f"{summary.store_hits} files found in the output store")
+    if pipeline is not None:
+        click.echo(pipeline.stats.get_report())
+
+
+def echo_summary(summary: Summary) -> int:
+    """
+    Show the final counts and return the exit code
+    """
+
+    exit_code = 0
+    check = summary.check
+    reformatted_count, unchanged_count = summary.reformatted_count, summary.unchanged_count
 
     # add a separator line
     click.echo("-" * len(OH_NO_STRING))
 
     # if we are just checking and at least one file needs to be reformatted OR some file failed
-    if (check and reformatted_count > 0) or failed_count > 0:
+    if (check and reformatted_count > 0) or summary.failed_count > 0:
         click.echo(OH_NO_STRING)
         exit_code = 1
-        if failed_count > 0:
-            click.echo(f"{failed_count} files failed to parse (black error)")
+        for kind, failed_count in summary.get_failure_counts().items():
+            if failed_count > 0:
+                click.echo(f"{failed_count} files {FAILURE_LABELS[kind]}")
+        if summary.skipped_count > 0:
+            click.echo(f"Stopped early (fail fast), {summary.skipped_count} files not processed")
     else:
         click.echo(ALL_DONE_STRING)
 
@@ -108,48 +833,173 @@ def main(path, check, diff, verbose):
         if unchanged_count > 0:
             click.echo(f"{unchanged_count} files unchanged")
 
-    sys.exit(exit_code)
+    return exit_code
 
 
 def process_path(
     path: Path,
     check_only_mode: bool = False,
     diff_mode: bool = False,
-) -> Tuple[bool, bool, str]:
+    safe_mode: bool = False,
+    post_engine: PostProcessingEngine = PostProcessingEngine.PARSO,
+    pre_engine: PreProcessingEngine = PreProcessingEngine.PARSO,
+    store_path: Optional[Path] = None,
+    store_max_size: int = DEFAULT_OUTPUT_STORE_MAX_SIZE_MB * 2 ** 20,
+    disabled_features: Tuple[str, ...] = (),
+    sort_imports: bool = False,
+    input_code: Optional[str] = None,
+    defer_write: bool = False,
+) -> ProcessPathResult:
     """
-    For each path compute `is_modified`, `is_failed`, and `message` to be used in main
+    For each path compute `is_modified`, `is_failed`, and `message` to be used in main, together
+    with the time spent formatting and verifying (the latter only in safe mode)
+
+    With an I/O pipeline (see io_pipeline.py), the code of the file is given as `input_code`, and
+    with `defer_write` the reformatted code is returned in the result rather than written
     """
 
     is_modified = False
-    input_code = path.read_text()
-    black_mode = get_black_mode(path)
+    if input_code is None:
+        try:
+            with span("read"):
+                input_code = path.read_text()
+        except (OSError, UnicodeDecodeError) as e:
+            return ProcessPathResult(
+                False,
+                True,
+                f"Failed to reformat {path}. Cannot read it: {e}",
+                path=path,
+                failure=FailureKind.READ,
+            )
     diff_output = ""
+    verify_seconds = 0.0
     try:
-        output_code = reformat_text(input_code, black_mode)
+        with span("config"):
+            black_mode = get_black_mode(path)
+            features = get_features(path, disabled_features)
+            isort_config = get_isort_config(path, sort_imports)
+    except InvalidConfigError as e:
+        return ProcessPathResult(
+            False,
+            True,
+            f"Failed to reformat {path}. {e}",
+            path=path,
+            failure=FailureKind.CONFIG,
+        )
+    store = open_output_store(store_path, store_max_size) if store_path is not None else None
+    store_key = ""
+    if store is not None:
+        store_key = get_store_key(
+            input_code,
+            black_mode,
+            features,
+            isort_config,
+            post_engine,
+            pre_engine,
+        )
+
+    start = time.perf_counter()
+    with span("store lookup"):
+        output_code = store.get(store_key, input_code, verified=safe_mode) if store else None
+    from_store = output_code is not None
+    try:
+        if output_code is None:
+            output_code, verify_seconds = format_code(
+                input_code,
+                black_mode,
+                safe_mode,
+                post_engine,
+                pre_engine,
+                features,
+                isort_config,
+            )
     except BlackError as e:
-        return False, True, f"Failed to reformat {path}. {e}"
+        # with the time spent, so that --shard-durations can balance the failing files too
+        return ProcessPathResult(
+            False,
+            True,
+            f"Failed to reformat {path}. {e}",
+            format_seconds=time.perf_counter() - start,
+            path=path,
+        )
+    format_seconds = time.perf_counter() - start - verify_seconds
+
+    if store is not None and not from_store:
+        with span("store write"):
+            store.put(store_key, input_code, output_code, verified=safe_mode)
 
     if input_code != output_code:
         is_modified = True
 
+    if check_only_mode and is_modified and diff_mode:
+        diff_output = text_diff(path, input_code, output_code)
+
+    deferred_output_code = None
+    if not check_only_mode and is_modified:
+        if defer_write:
+            deferred_output_code = output_code
+        else:
+            with span("write"):
+                path.write_text(output_code)
+
+    return ProcessPathResult(
+        is_modified,
+        False,
+        f"{get_action(check_only_mode, is_modified)} {path}",
+        format_seconds,
+        verify_seconds,
+        path,
+        diff_output,
+        from_store,
+        output_code=deferred_output_code,
+    )
+
+
+def get_action(check_only_mode: bool, is_modified: bool) -> str:
     if check_only_mode and is_modified:
-        if diff_mode:
-            diff_output = text_diff(path, output_code)
-            diff_output = f"\nDiff for {path} \n" + diff_output
-        initial_str = "Would reformat"
-    elif not check_only_mode and is_modified:
-        initial_str = "Reformatted"
-    else:
-        initial_str = "Nothing to do for"
+        return "Would reformat"
+    if is_modified:
+        return "Reformatted"
+    return "Nothing to do for"
 
-    if not check_only_mode:
-        path.write_text(output_code)
-    if diff_mode:
-        # if diff we add the diff report to the reformat message
-        output = diff_output + "\n" + f"{initial_str} {path}"
-    else:
-        output = f"{initial_str} {path}"
-    return is_modified, False, output
+
+def format_code(
+    input_code: str,
+    black_mode,
+    safe_mode: bool,
+    post_engine: PostProcessingEngine,
+    pre_engine: PreProcessingEngine,
+    features: FrozenSet[Feature],
+    isort_config: Optional[Any] = None,
+) -> Tuple[str, float]:
+    """
+    Reformat the code, verifying the output in safe mode. Return the output and the time spent
+    verifying it
+    """
+
+    output_code = reformat_text(
+        input_code,
+        black_mode,
+        post_engine=post_engine,
+        pre_engine=pre_engine,
+        features=features,
+        isort_config=isort_config,
+    )
+    if not safe_mode:
+        return output_code, 0.0
+
+    start = time.perf_counter()
+    with span("verify"):
+        assert_safe_reformat(
+            input_code,
+            output_code,
+            black_mode,
+            post_engine,
+            pre_engine,
+            features,
+            isort_config,
+        )
+    return output_code, time.perf_counter() - start
 
 
 if __name__ == "__main__":
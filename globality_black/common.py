@@ -1,12 +1,116 @@
+import math
 import re
-from typing import List, Optional
+from bisect import bisect_right
+from functools import lru_cache
+from typing import (
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    cast,
+)
 
-from parso.python.tree import Module
+from parso.python.tree import Leaf, Module
+from parso.tree import BaseNode, NodeOrLeaf
 
 from globality_black.constants import (
     MAX_CHARACTERS_TO_FIND_INDENTATION_PARENT,
+    STATEMENT_CONTAINER_TYPES,
     TYPES_TO_CHECK_FMT_ON_OFF,
 )
+from globality_black.stats import (
+    GET_CODE_CALLS,
+    INDENTATION_LEAF_LOOKUPS,
+    VISITOR_NODES,
+    VISITOR_TRAVERSALS,
+    count,
+)
+
+
+class FmtOffRegions:
+    """
+    Lines where formatting is disabled by `fmt: off` / `fmt: on` comments, as sorted and disjoint
+    intervals [start, end). Use `find_fmt_off_regions` to compute them once per parse, and share
+    them between all SyntaxTreeVisitor passes on the same tree
+    """
+
+    def __init__(self, intervals: Sequence[Tuple[int, float]] = ()):
+        self.starts = [start for start, _ in intervals]
+        self.ends = [end for _, end in intervals]
+
+    def __bool__(self) -> bool:
+        return bool(self.starts)
+
+    def contains(self, line: int) -> bool:
+        index = bisect_right(self.starts, line) - 1
+        return index >= 0 and line < self.ends[index]
+
+
+def find_fmt_off_regions(module: Module, code: Optional[str] = None) -> FmtOffRegions:
+    """
+    Find the lines where formatting is disabled. The toggles are read from the prefix (comments)
+    of statements, function and class definitions, in the order they are reached when traversing
+    the tree and skipping whole subtrees while disabled. Hence, a `fmt: on` inside a block
+    disabled as a whole is ignored. This only needs to go through statements, not expressions
+
+    If `code` is given and has no `fmt:` comment at all, there is nothing to traverse
+    """
+
+    if code is not None and "fmt:" not in code:
+        return FmtOffRegions()
+
+    intervals: List[Tuple[int, float]] = []
+    fmt_off, off_start = False, 0
+    # only nodes can contain statements
+    stack: List[BaseNode] = [module]
+
+    while stack:
+        node = stack.pop()
+
+        if is_statement_type(node.type):
+            leaf = get_first_leaf(node)
+            was_off = fmt_off
+            if "fmt: off" in leaf.prefix:
+                fmt_off = True
+            if "fmt: on" in leaf.prefix:
+                fmt_off = False
+
+            if fmt_off and not was_off:
+                off_start = leaf.line
+            elif was_off and not fmt_off:
+                intervals.append((off_start, leaf.line))
+
+        if not fmt_off:
+            stack.extend(
+                cast(BaseNode, child)
+                for child in reversed(node.children)
+                if can_contain_statements(child.type)
+            )
+
+    if fmt_off:
+        intervals.append((off_start, math.inf))
+
+    return FmtOffRegions(intervals)
+
+
+@lru_cache(maxsize=None)
+def is_statement_type(node_type: str) -> bool:
+    return any(name in node_type for name in TYPES_TO_CHECK_FMT_ON_OFF)
+
+
+@lru_cache(maxsize=None)
+def can_contain_statements(node_type: str) -> bool:
+    return node_type in STATEMENT_CONTAINER_TYPES or is_statement_type(node_type)
+
+
+def is_disabled(node: NodeOrLeaf, regions: FmtOffRegions) -> bool:
+    """Whether a node (with a parent) is skipped as a whole, being in a `fmt: off` region"""
+
+    parent = cast(BaseNode, node.parent)
+    return can_contain_statements(parent.type) and regions.contains(get_first_leaf(node).line)
 
 
 class SyntaxTreeVisitor:
@@ -14,49 +118,140 @@ class SyntaxTreeVisitor:
         self,
         module: Module,
         types_to_find: Optional[List[str]] = None,
-    ):
+        fmt_off_regions: Optional[FmtOffRegions] = None,
+    ) -> None:
         self.module = module
         self.types_to_find = types_to_find
-        self.fmt_off = False
+        if fmt_off_regions is None:
+            fmt_off_regions = find_fmt_off_regions(module)
+        self.fmt_off_regions = fmt_off_regions
+
+    def __call__(self, root: NodeOrLeaf) -> Iterator[NodeOrLeaf]:
+        """
+        Yield the nodes under `root` (included) in pre-order, skipping `fmt: off` regions
+
+        We use an explicit stack rather than recursion, so that the cost per node does not depend
+        on its depth, and deeply nested code does not hit the recursion limit
+
+        Regions start and end at statements, so the position check is only needed for children of
+        nodes that can contain statements: a disabled subtree is skipped as a whole, and all
+        descendants of an enabled expression are enabled
+        """
+
+        if self.types_to_find is None or root.type in self.types_to_find:
+            yield root
+
+        # files without fmt: off pay nothing but this check
+        regions = self.fmt_off_regions or None
+        stack: List[NodeOrLeaf] = list(reversed(getattr(root, "children", [])))
+        # counted once per traversal (see stats.py), even if not run to the end
+        visited = 1
+        try:
+            while stack:
+                node = stack.pop()
+                visited += 1
+                if regions is not None and is_disabled(node, regions):
+                    continue
+
+                if self.types_to_find is None or node.type in self.types_to_find:
+                    yield node
+
+                if hasattr(node, "children"):
+                    stack.extend(reversed(node.children))
+        finally:
+            count(VISITOR_TRAVERSALS)
+            count(VISITOR_NODES, visited)
+
+
+def get_first_leaf(node: NodeOrLeaf) -> Leaf:
+    """Same as parso's `node.get_first_leaf()`, without recursion"""
 
-    def __call__(self, node):
+    while hasattr(node, "children"):
+        node = node.children[0]
+    return cast(Leaf, node)
 
-        self.set_fmt_on_off_according_to_prefix(node)
-        if self.types_to_find is None or node.type in self.types_to_find and not self.fmt_off:
-            yield node
 
+def get_last_leaf(node: NodeOrLeaf) -> Leaf:
+    """Same as parso's `node.get_last_leaf()`, without recursion"""
+
+    while hasattr(node, "children"):
+        node = node.children[-1]
+    return cast(Leaf, node)
+
+
+def get_leaf_for_position(
+    node: NodeOrLeaf,
+    position: Tuple[int, int],
+    include_prefixes: bool = False,
+) -> Optional[Leaf]:
+    """Same as parso's `node.get_leaf_for_position()`, without recursion"""
+
+    if not (1, 0) <= position <= get_last_leaf(node).end_pos:
+        raise ValueError("Please provide a position that exists within this node.")
+
+    while hasattr(node, "children"):
+        children = node.children
+        lower, upper = 0, len(children) - 1
+        while lower < upper:
+            index = (lower + upper) // 2
+            if position <= get_last_leaf(children[index]).end_pos:
+                upper = index
+            else:
+                lower = index + 1
+        node = children[lower]
+        if not include_prefixes and position < get_first_leaf(node).start_pos:
+            return None
+    return cast(Leaf, node)
+
+
+def get_code(node: NodeOrLeaf) -> str:
+    """Same as parso's `node.get_code()`, without recursion (deep trees hit the recursion limit)"""
+
+    count(GET_CODE_CALLS)
+    parts = []
+    stack: List[NodeOrLeaf] = [node]
+    while stack:
+        node = stack.pop()
         if hasattr(node, "children"):
-            for child in node.children:
-                self.set_fmt_on_off_according_to_prefix(child)
-                if not self.fmt_off:
-                    yield from self(child)
+            stack.extend(reversed(node.children))
+        else:
+            leaf = cast(Leaf, node)
+            parts.append(leaf.prefix + leaf.value)
+    return "".join(parts)
 
-    def set_fmt_on_off_according_to_prefix(self, node):
-        """
-        We check for fmt_on_off only for some specific types, otherwise no-op. This saves time, so
-        we don't need to find the prefix for every single node in the parse tree
-        """
 
-        if not any(name in node.type for name in TYPES_TO_CHECK_FMT_ON_OFF):
-            return
-        prefix = node.get_first_leaf().prefix
+# original prefixes of the modified leaves, per tree kept in a parse cache. Keyed by id, since
+# parso compares (and hashes) some leaves by value
+ORIGINAL_PREFIXES: Dict[int, Dict[int, Tuple[Leaf, str]]] = {}
 
-        if "fmt: off" in prefix:
-            self.fmt_off = True
 
-        if "fmt: on" in prefix:
-            self.fmt_off = False
+def set_leaf_prefix(leaf: Leaf, prefix: str) -> None:
+    """
+    Set the prefix of a leaf. If its tree is kept in a parse cache (see parse_cache.py), record
+    the original prefix first, so that the tree can be restored once we are done with it
+    """
+
+    if ORIGINAL_PREFIXES:
+        original_prefixes = ORIGINAL_PREFIXES.get(id(leaf.get_root_node()))
+        if original_prefixes is not None:
+            original_prefixes.setdefault(id(leaf), (leaf, leaf.prefix))
+    leaf.prefix = prefix
 
 
-def apply_function_to_tree_prefixes(module, root, function):
-    visitor = SyntaxTreeVisitor(module)
+def apply_function_to_tree_prefixes(
+    module: Module,
+    root: NodeOrLeaf,
+    function: Callable[[str], str],
+) -> None:
+    # root is an enabled expression, there are no fmt: off regions within
+    visitor = SyntaxTreeVisitor(module, fmt_off_regions=FmtOffRegions())
 
     for node in visitor(root):
-        prefix = node.get_first_leaf().prefix
-        node.get_first_leaf().prefix = function(prefix)
+        leaf = get_first_leaf(node)
+        set_leaf_prefix(leaf, function(leaf.prefix))
 
 
-def find_indentation_parent_prefix(element):
+def find_indentation_parent_prefix(element: NodeOrLeaf) -> str:
     """
     Find prefix for the indentation parent by going to the parent's line and getting the indent
     for the first element in the line, i.e. the node we have to align this element with
@@ -68,17 +263,20 @@ def find_indentation_parent_prefix(element):
 
     """
 
-    parent = element.parent
+    parent = cast(BaseNode, element.parent)
     module = element.get_root_node()
 
+    # with prefixes, there is always a leaf
     line_start_pos = (parent.start_pos[0], 0)
-    leaf = module.get_leaf_for_position(line_start_pos, include_prefixes=True)
+    leaf = cast(Leaf, get_leaf_for_position(module, line_start_pos, include_prefixes=True))
+    count(INDENTATION_LEAF_LOOKUPS)
 
     # we move the "pointer" to position 0 of this line and check if the leaf.type is not a newline
     # otherwise we keep moving the pointer until we find something, and that gives as the
     # indentation sized we're looking for
     while leaf.type == "newline":
-        leaf = module.get_leaf_for_position(line_start_pos, include_prefixes=True)
+        leaf = cast(Leaf, get_leaf_for_position(module, line_start_pos, include_prefixes=True))
+        count(INDENTATION_LEAF_LOOKUPS)
         line_start_pos = (line_start_pos[0], line_start_pos[1] + 1)
 
         if line_start_pos[1] > MAX_CHARACTERS_TO_FIND_INDENTATION_PARENT:
@@ -91,7 +289,7 @@ def find_indentation_parent_prefix(element):
     return leaf.prefix
 
 
-def get_indent_from_prefix(prefix):
+def get_indent_from_prefix(prefix: str) -> str:
     """
     Each element in parso has a prefix. We want to get the indent from the parent, so we can
     construct the prefix for the modified elements.
@@ -108,7 +306,7 @@ def get_indent_from_prefix(prefix):
 
     if prefix:
         try:
-            return re.search("( *)$", prefix).group(0)
+            return re.search("( *)$", prefix).group(0)  # type: ignore
         except Exception:
             raise ValueError(f"Could not get indent from prefix {prefix}")
     else:
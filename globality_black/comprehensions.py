@@ -7,12 +7,19 @@ Module to explode comprehensions:
 from typing import cast
 
 from parso.python.tree import PythonNode
-
-from globality_black.common import find_indentation_parent_prefix, get_indent_from_prefix
+from parso.tree import NodeOrLeaf
+
+from globality_black.common import (
+    find_indentation_parent_prefix,
+    get_first_leaf,
+    get_indent_from_prefix,
+    set_leaf_prefix,
+)
 from globality_black.constants import TAB_CHAR_SIZE, ParsoTypes
+from globality_black.stats import COMPREHENSIONS_EXPLODED, count
 
 
-def reformat_comprehension(comp_for: PythonNode):
+def reformat_comprehension(comp_for: PythonNode) -> None:
     """
     comp_for represents a subset of the comprehension, e.g. in
 
@@ -68,7 +75,7 @@ def reformat_comprehension(comp_for: PythonNode):
         _reformat_comprehension(comp_for)
 
 
-def find_if_value_is_comprehension(comp: PythonNode):
+def find_if_value_is_comprehension(comp: PythonNode) -> bool:
     value = comp.children[0]
     for child in getattr(value, "children", []):
         if child.type == "testlist_comp":
@@ -76,10 +83,11 @@ def find_if_value_is_comprehension(comp: PythonNode):
     return False
 
 
-def _reformat_comprehension(comp_for: PythonNode):
+def _reformat_comprehension(comp_for: PythonNode) -> None:
     """
     Here we do the actual reformatting
     """
+    count(COMPREHENSIONS_EXPLODED)
     comp = cast(PythonNode, comp_for.parent)
     prefix = find_indentation_parent_prefix(comp)
     base_indent = get_indent_from_prefix(prefix)
@@ -95,31 +103,34 @@ def _reformat_comprehension(comp_for: PythonNode):
     set_prefix(last_child, "\n" + base_indent)
 
 
-def set_prefix(element: PythonNode, prefix: str):
+def set_prefix(element: NodeOrLeaf, prefix: str) -> None:
 
-    leaf = element.get_first_leaf()
+    leaf = get_first_leaf(element)
 
     # if there's only space, replace
     if not leaf.prefix.strip():
-        leaf.prefix = prefix
+        set_leaf_prefix(leaf, prefix)
 
     # otherwise, add prefix to previous prefix (to keep comments)
     else:
         last_eol_position = leaf.prefix.rindex("\n")
-        leaf.prefix = leaf.prefix[:last_eol_position] + prefix
+        set_leaf_prefix(leaf, leaf.prefix[:last_eol_position] + prefix)
 
 
-def set_prefix_for_all_last_children(comp_for: PythonNode, prefix: str):
+def set_prefix_for_all_last_children(comp_for: PythonNode, prefix: str) -> None:
     """
     indent for in comprehension + all for and if underneath
     unfortunately parso treats each new comp_for and comp_if after the comp_for (if any) as a child
     of the
-    previous one. Hence, we need to recursively iterate on them
+    previous one. Hence, we need to iterate on them (without recursion, as these chains can be
+    long)
 
     """
 
-    set_prefix(comp_for, prefix)
+    element = comp_for
+    while True:
+        set_prefix(element, prefix)
 
-    last_child = cast(PythonNode, comp_for.children[-1])
-    if last_child.type in {ParsoTypes.COMP_IF.value, ParsoTypes.SYNC_COMP_FOR.value}:
-        set_prefix_for_all_last_children(last_child, prefix)
+        element = cast(PythonNode, element.children[-1])
+        if element.type not in {ParsoTypes.COMP_IF.value, ParsoTypes.SYNC_COMP_FOR.value}:
+            break
@@ -0,0 +1,73 @@
+"""
+Configuration of globality-black in the `[tool.globality-black]` table of pyproject.toml, e.g.
+
+    [tool.globality-black]
+    disable = ["blank-lines", "dotted-chains", "tuples"]
+
+to only explode comprehensions. See constants.Feature for the names of the features
+
+Imports can also be sorted with isort before black, with `sort-imports = true`, see imports.py
+"""
+import sys
+from functools import lru_cache
+from pathlib import Path
+from typing import FrozenSet, Iterable, Optional
+
+import black
+
+from globality_black.constants import ALL_FEATURES, Feature
+
+
+if sys.version_info >= (3, 11):
+    import tomllib
+else:
+    import tomli as tomllib
+
+
+class InvalidConfigError(Exception):
+    pass
+
+
+def get_features(src: Path, disabled: Iterable[str] = ()) -> FrozenSet[Feature]:
+    """
+    Features enabled for `src`, i.e. all but those disabled in its pyproject.toml or in `disabled`
+    """
+
+    config = read_config(black.find_pyproject_toml((str(src),)) or None)
+    return ALL_FEATURES - parse_features(config.get("disable", [])) - parse_features(disabled)
+
+
+def get_sort_imports(src: Path) -> bool:
+    """Whether to sort the imports of `src`, as set in its pyproject.toml"""
+
+    sort_imports = read_config(black.find_pyproject_toml((str(src),)) or None).get(
+        "sort-imports",
+        False,
+    )
+    if not isinstance(sort_imports, bool):
+        raise InvalidConfigError(f"sort-imports must be true or false, not {sort_imports!r}")
+    return sort_imports
+
+
+@lru_cache(maxsize=None)
+def read_config(pyproject_path: Optional[str]) -> dict:
+    """Read the `[tool.globality-black]` table, if any"""
+
+    if pyproject_path is None:
+        return {}
+
+    try:
+        with open(pyproject_path, "rb") as pyproject_file:
+            pyproject = tomllib.load(pyproject_file)
+    except (OSError, tomllib.TOMLDecodeError) as e:
+        raise InvalidConfigError(f"Cannot read {pyproject_path}. {e}")
+
+    return pyproject.get("tool", {}).get("globality-black", {})
+
+
+def parse_features(names: Iterable[str]) -> FrozenSet[Feature]:
+    try:
+        return frozenset(Feature(name) for name in names)
+    except ValueError as e:
+        valid_names = ", ".join(feature.value for feature in Feature)
+        raise InvalidConfigError(f"{e}, features are: {valid_names}")
@@ -10,19 +10,64 @@ class ParsoTypes(Enum):
     LISTCOMP = "testlist_comp"
 
 
+@unique
+class PreProcessingEngine(Enum):
+    PARSO = "parso"
+    TOKENIZE = "tokenize"
+
+
+@unique
+class PostProcessingEngine(Enum):
+    PARSO = "parso"
+    BLIB2TO3 = "blib2to3"
+
+
+@unique
+class Executor(Enum):
+    AUTO = "auto"
+    SERIAL = "serial"
+    THREAD = "thread"
+    FORK = "fork"
+    FORKSERVER = "forkserver"
+    SPAWN = "spawn"
+
+
+@unique
+class Feature(Enum):
+    BLANK_LINES = "blank-lines"
+    DOTTED_CHAINS = "dotted-chains"
+    TUPLES = "tuples"
+    COMPREHENSIONS = "comprehensions"
+
+
+ALL_FEATURES = frozenset(Feature)
+
 BLANK_LINE_TOKEN = "BLANK_LINE_TOKEN"
 DOTTED_CHAIN_TOKEN = "DOTTED_CHAIN_TOKEN"
 TUPLE_TOKEN = "TUPLE_TOKEN"
 
+# features protecting lines from black, with the sentinel they insert in pre-processing
+COVER_FEATURE_TOKENS = {
+    Feature.BLANK_LINES: BLANK_LINE_TOKEN,
+    Feature.DOTTED_CHAINS: DOTTED_CHAIN_TOKEN,
+    Feature.TUPLES: TUPLE_TOKEN,
+}
+COVER_FEATURES = frozenset(COVER_FEATURE_TOKENS)
+
 BLANK_LINES_TYPES = ["atom_expr", "atom"]
 DOTTED_CHAIN_TYPES = ["atom_expr"]
 COMPREHENSIONS_TYPES = ["comp_if", "sync_comp_for"]
 TUPLE_TYPES = ["atom"]
 
 TYPES_TO_CHECK_FMT_ON_OFF = ("stmt", "funcdef", "classdef")
+# nodes (besides statements and definitions) whose children can be statements
+STATEMENT_CONTAINER_TYPES = {"file_input", "suite", "decorated", "error_node"}
 MAX_CHARACTERS_TO_FIND_INDENTATION_PARENT = 200
 DEFAULT_BLACK_LINE_LENGTH = 100
-NUM_FILES_TO_ENABLE_PARALLELIZATION = 5
+DEFAULT_PARSE_CACHE_SIZE = 32
+# in MB
+DEFAULT_OUTPUT_STORE_MAX_SIZE_MB = 256
+DEFAULT_OUTPUT_STORE_MAX_SIZE = DEFAULT_OUTPUT_STORE_MAX_SIZE_MB * 2 ** 20
 TAB_CHAR_SIZE = 4
 ALL_DONE_STRING = "All done! ✨ 🍰 ✨"
 OH_NO_STRING = "Oh no! 💥 💔 💥"
@@ -1,14 +1,28 @@
+import os
 from pathlib import Path
 
 from black import color_diff, diff
 
 
-def text_diff(input_path: Path, output_code: str) -> str:
+def text_diff(input_path: Path, input_code: str, output_code: str) -> str:
     """
     Report the differences that globality black will make to input_path file
     in a git-like format leveraging code already in black.
+
+    File names are relative to the current directory and prefixed with a/ and b/ as git does, so
+    that a concatenation of these diffs can be applied with `git apply` from that directory
+    """
+
+    name = Path(os.path.relpath(input_path)).as_posix()
+    return diff(input_code, output_code, f"a/{name}", f"b/{name}")
+
+
+def format_diff_report(input_path: Path, diff_contents: str, color: bool) -> str:
+    """
+    Diff for a file as shown in the terminal, colored only if requested (e.g. when writing to a
+    TTY)
     """
 
-    diff_contents = diff(input_path.read_text(), output_code, "", input_path.name)
-    diff_contents = color_diff(diff_contents)
-    return diff_contents
+    if color:
+        diff_contents = color_diff(diff_contents)
+    return f"\nDiff for {input_path} \n" + diff_contents
@@ -25,13 +25,17 @@ We want to keep these as they are. To do so, we will:
 """
 import re
 
-from parso.python.tree import PythonNode
+from parso.python.tree import Module, PythonNode
+from parso.tree import NodeOrLeaf
 
-from globality_black.common import apply_function_to_tree_prefixes
+from globality_black.common import apply_function_to_tree_prefixes, get_first_leaf, set_leaf_prefix
 from globality_black.constants import DOTTED_CHAIN_TOKEN, TAB_CHAR_SIZE
 
 
-def cover_dotted_chain_if_needed(candidate: PythonNode):
+NEW_LINE_AND_INDENT_REGEX = re.compile(rf"\n(?: {{{TAB_CHAR_SIZE}}})+")
+
+
+def cover_dotted_chain_if_needed(candidate: PythonNode) -> None:
     """
     Check if it is a dotted chain and if so, cover it
     module: contains all python code in this file
@@ -77,11 +81,10 @@ def is_dotted_chain(atom_expr: PythonNode) -> bool:
 
     """
     children = atom_expr.children
-    new_line_and_indent_regex = rf"\n(?: {{{TAB_CHAR_SIZE}}})+"
 
     # first node should start with a \n (a new line) + tabs (space characters, multiple of 4)
-    prefix_child1 = children[0].get_first_leaf().prefix
-    if not re.match(new_line_and_indent_regex, prefix_child1):
+    prefix_child1 = get_first_leaf(children[0]).prefix
+    if not NEW_LINE_AND_INDENT_REGEX.match(prefix_child1):
         return False
 
     # more than one child needed to be a dotted chain
@@ -89,28 +92,37 @@ def is_dotted_chain(atom_expr: PythonNode) -> bool:
         return False
 
     # all children after the first one (which starts with \n + indent) should start with a dot
-    # otherwise it's not a dotted chain
+    # otherwise it's not a dotted chain. Only the first leaf of each child is needed (its code
+    # starts with the prefix of this leaf, and leaf values never start with whitespace)
     for child in children[1:]:
-        code = child.get_code()
-        if re.match(new_line_and_indent_regex, code):
-            if not code.strip().startswith("."):
+        leaf = get_first_leaf(child)
+        if NEW_LINE_AND_INDENT_REGEX.match(leaf.prefix):
+            if not starts_with_dot(leaf.prefix, leaf.value):
                 return False
 
     return True
 
 
-def cover_dotted_chain(candidate):
+def starts_with_dot(prefix: str, value: str) -> bool:
+    """
+    Whether the code of a leaf with this prefix and value, stripped, starts with a dot. A prefix
+    with anything but whitespace (comments, backslashes) never starts with a dot
+    """
+    return not prefix.strip() and value.startswith(".")
+
+
+def cover_dotted_chain(candidate: PythonNode) -> None:
     """
     We cannot use `apply_function_to_tree_prefixes` (or not easily) as not all lines in the dotted
     chain are to be modified, only those starting with "." (which is not in the prefix)
     """
     for node in candidate.children[1:]:
-        if node.get_code().strip().startswith("."):
-            prefix = node.get_first_leaf().prefix
-            node.get_first_leaf().prefix = get_new_prefix(prefix)
+        leaf = get_first_leaf(node)
+        if starts_with_dot(leaf.prefix, leaf.value):
+            set_leaf_prefix(leaf, get_new_prefix(leaf.prefix))
 
 
-def get_new_prefix(prefix):
+def get_new_prefix(prefix: str) -> str:
     # Add a token to avoid line merging
 
     return re.sub(
@@ -120,7 +132,7 @@ def get_new_prefix(prefix):
     )
 
 
-def uncover_dotted_chain(module, root):
+def uncover_dotted_chain(module: Module, root: NodeOrLeaf) -> None:
     """
     In this case we can apply the function to all lines
 
@@ -132,7 +144,7 @@ def uncover_dotted_chain(module, root):
     )
 
 
-def remove_token_from_covered_dotted_chain_line(prefix):
+def remove_token_from_covered_dotted_chain_line(prefix: str) -> str:
     # Remove extra lines with DC_TOKEN" added in pre-processing
 
     return re.sub(
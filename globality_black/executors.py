@@ -0,0 +1,167 @@
+"""
+How to process the files: serially in the main process, in threads, or in worker processes
+started with fork, forkserver or spawn
+
+With the `auto` executor, we choose with a simple cost model. Formatting runs at roughly
+FORMAT_BYTES_PER_SECOND per core, and starting a pool of processes has a fixed cost depending on
+the start method (fork only copies the warm main process, forkserver and spawn start a new
+interpreter and import everything). Hence, a handful of small files is formatted serially,
+whereas a few huge files are worth a pool.
+
+Threads only run in parallel on free-threaded builds of Python, where they are preferred (they
+start instantly and share the warm caches of the main process). Neither the main process nor
+threads can be interrupted, so a timeout per file requires worker processes.
+
+Forking a process running other threads (e.g. the I/O threads of io_pipeline.py) may leave the
+children with locks held by threads which do not exist there, hence workers are then started
+with forkserver instead of fork.
+"""
+import multiprocessing as mp
+import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from globality_black.constants import Executor
+
+
+# measured on the synthetic repo of benchmarks/throughput.py, one core
+FORMAT_BYTES_PER_SECOND = 30_000
+POOL_START_SECONDS = {
+    Executor.THREAD: 0.0,
+    Executor.FORK: 0.05,
+    Executor.FORKSERVER: 0.4,
+    Executor.SPAWN: 0.8,
+}
+PROCESS_EXECUTORS = (Executor.FORK, Executor.FORKSERVER, Executor.SPAWN)
+
+
+def is_free_threaded() -> bool:
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_gil_enabled is not None and not is_gil_enabled()
+
+
+def get_default_workers(executor: Executor) -> int:
+    """
+    All CPUs for threads. For processes, leave one CPU to the main process (and the system)
+    """
+
+    if executor == Executor.THREAD:
+        return mp.cpu_count()
+    return max(mp.cpu_count() - 1, 1)
+
+
+def get_process_executor(threads: bool = False) -> Executor:
+    """
+    Fork where it is safe (not on macOS, where system libraries may not survive it, nor if the
+    main process runs other `threads`), otherwise forkserver, and spawn on Windows
+    """
+
+    start_methods = mp.get_all_start_methods()
+    if "fork" in start_methods and sys.platform != "darwin" and not threads:
+        return Executor.FORK
+    if "forkserver" in start_methods:
+        return Executor.FORKSERVER
+    return Executor.SPAWN
+
+
+def select_executor(
+    sizes: List[int],
+    workers: Optional[int] = None,
+    timeout: Optional[float] = None,
+    threads: bool = False,
+) -> Tuple[Executor, int]:
+    """
+    Cheapest executor (and number of workers) to format files of the given sizes in bytes. With
+    `threads`, the main process runs other threads while starting the workers
+    """
+
+    if is_free_threaded() and timeout is None:
+        parallel_executor = Executor.THREAD
+    else:
+        parallel_executor = get_process_executor(threads)
+    workers = workers or get_default_workers(parallel_executor)
+
+    parallelism = min(workers, len(sizes), mp.cpu_count())
+    serial_seconds = sum(sizes) / FORMAT_BYTES_PER_SECOND
+    parallel_seconds = POOL_START_SECONDS[parallel_executor] + max(
+        serial_seconds / max(parallelism, 1),
+        max(sizes, default=0) / FORMAT_BYTES_PER_SECOND,
+    )
+
+    if timeout is None and (parallelism <= 1 or serial_seconds <= parallel_seconds):
+        return Executor.SERIAL, 1
+    return parallel_executor, workers
+
+
+def resolve_executor(
+    executor: Executor,
+    sizes: List[int],
+    workers: Optional[int] = None,
+    timeout: Optional[float] = None,
+    threads: bool = False,
+) -> Tuple[Executor, int]:
+    """
+    Executor and number of workers to use, selecting them with `select_executor` for `auto`.
+    With `threads`, the main process runs other threads while starting the workers, so fork is
+    replaced by forkserver
+    """
+
+    if executor == Executor.AUTO:
+        return select_executor(sizes, workers, timeout, threads)
+    if executor == Executor.SERIAL:
+        return executor, 1
+    if executor == Executor.FORK and threads:
+        executor = Executor.FORKSERVER
+    return executor, workers or get_default_workers(executor)
+
+
+def get_process_context(executor: Executor, preload: List[str]):
+    """
+    Multiprocessing context for the start method of `executor`, the forkserver importing the
+    `preload` modules once for all workers
+    """
+
+    context = mp.get_context(executor.value)
+    if executor == Executor.FORKSERVER:
+        context.set_forkserver_preload(preload)
+    return context
+
+
+def iter_in_threads(
+    function: Callable,
+    items: List,
+    workers: int,
+    ordered: bool = True,
+) -> Iterator[Tuple[Any, Any]]:
+    """
+    Yield (item, result) for all items, in order or as soon as available. Closing the iterator
+    before the end cancels the items not started yet
+    """
+
+    executor = ThreadPoolExecutor(workers)
+    futures = [executor.submit(function, item) for item in items]
+    item_by_future: Dict[Any, Any] = dict(zip(futures, items))
+
+    try:
+        if ordered:
+            for future in futures:
+                yield item_by_future[future], future.result()
+            return
+
+        not_done = set(futures)
+        while not_done:
+            done, not_done = wait(not_done, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield item_by_future[future], future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
@@ -0,0 +1,122 @@
+"""
+flake8 plugin reporting files that globality-black would reformat, so that a single (parallel)
+flake8 run covers both checks, formatting the source flake8 has already read. See README
+
+Errors are reported on the first line that would change:
+ - GB100: file would be reformatted by globality-black
+ - GB001: globality-black failed to format the file (e.g. invalid configuration)
+
+With --globality-black-store STORE_FILE (or GLOBALITY_BLACK_STORE set), outputs are kept in the
+content-addressed output store also used by the CLI (see output_store.py), so unchanged files are
+not formatted again in later runs, whatever the tool that formatted them first.
+"""
+import ast
+import os
+from pathlib import Path
+from typing import (
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from globality_black.black_handler import get_black_mode
+from globality_black.config import InvalidConfigError, get_features
+from globality_black.constants import DEFAULT_OUTPUT_STORE_MAX_SIZE_MB
+from globality_black.imports import get_isort_config
+from globality_black.output_store import get_store_key, open_output_store
+from globality_black.reformat_text import BlackError, reformat_text
+
+
+class GlobalityBlackChecker:
+
+    name = "globality-black"
+    version = "0.1.0"
+
+    store_path: Optional[Path] = None
+    store_max_size = DEFAULT_OUTPUT_STORE_MAX_SIZE_MB * 2 ** 20
+
+    def __init__(self, tree: ast.AST, lines: List[str], filename: str):
+        # taking the tree makes flake8 run the plugin once per file, only the lines are needed
+        self.lines = lines
+        self.filename = filename
+
+    @classmethod
+    def add_options(cls, parser):
+        parser.add_option(
+            "--globality-black-store",
+            default=os.environ.get("GLOBALITY_BLACK_STORE"),
+            parse_from_config=True,
+            help="Output store of globality-black, shared with its CLI (see --store)",
+        )
+        parser.add_option(
+            "--globality-black-store-max-size",
+            type=int,
+            default=DEFAULT_OUTPUT_STORE_MAX_SIZE_MB,
+            parse_from_config=True,
+            help="Maximum size of the output store in MB (default: %(default)s)",
+        )
+
+    @classmethod
+    def parse_options(cls, options):
+        store = options.globality_black_store
+        cls.store_path = Path(store) if store else None
+        cls.store_max_size = options.globality_black_store_max_size * 2 ** 20
+
+    def run(self) -> Iterator[Tuple[int, int, str, type]]:
+        input_code = "".join(self.lines)
+        path = Path(self.filename)
+        try:
+            output_code = format_source(input_code, path, self.store_path, self.store_max_size)
+        except (BlackError, InvalidConfigError) as e:
+            message = str(e).splitlines()[0] if str(e) else type(e).__name__
+            yield 1, 0, f"GB001 globality-black failed to format the file: {message}", type(self)
+            return
+
+        if output_code != input_code:
+            line = get_first_different_line(self.lines, output_code.splitlines(keepends=True))
+            yield line, 0, "GB100 file would be reformatted by globality-black", type(self)
+
+
+def format_source(
+    input_code: str,
+    path: Path,
+    store_path: Optional[Path] = None,
+    store_max_size: int = DEFAULT_OUTPUT_STORE_MAX_SIZE_MB * 2 ** 20,
+) -> str:
+    """
+    Output of globality-black for the code of `path`, from the output store if given and found
+    """
+
+    black_mode = get_black_mode(path)
+    features = get_features(path)
+    isort_config = get_isort_config(path)
+    if store_path is None:
+        return reformat_text(input_code, black_mode, features=features, isort_config=isort_config)
+
+    store = open_output_store(store_path, store_max_size)
+    store_key = get_store_key(input_code, black_mode, features, isort_config)
+    output_code = store.get(store_key, input_code)
+    if output_code is None:
+        output_code = reformat_text(
+            input_code,
+            black_mode,
+            features=features,
+            isort_config=isort_config,
+        )
+        store.put(store_key, input_code, output_code)
+    return output_code
+
+
+def get_first_different_line(input_lines: Sequence[str], output_lines: Sequence[str]) -> int:
+    """
+    First line (from 1) of the input that differs in the output, or the last line if lines are
+    only added or removed at the end
+    """
+
+    for index, (input_line, output_line) in enumerate(zip(input_lines, output_lines)):
+        if input_line != output_line:
+            return index + 1
+
+    return max(min(len(input_lines), len(output_lines) + 1), 1)
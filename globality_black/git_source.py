@@ -0,0 +1,153 @@
+"""
+Files of a git revision or of the index, read from the object database rather than from the
+worktree, see --git-rev
+
+This allows checking what is committed (or pushed) where there is no worktree, as in a
+pre-receive hook, or where it differs from the index, as in a pre-commit hook with unstaged
+changes. Files are listed with `git ls-tree` (or `git ls-files` for the index), and their contents
+streamed from a single `git cat-file --batch` process, read ahead of the formatting workers by
+the I/O pipeline (see io_pipeline.py)
+"""
+import subprocess
+import threading
+from pathlib import Path
+from typing import (
+    IO,
+    Dict,
+    List,
+    NamedTuple,
+    Sequence,
+    Tuple,
+    cast,
+)
+
+
+# revision standing for the index, i.e. the staged files
+INDEX_REVISION = ":"
+# regular files, executable or not (i.e. not symbolic links nor submodules)
+FILE_MODES = {"100644", "100755"}
+
+
+class GitError(Exception):
+    pass
+
+
+class GitFile(NamedTuple):
+    path: Path
+    object_id: str
+    size: int
+
+
+def list_git_files(revision: str, pathspecs: Sequence[str] = ()) -> List[GitFile]:
+    """
+    Python files of `revision`, or of the index for INDEX_REVISION, under the given paths (all if
+    none). Paths are relative to the current directory, as shown by git
+    """
+
+    entries = []
+    if revision == INDEX_REVISION:
+        output = run_git(["ls-files", "--stage", "-z", "--", *pathspecs])
+        for info, path in split_entries(output):
+            mode, object_id, stage = info.split()
+            # unmerged files have one entry per side of the conflict instead
+            if stage == "0":
+                entries.append((mode, object_id, path))
+    else:
+        output = run_git(["ls-tree", "-r", "-z", revision, "--", *pathspecs])
+        for info, path in split_entries(output):
+            mode, _, object_id = info.split()
+            entries.append((mode, object_id, path))
+
+    python_entries = [
+        (object_id, path)
+        for mode, object_id, path in entries
+        if mode in FILE_MODES and path.endswith(".py")
+    ]
+    sizes = get_object_sizes([object_id for object_id, _ in python_entries])
+    return [
+        GitFile(Path(path), object_id, sizes[object_id])
+        for object_id, path in python_entries
+    ]
+
+
+def split_entries(output: str) -> List[Tuple[str, str]]:
+    return [
+        tuple(entry.split("\t", 1))  # type: ignore
+        for entry in output.split("\0")
+        if entry
+    ]
+
+
+def get_object_sizes(object_ids: Sequence[str]) -> Dict[str, int]:
+    if not object_ids:
+        return {}
+
+    object_lines = "".join(f"{object_id}\n" for object_id in object_ids)
+    output = run_git(["cat-file", "--batch-check"], object_lines)
+    sizes = {}
+    for line in output.splitlines():
+        object_id, _, size = line.split()
+        sizes[object_id] = int(size)
+    return sizes
+
+
+def run_git(args: List[str], input_text: str = "") -> str:
+    try:
+        completed = subprocess.run(
+            ["git", *args],
+            input=input_text,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except OSError as e:
+        raise GitError(f"Cannot run git. {e}")
+    except subprocess.CalledProcessError as e:
+        raise GitError(f"git {args[0]} failed. {e.stderr.strip()}")
+    return completed.stdout
+
+
+class GitBlobReader:
+    def __init__(self, files: Sequence[GitFile]):
+        """
+        Contents of the given files, from a `git cat-file --batch` process kept open until closed
+        """
+
+        self.object_ids = {file.path: file.object_id for file in files}
+        self.process = subprocess.Popen(
+            ["git", "cat-file", "--batch"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        self.stdin = cast(IO[bytes], self.process.stdin)
+        self.stdout = cast(IO[bytes], self.process.stdout)
+        self.lock = threading.Lock()
+
+    def __enter__(self) -> "GitBlobReader":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def read(self, path: Path) -> str:
+        object_id = self.object_ids[path]
+        with self.lock:
+            self.stdin.write(f"{object_id}\n".encode())
+            self.stdin.flush()
+            # <object> blob <size>\n<contents>\n
+            header = self.stdout.readline().split()
+            if len(header) != 3 or header[1] != b"blob":
+                raise GitError(f"Cannot read {path} ({object_id}) from git")
+            contents = self.stdout.read(int(header[2]) + 1)[:-1]
+
+        try:
+            return contents.decode()
+        except UnicodeDecodeError as e:
+            raise GitError(f"Cannot decode {path} ({object_id}). {e}")
+
+    def close(self):
+        # forked workers share the pipes, hence git may not see the end of its input
+        self.process.kill()
+        self.process.wait()
+        self.stdin.close()
+        self.stdout.close()
@@ -0,0 +1,73 @@
+"""
+Optional import-sorting stage, applying isort before black in the same process, so that pairing
+globality-black with isort does not read, tokenize and write every file twice
+
+Enabled with `sort-imports = true` in the `[tool.globality-black]` table of pyproject.toml, or
+with --sort-imports. isort is used as a library (pip install globality-black[isort]), configured as
+when run on its own from the directory of the pyproject.toml of the file, i.e. from the
+`[tool.isort]` table of the same pyproject.toml, or setup.cfg, .isort.cfg, ... next to it
+"""
+import dataclasses
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Optional
+
+import black
+
+from globality_black.config import InvalidConfigError, get_sort_imports
+
+
+try:
+    import isort
+except ImportError:  # pragma: no cover
+    isort = None  # type: ignore
+
+
+def get_isort_config(src: Path, sort_imports: bool = False) -> Optional[Any]:
+    """
+    isort configuration for `src` if its imports are to be sorted, i.e. with `sort_imports` or
+    if enabled in its pyproject.toml, None otherwise
+    """
+
+    if not (sort_imports or get_sort_imports(src)):
+        return None
+
+    pyproject_path = black.find_pyproject_toml((str(src),))
+    directory = Path(pyproject_path).parent if pyproject_path else src.resolve().parent
+    return read_isort_config(str(directory))
+
+
+@lru_cache(maxsize=None)
+def read_isort_config(directory: str) -> Any:
+    """isort configuration found from `directory`, read once per process"""
+
+    if isort is None:
+        raise InvalidConfigError("isort is needed to sort imports: pip install isort")
+    return isort.Config(settings_path=directory)
+
+
+def sort_imports(code: str, isort_config: Any) -> str:
+    return isort.code(code, config=isort_config)
+
+
+def get_isort_config_key(isort_config: Any) -> str:
+    """
+    Settings and version of isort, as a string that is the same in all processes (sets are
+    sorted, their order depending on the hash seed), to key outputs in the output store
+    """
+
+    settings = [
+        (field.name, get_stable_value(getattr(isort_config, field.name)))
+        for field in dataclasses.fields(isort_config)
+    ]
+    return f"isort {isort.__version__} {settings!r}"
+
+
+def get_stable_value(value: Any) -> Any:
+    if isinstance(value, (set, frozenset)):
+        return sorted(repr(get_stable_value(item)) for item in value)
+    if isinstance(value, dict):
+        return sorted((repr(key), get_stable_value(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [get_stable_value(item) for item in value]
+    return value
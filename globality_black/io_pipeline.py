@@ -0,0 +1,176 @@
+"""
+Pipelined file I/O for the CLI, see --io-workers
+
+On network-backed volumes (e.g. CI checkouts), reading and writing files stalls the formatting
+workers on I/O latency. Instead, a pool of I/O threads in the main process reads the files ahead of
+the formatting workers, which receive the code of each file with its path, and writes back the
+reformatted files once the workers are done with them.
+
+I/O then overlaps with formatting, the main process only waiting when a worker is free before its
+next file is read, and for the last writes. Both the time spent on I/O and the time waited for it
+are measured, see IOStats.
+"""
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+)
+
+from globality_black.trace import Span, get_worker_id
+
+
+# files read ahead of the last one sent to the formatting workers, per (formatting or I/O) worker
+LOOKAHEAD_PER_WORKER = 2
+
+
+class Source(NamedTuple):
+    path: Path
+    # None if the file could not be read, see error
+    code: Optional[str]
+    error: Optional[str] = None
+
+
+class IOStats:
+    def __init__(self):
+        self.files_read = 0
+        self.read_seconds = 0.0
+        self.files_written = 0
+        self.write_seconds = 0.0
+        # time spent waiting for the I/O threads, by the main process (or formatting threads)
+        self.wait_seconds = 0.0
+
+    @property
+    def overlap(self) -> float:
+        """Fraction of the time spent on I/O that overlapped with formatting"""
+
+        io_seconds = self.read_seconds + self.write_seconds
+        if io_seconds == 0:
+            return 1.0
+        return max(1 - self.wait_seconds / io_seconds, 0.0)
+
+    def get_report(self) -> str:
+        return (
+            f"I/O threads read {self.files_read} files in {self.read_seconds:.2f}s and wrote "
+            f"{self.files_written} in {self.write_seconds:.2f}s, which were waited for "
+            f"{self.wait_seconds:.2f}s ({self.overlap:.0%} overlapped with formatting)"
+        )
+
+
+class IOPipeline:
+    def __init__(
+        self,
+        paths: Sequence[Path],
+        io_workers: int,
+        lookahead: int,
+        trace: bool = False,
+        read_code: Optional[Callable[[Path], str]] = None,
+    ):
+        """
+        Read `paths` in order with `io_workers` threads, up to `lookahead` files ahead of the last
+        one requested with `read`, starting right away. With `trace`, the I/O and the waits for it
+        are recorded as spans (see trace.py)
+
+        Files are read from disk, or with `read_code` if given (e.g. from git, see git_source.py)
+        """
+
+        self.paths = list(paths)
+        self.indexes = {path: index for index, path in enumerate(self.paths)}
+        self.lookahead = lookahead
+        self.read_code = read_code
+        self.executor = ThreadPoolExecutor(io_workers, thread_name_prefix="globality-black-io")
+        self.reads: Dict[int, Future] = {}
+        self.next_index = 0
+        self.lock = threading.Lock()
+        self.stats = IOStats()
+        self.spans: Optional[List[Span]] = [] if trace else None
+
+        self.read_ahead(lookahead)
+
+    def __enter__(self) -> "IOPipeline":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def read(self, path: Path) -> Source:
+        """
+        Code of a file, waiting for it if not read yet, and reading the next files ahead
+        """
+
+        with self.lock:
+            index = self.indexes[path]
+            self.read_ahead(index + 1 + self.lookahead)
+            future = self.reads.pop(index)
+        return self.wait(future)
+
+    def write(self, path: Path, code: str) -> Future:
+        return self.executor.submit(self.run_io, "write back", path, path.write_text, code)
+
+    def wait(self, future: Future) -> Any:
+        """Result of an I/O operation, timing the wait if not done yet"""
+
+        if future.done():
+            return future.result()
+
+        start = time.perf_counter()
+        try:
+            return future.result()
+        finally:
+            seconds = time.perf_counter() - start
+            with self.lock:
+                self.stats.wait_seconds += seconds
+            self.add_span("wait for I/O", start, seconds)
+
+    def close(self):
+        """Wait for the writes, skipping the reads not started yet (e.g. stopping early)"""
+
+        for future in self.reads.values():
+            future.cancel()
+        self.executor.shutdown(wait=True)
+
+    def read_ahead(self, end: int):
+        # called with the lock held
+        while self.next_index < min(end, len(self.paths)):
+            path = self.paths[self.next_index]
+            self.reads[self.next_index] = self.executor.submit(self.read_file, path)
+            self.next_index += 1
+
+    def read_file(self, path: Path) -> Source:
+        try:
+            if self.read_code is None:
+                # looked up here rather than bound as a default, so Path.read_text can be patched
+                code = self.run_io("prefetch", path, path.read_text)
+            else:
+                code = self.run_io("prefetch", path, self.read_code, path)
+            return Source(path, code)
+        except Exception as e:
+            # the file fails, as any other error processing it
+            return Source(path, None, str(e))
+
+    def run_io(self, name: str, path: Path, function: Callable, *args) -> Any:
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            seconds = time.perf_counter() - start
+            with self.lock:
+                if name == "prefetch":
+                    self.stats.files_read += 1
+                    self.stats.read_seconds += seconds
+                else:
+                    self.stats.files_written += 1
+                    self.stats.write_seconds += seconds
+            self.add_span(name, start, seconds, path=str(path))
+
+    def add_span(self, name: str, start: float, seconds: float, **args):
+        if self.spans is not None:
+            # list.append is atomic
+            self.spans.append(Span(name, start, seconds, get_worker_id(), args))
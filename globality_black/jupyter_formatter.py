@@ -1,11 +1,13 @@
 """Helper class to use with `jupyterlab_code_formatter` Jupyter extension. See README for details"""
 
 import logging
+import os
 import re
 
 import black
 from jupyterlab_code_formatter.formatters import BaseFormatter, handle_line_ending_and_magic
 
+from globality_black.imports import read_isort_config
 from globality_black.reformat_text import reformat_text
 
 
@@ -13,8 +15,10 @@ class GlobalityBlackFormatter(BaseFormatter):
 
     label = "Apply Globality Black Formatter"
 
-    def __init__(self, line_length=100):
+    def __init__(self, line_length=100, sort_imports=False):
         self.line_length = line_length
+        # sort imports with isort first, configured from the working directory of JupyterLab
+        self.sort_imports = sort_imports
 
     @property
     def importable(self) -> bool:
@@ -36,4 +40,6 @@ class GlobalityBlackFormatter(BaseFormatter):
         # see https://github.com/ryantam626/jupyterlab_code_formatter/issues/87
         # black_mode = black.Mode(**options)
 
-        return reformat_text(code, black_mode)
+        isort_config = read_isort_config(os.getcwd()) if self.sort_imports else None
+
+        return reformat_text(code, black_mode, isort_config=isort_config)
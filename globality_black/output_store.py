@@ -0,0 +1,252 @@
+"""
+Content-addressed store of formatted outputs, shareable across branches, checkouts and CI jobs
+
+Entries map a hash of (input code, black mode, features, isort settings, engines, formatter
+version) to the hash of the output and the output itself, so identical files are never reformatted
+twice, whatever their path or mtime.
+Outputs identical to their input (the most common case) are stored without the code.
+
+The store is a SQLite database in WAL mode, so it is safe to share between concurrent workers and
+processes, and can be saved / restored as a CI cache artifact. Its size is capped, evicting the
+least recently used entries first. Each entry counts for its key, output hash and stored output (if
+any) plus a fixed overhead, and the total is kept up to date in the database as entries are added
+and evicted, so that putting an entry does not scan the store.
+"""
+import hashlib
+import importlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+from typing import (
+    Any,
+    Dict,
+    FrozenSet,
+    Iterator,
+    Optional,
+    Tuple,
+    cast,
+)
+
+import black
+
+from globality_black.constants import (
+    ALL_FEATURES,
+    DEFAULT_OUTPUT_STORE_MAX_SIZE,
+    Feature,
+    PostProcessingEngine,
+    PreProcessingEngine,
+)
+from globality_black.imports import get_isort_config_key
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outputs (
+    key TEXT PRIMARY KEY,
+    output_hash TEXT NOT NULL,
+    output TEXT,
+    size INTEGER NOT NULL,
+    verified INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outputs_last_used ON outputs (last_used);
+CREATE TABLE IF NOT EXISTS store_size (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    total INTEGER NOT NULL
+);
+"""
+# approximate bytes per entry besides its key, output hash and output: the other columns, the
+# row headers and the index entries
+ENTRY_OVERHEAD = 64
+# seconds to wait for a concurrent writer
+BUSY_TIMEOUT = 60
+# modules whose code determines the output, see get_formatter_version
+FORMATTER_MODULES = [
+    "globality_black.black_tree",
+    "globality_black.blank_lines",
+    "globality_black.common",
+    "globality_black.comprehensions",
+    "globality_black.constants",
+    "globality_black.dotted_chains",
+    "globality_black.imports",
+    "globality_black.reformat_text",
+    "globality_black.tokenize_cover",
+    "globality_black.tuples",
+]
+
+
+class OutputStore:
+    def __init__(self, path: Path, max_size: int = DEFAULT_OUTPUT_STORE_MAX_SIZE):
+        """
+        max_size is the maximum size in bytes of the stored entries
+        """
+
+        self.path = path
+        self.max_size = max_size
+        self.connection = sqlite3.connect(str(path), timeout=BUSY_TIMEOUT, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+        if self.connection.execute("SELECT total FROM store_size").fetchone() is None:
+            # new store, or created by a version not keeping the total
+            self.connection.execute(
+                "INSERT OR IGNORE INTO store_size SELECT 0, COALESCE(SUM(size), 0) FROM outputs",
+            )
+
+    def get(self, key: str, input_code: str, verified: bool = False) -> Optional[str]:
+        """
+        Return the stored output for `key` if any. If `verified`, only return outputs checked in
+        safe mode
+        """
+
+        row = self.connection.execute(
+            "SELECT output_hash, output, verified FROM outputs WHERE key = ?",
+            (key,),
+        ).fetchone()
+        if row is None or verified and not row[2]:
+            return None
+
+        output_hash, output_code, _ = row
+        if output_code is None:
+            output_code = input_code
+        if get_hash(output_code) != output_hash:
+            # corrupted entry, format again
+            return None
+
+        self.connection.execute(
+            "UPDATE outputs SET last_used = ? WHERE key = ?",
+            (time.time(), key),
+        )
+        return output_code
+
+    def put(self, key: str, input_code: str, output_code: str, verified: bool = False):
+        stored_output = None if output_code == input_code else output_code
+        output_hash = get_hash(output_code)
+        size = get_entry_size(key, output_hash, stored_output)
+
+        with self.transaction():
+            row = self.connection.execute(
+                "SELECT size FROM outputs WHERE key = ?",
+                (key,),
+            ).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?, ?)",
+                (key, output_hash, stored_output, size, int(verified), time.time()),
+            )
+            self.add_size(size - (row[0] if row is not None else 0))
+            self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the stored outputs fit in max_size
+        """
+
+        excess = self.get_size() - self.max_size
+        if excess <= 0:
+            return
+
+        rows = self.connection.execute("SELECT key, size FROM outputs ORDER BY last_used")
+        keys_to_delete = []
+        evicted_size = 0
+        for key, size in rows:
+            if evicted_size >= excess:
+                break
+            keys_to_delete.append((key,))
+            evicted_size += size
+
+        self.connection.executemany("DELETE FROM outputs WHERE key = ?", keys_to_delete)
+        self.add_size(-evicted_size)
+
+    def add_size(self, size: int):
+        self.connection.execute("UPDATE store_size SET total = total + ?", (size,))
+
+    def get_size(self) -> int:
+        return self.connection.execute("SELECT total FROM store_size").fetchone()[0]
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """
+        Write transaction, so that concurrent workers keep the total size consistent
+        """
+
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def close(self):
+        self.connection.close()
+
+
+# one connection per process and thread (and path), since connections cannot be shared with
+# forked workers nor used from other threads
+OPEN_STORES: Dict[Tuple[int, int, str, int], OutputStore] = {}
+
+
+def open_output_store(path: Path, max_size: int = DEFAULT_OUTPUT_STORE_MAX_SIZE) -> OutputStore:
+    store_key = (os.getpid(), threading.get_ident(), str(path), max_size)
+    if store_key not in OPEN_STORES:
+        OPEN_STORES[store_key] = OutputStore(path, max_size)
+    return OPEN_STORES[store_key]
+
+
+def get_store_key(
+    input_code: str,
+    black_mode: black.Mode,
+    features: FrozenSet[Feature] = ALL_FEATURES,
+    isort_config: Optional[Any] = None,
+    post_engine: PostProcessingEngine = PostProcessingEngine.PARSO,
+    pre_engine: PreProcessingEngine = PreProcessingEngine.PARSO,
+) -> str:
+    """
+    Hash of the input code, black mode, enabled features, isort settings (if sorting imports),
+    engines and version of the formatter. The engines are part of the key since they may give
+    different outputs on code parso mis-parses (see tokenize_cover.py)
+    """
+
+    features_key = ",".join(sorted(feature.value for feature in features))
+    isort_key = get_isort_config_key(isort_config) if isort_config is not None else ""
+    return get_hash("\0".join([
+        get_formatter_version(),
+        get_mode_key(black_mode),
+        features_key,
+        isort_key,
+        f"{pre_engine.value},{post_engine.value}",
+        input_code,
+    ]))
+
+
+def get_mode_key(black_mode: black.Mode) -> str:
+    if hasattr(black_mode, "get_cache_key"):
+        return black_mode.get_cache_key()
+    return repr(black_mode)
+
+
+@lru_cache(maxsize=1)
+def get_formatter_version() -> str:
+    """
+    Version of black and hash of the modules of globality-black determining the output, so that
+    any change to either invalidates the stored outputs, including in development, while changes
+    to other modules (e.g. the CLI) keep them. The files hashed are those actually loaded, i.e.
+    the compiled extensions in a mypyc build (see setup.py)
+    """
+
+    digest = hashlib.sha256()
+    for module_name in FORMATTER_MODULES:
+        module_path = Path(cast(str, importlib.import_module(module_name).__file__))
+        digest.update(module_path.read_bytes())
+    return f"{black.__version__}-{digest.hexdigest()}"
+
+
+def get_entry_size(key: str, output_hash: str, stored_output: Optional[str]) -> int:
+    output_size = len(stored_output.encode()) if stored_output is not None else 0
+    return len(key) + len(output_hash) + output_size + ENTRY_OVERHEAD
+
+
+def get_hash(code: str) -> str:
+    return hashlib.sha256(code.encode()).hexdigest()
@@ -0,0 +1,95 @@
+"""
+Incremental reparsing for repeated formatting of the same buffer (editors, daemons, watch mode)
+
+When `reformat_text` is given a cache key (e.g. the path of the file or a buffer id), the parso
+trees of the input and of black's output are kept and, on the next call with the same key, they
+are updated with parso's diff parser (through parso's grammar cache) instead of being rebuilt from
+scratch. Hence, the reparse cost is proportional to the edit.
+
+The processing modifies the prefixes of the tree in place. Since the diff parser needs the cached
+tree to match the cached code, every modified prefix is recorded (see `common.set_leaf_prefix`)
+and restored once we are done with the tree.
+
+The number of cached trees is bounded, the least recently used being dropped first.
+"""
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import (
+    Dict,
+    Iterator,
+    Optional,
+    Tuple,
+)
+
+import parso
+from parso.cache import parser_cache
+from parso.file_io import FileIO
+from parso.python.tree import Leaf, Module
+
+from globality_black.common import ORIGINAL_PREFIXES
+from globality_black.constants import DEFAULT_PARSE_CACHE_SIZE
+from globality_black.trace import span
+
+
+class ParseCache:
+    def __init__(self, max_size: int = DEFAULT_PARSE_CACHE_SIZE):
+        self.max_size = max_size
+        self.grammar = parso.load_grammar()
+        self.keys: "OrderedDict[str, None]" = OrderedDict()
+        # the diff parser updates the cached tree in place, one user at a time
+        self.lock = threading.RLock()
+
+    @contextmanager
+    def parse(
+        self,
+        code: str,
+        cache_key: Optional[str] = None,
+        span_name: str = "parse",
+    ) -> Iterator[Module]:
+        """
+        Parse `code`, reusing the tree parsed for the previous code with the same `cache_key` (if
+        any). Prefixes modified within the context are restored on exit. Parsing is traced as
+        `span_name`, see trace.py
+        """
+
+        if cache_key is None:
+            with span(span_name):
+                module = parso.parse(code)
+            yield module
+            return
+
+        with self.lock:
+            with span(span_name):
+                module = self.grammar.parse(code, path=cache_key, diff_cache=True)
+            self.touch(cache_key)
+
+            original_prefixes: Dict[int, Tuple[Leaf, str]] = {}
+            ORIGINAL_PREFIXES[id(module)] = original_prefixes
+            try:
+                yield module
+            finally:
+                del ORIGINAL_PREFIXES[id(module)]
+                for leaf, prefix in original_prefixes.values():
+                    leaf.prefix = prefix
+
+    def touch(self, cache_key: str):
+        self.keys[cache_key] = None
+        self.keys.move_to_end(cache_key)
+        while len(self.keys) > self.max_size:
+            oldest_key, _ = self.keys.popitem(last=False)
+            self.evict(oldest_key)
+
+    def evict(self, cache_key: str):
+        # parso keys its cache by path
+        cached_trees = parser_cache.get(self.grammar._hashed, {})
+        cached_trees.pop(FileIO(cache_key).path, None)
+
+    def clear(self):
+        with self.lock:
+            for cache_key in self.keys:
+                self.evict(cache_key)
+            self.keys.clear()
+
+
+PARSE_CACHE = ParseCache()
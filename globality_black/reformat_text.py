@@ -1,78 +1,347 @@
+from collections import Counter
+from pathlib import Path
+from typing import (
+    Any,
+    FrozenSet,
+    Optional,
+    cast,
+)
+
 import black
-import parso
+from parso.python.tree import Module, PythonNode
 
+from globality_black.black_tree import postprocess_black_tree
 from globality_black.blank_lines import cover_blank_lines, uncover_blank_lines
-from globality_black.common import SyntaxTreeVisitor
+from globality_black.common import (
+    FmtOffRegions,
+    SyntaxTreeVisitor,
+    find_fmt_off_regions,
+    get_code,
+)
 from globality_black.comprehensions import reformat_comprehension
 from globality_black.constants import (
+    ALL_FEATURES,
     BLANK_LINES_TYPES,
     COMPREHENSIONS_TYPES,
+    COVER_FEATURE_TOKENS,
+    COVER_FEATURES,
     DOTTED_CHAIN_TYPES,
     TUPLE_TYPES,
+    Feature,
+    PostProcessingEngine,
+    PreProcessingEngine,
 )
 from globality_black.dotted_chains import cover_dotted_chain_if_needed, uncover_dotted_chain
+from globality_black.imports import sort_imports
+from globality_black.parse_cache import PARSE_CACHE
+from globality_black.stats import (
+    BLACK_BYTES_IN,
+    BLACK_BYTES_OUT,
+    SENTINELS_PREFIX,
+    get_counters,
+)
+from globality_black.tokenize_cover import TokenizeError, cover_with_tokenize
+from globality_black.trace import span
 from globality_black.tuples import cover_tuple_if_needed, uncover_tuple
 
 
+# whether this module (and the other pre/post-processing modules) is compiled with mypyc, see
+# setup.py. As black.COMPILED
+COMPILED = Path(__file__).suffix in (".pyd", ".so")
+
+
 class BlackError(Exception):
     pass
 
 
-def reformat_text(file_contents, black_mode):
+class UnsafeReformatError(BlackError):
+    """Reformatted code is not equivalent to the input, or not stable (only raised in safe mode)"""
+
+
+def reformat_text(
+    file_contents: str,
+    black_mode: black.Mode,
+    safe: bool = False,
+    post_engine: PostProcessingEngine = PostProcessingEngine.PARSO,
+    pre_engine: PreProcessingEngine = PreProcessingEngine.PARSO,
+    cache_key: Optional[str] = None,
+    features: FrozenSet[Feature] = ALL_FEATURES,
+    isort_config: Optional[Any] = None,
+) -> str:
+    """
+    Apply globality-black to the given code
+
+    If safe, check that the output is AST-equivalent to the input and a fixed point of a second
+    run, raising UnsafeReformatError otherwise. Note this roughly doubles the cost per file
+
+    post_engine selects the syntax tree used for post-processing: parso (reparsing black's
+    output) or blib2to3 (black's own parser, see black_tree.py). Similarly, pre_engine selects
+    how lines are covered before black: parso or tokenize (see tokenize_cover.py). All
+    combinations give the same output, except on code parso mis-parses (see tokenize_cover.py)
+
+    When formatting the same buffer repeatedly (e.g. in an editor), pass a cache_key identifying
+    it (e.g. its path) to reparse it incrementally with parso, see parse_cache.py
+
+    features selects the globality-black features to apply (see constants.Feature), the passes
+    of the others being skipped. With no features, this is just black
+
+    If an isort_config is given (see imports.py), imports are sorted with isort first
+    """
+
+    output_code = _reformat_text(
+        file_contents,
+        black_mode,
+        post_engine,
+        pre_engine,
+        cache_key,
+        features,
+        isort_config,
+    )
+
+    if safe:
+        assert_safe_reformat(
+            file_contents,
+            output_code,
+            black_mode,
+            post_engine,
+            pre_engine,
+            features,
+            isort_config,
+        )
+
+    return output_code
 
-    module = parso.parse(file_contents)
+
+def assert_safe_reformat(
+    input_code: str,
+    output_code: str,
+    black_mode: black.Mode,
+    post_engine: PostProcessingEngine = PostProcessingEngine.PARSO,
+    pre_engine: PreProcessingEngine = PreProcessingEngine.PARSO,
+    features: FrozenSet[Feature] = ALL_FEATURES,
+    isort_config: Optional[Any] = None,
+) -> None:
+    """
+    Check that `output_code` is AST-equivalent to `input_code` and that reformatting it again
+    leaves it unchanged. Unlike black, we verify the final output, i.e. after post-processing
+
+    Moving imports changes the AST, so with an isort_config the output is compared to the input
+    with sorted imports, trusting isort as when running it before black
+    """
+
+    if input_code == output_code:
+        # unchanged code is trivially equivalent, and stable since it is already the output
+        return
+
+    if isort_config is not None:
+        input_code = sort_imports(input_code, isort_config)
+
+    try:
+        black.assert_equivalent(input_code, output_code)
+    except Exception as e:
+        raise UnsafeReformatError(f"Output is not equivalent to the source. {e}")
+
+    second_output_code = _reformat_text(
+        output_code,
+        black_mode,
+        post_engine,
+        pre_engine,
+        features=features,
+        isort_config=isort_config,
+    )
+    if second_output_code != output_code:
+        raise UnsafeReformatError("Output is not stable, a second pass produces different code")
+
+
+def _reformat_text(
+    file_contents: str,
+    black_mode: black.Mode,
+    post_engine: PostProcessingEngine,
+    pre_engine: PreProcessingEngine,
+    cache_key: Optional[str] = None,
+    features: FrozenSet[Feature] = ALL_FEATURES,
+    isort_config: Optional[Any] = None,
+) -> str:
+
+    # IMPORTS
+
+    if isort_config is not None:
+        try:
+            with span("sort imports"):
+                file_contents = sort_imports(file_contents, isort_config)
+        except Exception as e:
+            raise BlackError(e)
 
     # PRE-PROCESSING
 
+    cover_features = features & COVER_FEATURES
+    if not cover_features:
+        code_to_format = file_contents
+    elif pre_engine == PreProcessingEngine.TOKENIZE:
+        try:
+            with span("cover (tokenize)"):
+                code_to_format = cover_with_tokenize(file_contents, cover_features)
+        except TokenizeError:
+            # let parso (with error recovery) and black decide on code we cannot tokenize
+            code_to_format = cover_with_parso(file_contents, cache_key, cover_features)
+    else:
+        code_to_format = cover_with_parso(file_contents, cache_key, cover_features)
+
+    counters = get_counters()
+    if counters is not None:
+        count_sentinels(counters, file_contents, code_to_format, cover_features)
+
+    # BLACK
+
+    try:
+        with span("black"):
+            code_after_black = black.format_str(code_to_format, mode=black_mode)
+    except Exception as e:
+        raise BlackError(e)
+
+    if counters is not None:
+        counters[BLACK_BYTES_IN] += len(code_to_format.encode())
+        counters[BLACK_BYTES_OUT] += len(code_after_black.encode())
+
+    # POST-PROCESSING
+
+    post_features = get_post_features(code_to_format, code_after_black, features)
+    if not post_features:
+        # nothing to explode nor to uncover, skip parsing black's output
+        return code_after_black
+
+    if post_engine == PostProcessingEngine.BLIB2TO3:
+        return postprocess_black_tree(code_after_black, black_mode, post_features)
+
+    post_cache_key = None if cache_key is None else f"{cache_key}:black"
+    return postprocess_with_parso(code_after_black, post_cache_key, post_features)
+
+
+def count_sentinels(
+    counters: Counter,
+    file_contents: str,
+    code_to_format: str,
+    cover_features: FrozenSet[Feature],
+) -> None:
+    """Count the sentinels inserted by pre-processing (either engine), per token"""
+
+    for feature in cover_features:
+        token = COVER_FEATURE_TOKENS[feature]
+        inserted = code_to_format.count(token) - file_contents.count(token)
+        counters[SENTINELS_PREFIX + token] += inserted
+
+
+def get_post_features(
+    code_to_format: str,
+    code_after_black: str,
+    features: FrozenSet[Feature],
+) -> FrozenSet[Feature]:
+    """
+    Features with some post-processing to do: comprehensions if black's output has any `for`,
+    and the covering features whose sentinels are found in the pre-processed code, since
+    otherwise none was inserted and there is nothing to uncover
+    """
+
+    post_features = {
+        feature
+        for feature in features & COVER_FEATURES
+        if COVER_FEATURE_TOKENS[feature] in code_to_format
+    }
+    if Feature.COMPREHENSIONS in features and "for" in code_after_black:
+        post_features.add(Feature.COMPREHENSIONS)
+
+    return frozenset(post_features)
+
+
+def cover_with_parso(
+    file_contents: str,
+    cache_key: Optional[str] = None,
+    features: FrozenSet[Feature] = ALL_FEATURES,
+) -> str:
+
+    with PARSE_CACHE.parse(file_contents, cache_key) as module:
+        fmt_off_regions = find_fmt_off_regions(module, file_contents)
+        return _cover_with_parso(module, fmt_off_regions, features)
+
+
+def _cover_with_parso(
+    module: Module,
+    fmt_off_regions: FmtOffRegions,
+    features: FrozenSet[Feature] = ALL_FEATURES,
+) -> str:
+
     # cover blank lines if needed
-    finder = SyntaxTreeVisitor(module, BLANK_LINES_TYPES)
-    for element in finder(module):
-        cover_blank_lines(module, element)
+    if Feature.BLANK_LINES in features:
+        with span("cover blank lines"):
+            finder = SyntaxTreeVisitor(module, BLANK_LINES_TYPES, fmt_off_regions)
+            for element in finder(module):
+                cover_blank_lines(module, element)
 
     # cover dotted chains
-    finder = SyntaxTreeVisitor(module, DOTTED_CHAIN_TYPES)
-    for element in finder(module):
-        cover_dotted_chain_if_needed(element)
+    if Feature.DOTTED_CHAINS in features:
+        with span("cover dotted chains"):
+            finder = SyntaxTreeVisitor(module, DOTTED_CHAIN_TYPES, fmt_off_regions)
+            for element in finder(module):
+                cover_dotted_chain_if_needed(cast(PythonNode, element))
 
     # cover size one tuples
     # TODO: remove this once/if https://github.com/psf/black/issues/1139#issuecomment-951014094
     #  solved
-    finder = SyntaxTreeVisitor(module, TUPLE_TYPES)
-    for element in finder(module):
-        cover_tuple_if_needed(element)
+    if Feature.TUPLES in features:
+        with span("cover tuples"):
+            finder = SyntaxTreeVisitor(module, TUPLE_TYPES, fmt_off_regions)
+            for element in finder(module):
+                cover_tuple_if_needed(cast(PythonNode, element))
 
-    # BLACK
+    return get_code(module)
 
-    try:
-        code_after_black = black.format_str(module.get_code(), mode=black_mode)
-    except Exception as e:
-        raise BlackError(e)
 
-    module = parso.parse(code_after_black)
+def postprocess_with_parso(
+    code_after_black: str,
+    cache_key: Optional[str] = None,
+    features: FrozenSet[Feature] = ALL_FEATURES,
+) -> str:
 
-    # POST-PROCESSING
+    with PARSE_CACHE.parse(code_after_black, cache_key, span_name="reparse") as module:
+        fmt_off_regions = find_fmt_off_regions(module, code_after_black)
+        return _postprocess_with_parso(module, fmt_off_regions, features)
+
+
+def _postprocess_with_parso(
+    module: Module,
+    fmt_off_regions: FmtOffRegions,
+    features: FrozenSet[Feature] = ALL_FEATURES,
+) -> str:
 
     # comprehensions
-    finder = SyntaxTreeVisitor(module, COMPREHENSIONS_TYPES)
-    for element in finder(module):
-        if element.type == "sync_comp_for":
-            reformat_comprehension(element)
+    if Feature.COMPREHENSIONS in features:
+        with span("explode comprehensions"):
+            finder = SyntaxTreeVisitor(module, COMPREHENSIONS_TYPES, fmt_off_regions)
+            for element in finder(module):
+                if element.type == "sync_comp_for":
+                    reformat_comprehension(cast(PythonNode, element))
 
     # uncover blank lines protected during pre-processing
-    finder = SyntaxTreeVisitor(module, BLANK_LINES_TYPES)
-    for element in finder(module):
-        uncover_blank_lines(module, element)
+    if Feature.BLANK_LINES in features:
+        with span("uncover blank lines"):
+            finder = SyntaxTreeVisitor(module, BLANK_LINES_TYPES, fmt_off_regions)
+            for element in finder(module):
+                uncover_blank_lines(module, element)
 
     # uncover lines from dotted chains protected during pre-processing
-    finder = SyntaxTreeVisitor(module, DOTTED_CHAIN_TYPES)
-    for element in finder(module):
-        uncover_dotted_chain(module, element)
+    if Feature.DOTTED_CHAINS in features:
+        with span("uncover dotted chains"):
+            finder = SyntaxTreeVisitor(module, DOTTED_CHAIN_TYPES, fmt_off_regions)
+            for element in finder(module):
+                uncover_dotted_chain(module, element)
 
-    # cover size one tuples
+    # uncover size one tuples
     # TODO: remove this once/if https://github.com/psf/black/issues/1139#issuecomment-951014094
     #  solved
-    finder = SyntaxTreeVisitor(module, TUPLE_TYPES)
-    for element in finder(module):
-        uncover_tuple(module, element)
+    if Feature.TUPLES in features:
+        with span("uncover tuples"):
+            finder = SyntaxTreeVisitor(module, TUPLE_TYPES, fmt_off_regions)
+            for element in finder(module):
+                uncover_tuple(module, element)
 
-    return module.get_code()
+    return get_code(module)
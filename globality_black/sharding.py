@@ -0,0 +1,90 @@
+"""
+Deterministic sharding of the files to process, to distribute a full-repo check across N CI jobs
+
+Files are balanced by weight rather than by count, so that all shards take about the same time:
+by default, the weight is the file size. If the summary of a previous run is given (see
+summary.py), the recorded durations are used instead, estimating the duration of new files from
+their size. Sizes may be given instead of read from disk, e.g. for files read from git.
+
+Files are assigned greedily, heaviest first, to the lightest shard so far (ties broken by path
+and shard index), so every job computes the same partition from the same files.
+"""
+import heapq
+from pathlib import Path
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+from globality_black.summary import get_path_key
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """
+    Parse `i/N`, the i-th shard (starting at 1) out of N
+    """
+
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard must be of the form i/N, e.g. 1/4, got {value!r}")
+
+    if not 1 <= index <= count:
+        raise ValueError(f"Shard index must be between 1 and {count}, got {index}")
+
+    return index, count
+
+
+def select_shard(
+    paths: List[Path],
+    index: int,
+    count: int,
+    durations: Optional[Dict[str, float]] = None,
+    sizes: Optional[Dict[Path, int]] = None,
+) -> List[Path]:
+    """
+    Return the paths of the `index`-th shard out of `count`, in the original order
+
+    The sizes of the files are read from disk unless given
+    """
+
+    weights = get_weights(paths, durations, sizes)
+    by_weight = sorted(paths, key=lambda path: (-weights[path], get_path_key(path)))
+
+    loads = [(0.0, shard_index) for shard_index in range(1, count + 1)]
+    selected = set()
+    for path in by_weight:
+        load, shard_index = heapq.heappop(loads)
+        if shard_index == index:
+            selected.add(path)
+        heapq.heappush(loads, (load + weights[path], shard_index))
+
+    return [path for path in paths if path in selected]
+
+
+def get_weights(
+    paths: List[Path],
+    durations: Optional[Dict[str, float]],
+    sizes: Optional[Dict[Path, int]] = None,
+) -> Dict[Path, float]:
+    size_weights = {
+        path: float(sizes[path] if sizes is not None else path.stat().st_size)
+        for path in paths
+    }
+    if not durations:
+        return size_weights
+
+    recorded = {
+        path: durations[get_path_key(path)]
+        for path in paths
+        if get_path_key(path) in durations
+    }
+    recorded_size = sum(size_weights[path] for path in recorded)
+    seconds_per_byte = sum(recorded.values()) / recorded_size if recorded_size else 1.0
+
+    return {
+        path: recorded.get(path, size_weights[path] * seconds_per_byte)
+        for path in paths
+    }
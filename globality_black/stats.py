@@ -0,0 +1,82 @@
+"""
+Counters of the work done by the hot paths of the formatter, see --stats
+
+Each file is processed within `record_counters`, collecting the counts added with `count` in the
+same thread: nodes visited by the syntax tree traversals, leaf lookups to find indentations,
+sentinels inserted per token, comprehensions exploded, trees turned back into code, and bytes in
+and out of black. Counters travel back to the main process with the result of the file and are
+summed over all files, whatever the worker.
+
+Unlike timings, counts do not depend on the machine nor on its load, so they show how the work
+grows with the input, e.g. that traversals visit each node a bounded number of times. They can
+also be collected around any library call:
+
+    with record_counters() as counters:
+        reformat_text(code, black_mode)
+
+As for spans (see trace.py), `count` only checks a thread-local outside `record_counters`
+"""
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Iterator, Mapping, Optional
+
+
+# nodes yielded or skipped by SyntaxTreeVisitor, and number of traversals
+VISITOR_NODES = "visitor.nodes"
+VISITOR_TRAVERSALS = "visitor.traversals"
+# get_leaf_for_position calls to find the indentation of a line, see find_indentation_parent_prefix
+INDENTATION_LEAF_LOOKUPS = "indentation.leaf_lookups"
+# sentinel comments inserted before black, per token (e.g. sentinels.TUPLE_TOKEN)
+SENTINELS_PREFIX = "sentinels."
+COMPREHENSIONS_EXPLODED = "comprehensions.exploded"
+GET_CODE_CALLS = "get_code.calls"
+# UTF-8 encoded sizes of the code given to black, and of its output
+BLACK_BYTES_IN = "black.bytes_in"
+BLACK_BYTES_OUT = "black.bytes_out"
+
+
+LOCAL = threading.local()
+
+
+def count(name: str, value: int = 1):
+    """Add `value` to a counter, if recording counters in this thread"""
+
+    counters = getattr(LOCAL, "counters", None)
+    if counters is not None:
+        counters[name] += value
+
+
+def get_counters() -> Optional[Counter]:
+    """
+    Counters being recorded in this thread, if any, to skip computing counts (e.g. encoding code
+    to count its bytes) when not recording
+    """
+
+    return getattr(LOCAL, "counters", None)
+
+
+@contextmanager
+def record_counters() -> Iterator[Counter]:
+    """Collect the counts added in this thread within the context"""
+
+    previous_counters = getattr(LOCAL, "counters", None)
+    counters: Counter = Counter()
+    LOCAL.counters = counters
+    try:
+        yield counters
+    finally:
+        LOCAL.counters = previous_counters
+
+
+def format_counters(counters: Mapping[str, int], files: int) -> str:
+    """Counters as a table, with their total and their mean per file"""
+
+    if not counters:
+        return "No work counted"
+
+    width = max(len(name) for name in counters)
+    lines = [f"{'counter':<{width}}  {'total':>12}  {'per file':>10}"]
+    for name, value in sorted(counters.items()):
+        lines.append(f"{name:<{width}}  {value:>12}  {value / max(files, 1):>10.1f}")
+    return "\n".join(lines)
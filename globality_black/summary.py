@@ -0,0 +1,116 @@
+"""
+Summary of a run of globality-black, i.e. the final counts shown by the CLI
+
+Summaries can be saved as JSON and merged into one report, e.g. for a full-repo check split in
+shards across CI jobs (see sharding.py). They also record the time spent on each file, which can
+be used to balance the shards of the next run
+"""
+import json
+import os
+from collections import Counter
+from enum import Enum, unique
+from pathlib import Path
+from typing import Dict, Optional
+
+
+@unique
+class FailureKind(Enum):
+    BLACK = "black"
+    CONFIG = "config"
+    READ = "read"
+    # timed out, died or raised an error in a worker process, see workers.py
+    WORKER = "worker"
+
+
+class Summary:
+    def __init__(
+        self,
+        check: bool,
+        reformatted_count: int = 0,
+        failed_count: int = 0,
+        unchanged_count: int = 0,
+        skipped_count: int = 0,
+        format_seconds: float = 0.0,
+        verify_seconds: float = 0.0,
+        durations: Optional[Dict[str, float]] = None,
+        store_hits: int = 0,
+        failure_counts: Optional[Dict[str, int]] = None,
+    ):
+        self.check = check
+        self.reformatted_count = reformatted_count
+        self.failed_count = failed_count
+        self.unchanged_count = unchanged_count
+        self.skipped_count = skipped_count
+        self.format_seconds = format_seconds
+        self.verify_seconds = verify_seconds
+        # seconds spent on each processed file, see `get_path_key`
+        self.durations = durations or {}
+        # files whose output was found in the output store, see output_store.py
+        self.store_hits = store_hits
+        # failed files per FailureKind value
+        self.failure_counts = failure_counts or {}
+
+    @property
+    def processed_count(self) -> int:
+        return self.reformatted_count + self.failed_count + self.unchanged_count
+
+    def add(self, result):
+        """Add the result of processing one file, see cli.ProcessPathResult"""
+
+        if result.is_failed:
+            self.failed_count += 1
+            kind = (result.failure or FailureKind.BLACK).value
+            self.failure_counts[kind] = self.failure_counts.get(kind, 0) + 1
+        elif result.is_modified:
+            self.reformatted_count += 1
+        else:
+            self.unchanged_count += 1
+        self.format_seconds += result.format_seconds
+        self.verify_seconds += result.verify_seconds
+        self.store_hits += result.from_store
+        if result.path is not None:
+            self.durations[get_path_key(result.path)] = (
+                result.format_seconds + result.verify_seconds
+            )
+
+    def merge(self, other: "Summary") -> "Summary":
+        if self.check != other.check:
+            raise ValueError("Cannot merge summaries of runs with and without --check")
+
+        return Summary(
+            check=self.check,
+            reformatted_count=self.reformatted_count + other.reformatted_count,
+            failed_count=self.failed_count + other.failed_count,
+            unchanged_count=self.unchanged_count + other.unchanged_count,
+            skipped_count=self.skipped_count + other.skipped_count,
+            format_seconds=self.format_seconds + other.format_seconds,
+            verify_seconds=self.verify_seconds + other.verify_seconds,
+            durations={**self.durations, **other.durations},
+            store_hits=self.store_hits + other.store_hits,
+            failure_counts=dict(Counter(self.failure_counts) + Counter(other.failure_counts)),
+        )
+
+    def get_failure_counts(self) -> Dict[FailureKind, int]:
+        """
+        Failed files per kind, counting as black errors those of summaries written before kinds
+        were recorded
+        """
+
+        counts = {kind: self.failure_counts.get(kind.value, 0) for kind in FailureKind}
+        counts[FailureKind.BLACK] += self.failed_count - sum(counts.values())
+        return counts
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+    def write(self, path: Path):
+        path.write_text(json.dumps(self.to_dict(), indent=2, sort_keys=True))
+
+    @classmethod
+    def read(cls, path: Path) -> "Summary":
+        return cls(**json.loads(path.read_text()))
+
+
+def get_path_key(path: Path) -> str:
+    """Path relative to the current directory, as recorded in summaries"""
+    return Path(os.path.relpath(path)).as_posix()
@@ -0,0 +1,54 @@
+import black
+import pytest
+
+from globality_black.black_handler import get_black_mode, parse_black_mode
+from globality_black.config import InvalidConfigError
+
+
+def test_get_black_mode(tmp_path):
+
+    (tmp_path / "pyproject.toml").write_text(
+        "[tool.black]\n"
+        "line-length = 80\n"
+        'target-version = ["py38", "py39"]\n'
+        "skip-string-normalization = true\n"
+        "skip-magic-trailing-comma = true\n"
+        "preview = true\n"
+        'exclude = "migrations"\n'
+    )
+    path = tmp_path / "module.py"
+    path.write_text("x = 1\n")
+
+    assert get_black_mode(path) == black.Mode(
+        line_length=80,
+        target_versions={black.TargetVersion.PY38, black.TargetVersion.PY39},
+        string_normalization=False,
+        magic_trailing_comma=False,
+        preview=True,
+    )
+
+
+def test_get_black_mode_infers_target_versions(tmp_path):
+
+    (tmp_path / "pyproject.toml").write_text('[project]\nrequires-python = ">=3.11"\n')
+    path = tmp_path / "module.py"
+    path.write_text("x = 1\n")
+
+    black_mode = get_black_mode(path)
+    assert black_mode.line_length == 100
+    assert black.TargetVersion.PY311 in black_mode.target_versions
+    assert black.TargetVersion.PY310 not in black_mode.target_versions
+
+
+@pytest.mark.parametrize(
+    "config, message",
+    [
+        ({"line_length": "100"}, "line_length must be a positive integer"),
+        ({"target_version": "py38"}, "target_version must be a list of strings"),
+        ({"target_version": ["py2"]}, "Unknown target_version 'PY2', target versions are: py33"),
+        ({"preview": "yes"}, "preview must be true or false"),
+    ],
+)
+def test_parse_black_mode_invalid(config, message):
+    with pytest.raises(InvalidConfigError, match=message):
+        parse_black_mode(config)
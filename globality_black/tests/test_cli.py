@@ -1,19 +1,52 @@
+import json
 import re
 import shutil
+import subprocess
 import tempfile
 from enum import Enum, unique
 from pathlib import Path
-from typing import Tuple
+from typing import List, Sequence, Tuple
 
+import black
 import pytest
 from click.testing import CliRunner
 
-from globality_black.cli import main
-from globality_black.constants import ALL_DONE_STRING, OH_NO_STRING
+from globality_black import cli
+from globality_black.black_handler import get_black_mode
+from globality_black.cli import iter_processed, main, merge_summaries
+from globality_black.constants import (
+    ALL_DONE_STRING,
+    OH_NO_STRING,
+    Executor,
+    Feature,
+)
 from globality_black.tests import run_and_check, show_diff
 from globality_black.tests.fixtures import get_fixture_path
 
 
+def copy_fixtures(directory: Path, *filenames: str) -> List[Path]:
+    """
+    Copy the given fixtures to `directory` as .py files, returning their paths
+    """
+
+    paths = []
+    for filename in filenames:
+        path = (directory / filename).with_suffix(".py")
+        shutil.copy(str(get_fixture_path(filename)), str(path))
+        paths.append(path)
+    return paths
+
+
+def assert_formatted(paths: List[Path], filenames: Sequence[str]):
+    """
+    Check that the fixtures copied to `paths` were reformatted to their expected output
+    """
+
+    for path, filename in zip(paths, filenames):
+        expected_output_path = get_fixture_path(filename.replace("input", "output"))
+        assert path.read_text() == expected_output_path.read_text()
+
+
 @unique
 class FileCondition(Enum):
     NEEDS_GB = 0  # needs to be reformatted with globality-black
@@ -224,3 +257,403 @@ def test_cli_directory(runner: CliRunner, check: bool, error: bool, verbose: boo
         final_string = emojis + final_string
 
         assert result.output.endswith(final_string)
+
+
+@pytest.mark.parametrize("safe", (False, True))
+def test_cli_safe_mode(runner: CliRunner, tmp_path, safe: bool):
+    """
+    Safe mode gives the same result as fast mode for correct files, and reports the time spent
+    verifying when verbose
+    """
+
+    input_paths = copy_fixtures(tmp_path, "comprehensions_input.txt")
+
+    args = [str(input_paths[0]), "--verbose", "--safe" if safe else "--fast"]
+    result = run_and_check(runner, "globality-black", main, args)
+
+    assert result.exit_code == 0
+    assert_formatted(input_paths, ["comprehensions_input.txt"])
+    mode_string = "safe" if safe else "fast"
+    assert re.search(rf"verification took [\d.]+s \({mode_string} mode", result.output)
+
+
+@pytest.mark.parametrize("fail_fast", (False, True))
+def test_cli_fail_fast(runner: CliRunner, tmp_path, fail_fast: bool):
+    """
+    With --fail-fast, --check stops at the first file that would be reformatted
+    """
+
+    filenames = ["blank_lines_input.txt", "comprehensions_input.txt", "tuples_input.txt"]
+    copy_fixtures(tmp_path, *filenames)
+
+    args = [str(tmp_path), "--check", "--fail-fast" if fail_fast else "--no-fail-fast"]
+    result = run_and_check(runner, "globality-black", main, args)
+
+    assert result.exit_code == 1
+    expected_count = 1 if fail_fast else len(filenames)
+    assert result.output.count("Would reformat") == expected_count
+    assert f"{expected_count} files would be reformatted" in result.output
+    assert ("2 files not processed" in result.output) == fail_fast
+
+
+def test_cli_diff_output(runner: CliRunner, tmp_path, monkeypatch):
+    """
+    --diff-output writes a patch, which applied with `git apply` gives the reformatted files
+    """
+
+    filenames = ["blank_lines_input.txt", "comprehensions_input.txt", "fmt_off_output.txt"]
+    monkeypatch.chdir(tmp_path)
+    Path("subdir").mkdir()
+    input_paths = copy_fixtures(Path("subdir"), *filenames)
+
+    args = ["subdir", "--diff-output", "changes.diff"]
+    result = run_and_check(runner, "globality-black", main, args)
+
+    assert result.exit_code == 1
+    # files are left untouched, and diffs are only written to the patch file
+    assert input_paths[0].read_text() == get_fixture_path(filenames[0]).read_text()
+    assert "@@" not in result.output
+
+    subprocess.run(["git", "apply", "changes.diff"], check=True)
+
+    assert_formatted(input_paths, filenames)
+
+
+def test_cli_shards_and_merge_summaries(runner: CliRunner, tmp_path):
+    """
+    Checking all shards and merging their summaries gives the same report as checking all files
+    """
+
+    filenames = [
+        "blank_lines_input.txt",
+        "comprehensions_input.txt",
+        "fmt_off_output.txt",
+        "tuples_output.txt",
+        "file_with_errors.txt",
+    ]
+    (tmp_path / "src").mkdir()
+    copy_fixtures(tmp_path / "src", *filenames)
+
+    summary_paths = []
+    for index in (1, 2, 3):
+        summary_path = tmp_path / f"summary_{index}.json"
+        args = [str(tmp_path / "src"), "--check", "--shard", f"{index}/3"]
+        args += ["--summary-output", str(summary_path)]
+        run_and_check(runner, "globality-black", main, args)
+        summary_paths.append(str(summary_path))
+
+    merged_result = run_and_check(
+        runner,
+        "globality-black-merge-summaries",
+        merge_summaries,
+        summary_paths,
+    )
+    full_result = run_and_check(runner, "globality-black", main, [str(tmp_path), "--check"])
+
+    assert merged_result.exit_code == full_result.exit_code == 1
+    assert merged_result.output.endswith(
+        f"{OH_NO_STRING}\n1 files failed to parse (black error)\n"
+        "2 files would be reformatted\n2 files would be left unchanged\n"
+    )
+    assert full_result.output.endswith(merged_result.output)
+    # all files have a duration, failed ones included, to balance the next shards
+    durations = {}
+    for summary_path_str in summary_paths:
+        durations.update(json.loads(Path(summary_path_str).read_text())["durations"])
+    assert len(durations) == len(filenames)
+
+
+def test_cli_invalid_shard(runner: CliRunner):
+
+    result = run_and_check(runner, "globality-black", main, [".", "--shard", "3/2"])
+
+    assert result.exit_code == 2
+    assert "Shard index must be between 1 and 2" in result.output
+
+
+def test_cli_output_store(runner: CliRunner, tmp_path):
+    """
+    With --store, files already formatted (in any path) are not formatted again
+    """
+
+    store_path = tmp_path / "store.db"
+
+    for directory in ("first", "second"):
+        (tmp_path / directory).mkdir()
+        input_paths = copy_fixtures(tmp_path / directory, "comprehensions_input.txt")
+
+        args = [str(input_paths[0]), "--verbose", "--store", str(store_path)]
+        result = run_and_check(runner, "globality-black", main, args)
+
+        assert result.exit_code == 0
+        assert_formatted(input_paths, ["comprehensions_input.txt"])
+        store_hits = 0 if directory == "first" else 1
+        assert f"{store_hits} files found in the output store" in result.output
+
+
+def test_cli_many_paths(runner: CliRunner, tmp_path):
+    """
+    Files and directories can be passed together, each file being processed once
+    """
+
+    (tmp_path / "src").mkdir()
+    [first_path] = copy_fixtures(tmp_path / "src", "blank_lines_input.txt")
+    [second_path] = copy_fixtures(tmp_path, "comprehensions_input.txt")
+
+    args = [str(tmp_path / "src"), str(second_path), str(first_path), "--check"]
+    result = run_and_check(runner, "globality-black", main, args)
+
+    assert result.exit_code == 1
+    assert result.output.count("Would reformat") == 2
+    assert "2 files would be reformatted" in result.output
+
+
+def test_cli_disable_features(runner: CliRunner, tmp_path):
+    """
+    With all features disabled, globality-black is just black
+    """
+
+    [input_path] = copy_fixtures(tmp_path, "comprehensions_input.txt")
+
+    args = [str(input_path)]
+    for feature in Feature:
+        args += ["--disable", feature.value]
+    result = run_and_check(runner, "globality-black", main, args)
+
+    assert result.exit_code == 0
+    expected_output = black.format_str(
+        get_fixture_path("comprehensions_input.txt").read_text(),
+        mode=get_black_mode(input_path),
+    )
+    assert input_path.read_text() == expected_output
+
+
+def test_cli_timeout_per_file(runner: CliRunner, tmp_path):
+    """
+    Files taking longer than --timeout-per-file are reported as failed, the others are formatted
+    """
+
+    copy_fixtures(tmp_path, "blank_lines_input.txt", "comprehensions_input.txt")
+
+    args = [str(tmp_path), "--check", "--timeout-per-file", "60"]
+    result = run_and_check(runner, "globality-black", main, args)
+    assert result.output.count("Would reformat") == 2
+
+    args = [str(tmp_path), "--check", "--timeout-per-file", "0.001"]
+    result = run_and_check(runner, "globality-black", main, args)
+    assert result.exit_code == 1
+    assert result.output.count("Timed out after 0.001s") == 2
+    assert "2 files failed in a worker process" in result.output
+
+
+@pytest.mark.parametrize("args", (
+    ["--executor", "serial"],
+    ["--executor", "thread", "--workers", "2"],
+    ["--timeout-per-file", "60", "--workers", "2"],
+))
+def test_cli_reports_unreadable_files(runner: CliRunner, tmp_path, args):
+    """
+    A file which cannot be read (e.g. decoded) fails on its own, whatever the executor
+    """
+
+    copy_fixtures(tmp_path, "tuples_input.txt")
+    (tmp_path / "binary.py").write_bytes(b"\xff\n")
+
+    result = run_and_check(runner, "globality-black", main, [str(tmp_path), "--check", *args])
+
+    assert result.exit_code == 1
+    assert "Would reformat" in result.output and "tuples_input.py" in result.output
+    assert "Cannot read it: 'utf-8' codec can't decode" in result.output
+    assert "1 files failed to be read" in result.output
+
+
+def test_fork_workers_warm_up_once(tmp_path, monkeypatch):
+    """
+    With fork, the main process warms up once for all workers, replacements included
+    """
+
+    warm_ups_path = tmp_path / "warm_ups.txt"
+    warm_ups_path.touch()
+
+    def warm_up(path):
+        with open(warm_ups_path, "a") as warm_ups:
+            warm_ups.write(f"{path}\n")
+
+    monkeypatch.setattr(cli, "warm_up", warm_up)
+    paths = [tmp_path / f"module_{index}.py" for index in range(4)]
+
+    results = list(iter_processed(str, paths, False, Executor.FORK, 2, timeout_per_file=60))
+
+    assert results == [str(path) for path in paths]
+    assert warm_ups_path.read_text() == f"{paths[0]}\n"
+
+
+@pytest.mark.parametrize("executor", ("serial", "thread", "fork", "spawn"))
+def test_cli_executors(runner: CliRunner, tmp_path, executor: str):
+
+    filenames = ["blank_lines_input.txt", "comprehensions_input.txt", "tuples_output.txt"]
+    input_paths = copy_fixtures(tmp_path, *filenames)
+
+    args = [str(tmp_path), "--executor", executor, "--workers", "2", "--verbose"]
+    result = run_and_check(runner, "globality-black", main, args)
+
+    assert result.exit_code == 0
+    workers = 1 if executor == "serial" else 2
+    assert f"Formatting 3 files ({executor}, {workers} workers)" in result.output
+    assert_formatted(input_paths, filenames)
+
+
+def test_cli_timeout_needs_processes(runner: CliRunner):
+
+    args = [".", "--executor", "thread", "--timeout-per-file", "1"]
+    result = run_and_check(runner, "globality-black", main, args)
+
+    assert result.exit_code == 2
+    assert "Cannot use --timeout-per-file with the thread executor" in result.output
+
+
+def test_cli_trace_out(runner: CliRunner, tmp_path):
+
+    copy_fixtures(tmp_path, "blank_lines_input.txt", "comprehensions_input.txt", "tuples_output.txt")
+
+    trace_path = tmp_path / "run.json"
+    args = [str(tmp_path), "--executor", "fork", "--workers", "2", "--trace-out", str(trace_path)]
+    result = run_and_check(runner, "globality-black", main, args)
+    assert result.exit_code == 0
+
+    events = json.loads(trace_path.read_text())["traceEvents"]
+
+    spans = [event for event in events if event["ph"] == "X"]
+    names = {event["name"] for event in spans}
+    assert {"collect paths", "format", "file", "read", "parse", "black", "reparse"} <= names
+    assert {"cover tuples", "uncover tuples", "write"} <= names
+
+    files = [event for event in spans if event["name"] == "file"]
+    assert sorted(Path(event["args"]["path"]).stem for event in files) == [
+        "blank_lines_input",
+        "comprehensions_input",
+        "tuples_output",
+    ]
+    statuses = {Path(event["args"]["path"]).stem: event["args"]["status"] for event in files}
+    assert statuses["tuples_output"] == "unchanged"
+    assert statuses["blank_lines_input"] == "modified"
+
+    # files run in the workers, the main track only has the whole run
+    track_names = {
+        event["tid"]: event["args"]["name"] for event in events if event["name"] == "thread_name"
+    }
+    assert track_names[0] == "main"
+    assert all(event["tid"] != 0 for event in files)
+    assert {event["tid"] for event in spans} <= set(track_names)
+
+
+def test_cli_sort_imports(runner: CliRunner):
+    pytest.importorskip("isort")
+
+    input_code = "import sys\nimport os\nx = [os.sep, sys.argv, ]\n"
+    formatted_list = "x = [\n    os.sep,\n    sys.argv,\n]\n"
+
+    with tempfile.TemporaryDirectory() as temp_path:
+
+        (Path(temp_path) / "pyproject.toml").write_text("[tool.isort]\nlines_after_imports = 2\n")
+        input_path = Path(temp_path) / "module.py"
+        input_path.write_text(input_code)
+
+        result = run_and_check(runner, "globality-black", main, [temp_path, "--safe"])
+        assert result.exit_code == 0
+        assert input_path.read_text() == "import sys\nimport os\n\n" + formatted_list
+
+        # with the isort configuration of the same pyproject.toml
+        input_path.write_text(input_code)
+        args = [temp_path, "--safe", "--sort-imports"]
+        result = run_and_check(runner, "globality-black", main, args)
+        assert result.exit_code == 0
+        assert input_path.read_text() == "import os\nimport sys\n\n\n" + formatted_list
+
+        # unchanged files are not written
+        mtime = input_path.stat().st_mtime_ns
+        result = run_and_check(runner, "globality-black", main, [temp_path, "--sort-imports"])
+        assert "1 files unchanged" in result.output
+        assert input_path.stat().st_mtime_ns == mtime
+
+
+@pytest.mark.parametrize("executor", ("serial", "thread", "fork"))
+def test_cli_io_workers(runner: CliRunner, tmp_path, executor: str):
+
+    filenames = ["blank_lines_input.txt", "comprehensions_input.txt", "tuples_output.txt"]
+    input_paths = copy_fixtures(tmp_path, *filenames)
+
+    args = [str(tmp_path), "--executor", executor, "--workers", "2", "--io-workers", "2"]
+    args.append("--verbose")
+    result = run_and_check(runner, "globality-black", main, args)
+
+    assert result.exit_code == 0
+    assert "I/O threads read 3 files" in result.output
+    assert "and wrote 2 in" in result.output
+    assert_formatted(input_paths, filenames)
+
+
+def test_cli_git_rev(runner: CliRunner, tmp_path, monkeypatch):
+
+    def git(*args):
+        args = ("-c", "user.name=test", "-c", "user.email=test@example.com") + args
+        subprocess.run(["git", *args], cwd=tmp_path, check=True, capture_output=True)
+
+    git("init", "-q")
+    shutil.copy(str(get_fixture_path("tuples_input.txt")), str(tmp_path / "tuples.py"))
+    shutil.copy(str(get_fixture_path("tuples_output.txt")), str(tmp_path / "formatted.py"))
+    git("add", ".")
+    git("commit", "-q", "-m", "first")
+    # only staged, then only in the worktree
+    shutil.copy(str(get_fixture_path("tuples_output.txt")), str(tmp_path / "tuples.py"))
+    git("add", "tuples.py")
+    shutil.copy(str(get_fixture_path("tuples_input.txt")), str(tmp_path / "formatted.py"))
+    monkeypatch.chdir(tmp_path)
+
+    result = run_and_check(runner, "globality-black", main, [".", "--git-rev", "HEAD"])
+    assert result.exit_code == 1
+    assert result.output.startswith("Would reformat tuples.py\n")
+    assert "1 files would be left unchanged" in result.output
+
+    result = run_and_check(runner, "globality-black", main, [".", "--git-rev", ":"])
+    assert result.exit_code == 0
+    assert "2 files would be left unchanged" in result.output
+    # files on disk are left untouched
+    input_code = get_fixture_path("tuples_input.txt").read_text()
+    assert (tmp_path / "formatted.py").read_text() == input_code
+
+    # without worktree, paths are pathspecs and shards are weighted by the sizes in git
+    (tmp_path / "tuples.py").unlink()
+    (tmp_path / "formatted.py").unlink()
+    outputs = []
+    for index in (1, 2):
+        args = ["tuples.py", "formatted.py", "--git-rev", "HEAD", "--shard", f"{index}/2"]
+        result = run_and_check(runner, "globality-black", main, args)
+        outputs.append(result.output)
+    assert sorted(output.startswith("Would reformat tuples.py\n") for output in outputs) == [
+        False,
+        True,
+    ]
+
+
+def test_cli_stats(runner: CliRunner, tmp_path):
+
+    copy_fixtures(tmp_path, "blank_lines_input.txt", "comprehensions_input.txt", "tuples_input.txt")
+
+    outputs = []
+    for executor in ("serial", "fork"):
+        args = [str(tmp_path), "--check", "--stats", "--executor", executor, "--workers", "2"]
+        args += ["--trace-out", str(tmp_path / "run.json")]
+        result = run_and_check(runner, "globality-black", main, args)
+        assert result.exit_code == 1
+        # counters are shown before the final counts
+        output = result.output
+        outputs.append(output[output.index("counter"):output.index("-" * 10)])
+
+    # the same work, whether summed over workers or not
+    assert outputs[0] == outputs[1]
+    rows = [line.split() for line in outputs[0].splitlines()[1:]]
+    counters = {row[0]: int(row[1]) for row in rows}
+    assert counters["get_code.calls"] == 2 * 3
+    assert counters["comprehensions.exploded"] > 0
+    assert counters["sentinels.BLANK_LINE_TOKEN"] > 0
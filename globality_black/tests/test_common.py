@@ -0,0 +1,109 @@
+import parso
+
+from globality_black.common import (
+    SyntaxTreeVisitor,
+    find_fmt_off_regions,
+    get_code,
+    get_first_leaf,
+    get_last_leaf,
+    get_leaf_for_position,
+)
+from globality_black.comprehensions import set_prefix_for_all_last_children
+
+
+DEPTH = 1000
+
+
+def test_syntax_tree_visitor_with_deep_nesting():
+
+    code = "x = " + "[" * DEPTH + "1" + "]" * DEPTH + "\n"
+    module = parso.parse(code)
+
+    atoms = list(SyntaxTreeVisitor(module, ["atom"])(module))
+
+    assert len(atoms) == DEPTH
+    assert atoms[0].start_pos == (1, 4)
+    assert atoms[-1].start_pos == (1, 4 + DEPTH - 1)
+
+
+def test_syntax_tree_visitor_skips_fmt_off_regions_with_deep_nesting():
+
+    nested = "[" * DEPTH + "1" + "]" * DEPTH
+    code = f"# fmt: off\nx = {nested}\n# fmt: on\ny = {nested}\n"
+    module = parso.parse(code)
+
+    atoms = list(SyntaxTreeVisitor(module, ["atom"])(module))
+
+    assert len(atoms) == DEPTH
+    assert all(atom.start_pos[0] == 4 for atom in atoms)
+
+
+def test_set_prefix_for_all_last_children_with_long_chain():
+
+    code = "x = [a " + " ".join(f"for a{index} in b" for index in range(DEPTH)) + "]\n"
+    module = parso.parse(code)
+    comp_for = next(SyntaxTreeVisitor(module, ["sync_comp_for"])(module))
+
+    set_prefix_for_all_last_children(comp_for, "\n    ")
+
+    assert code.replace(" for", "\n    for") == "".join(
+        leaf.prefix + leaf.value
+        for leaf in iter_leaves(module)
+    )
+
+
+def test_first_and_last_leaves_with_deep_nesting():
+
+    code = "x = " + "[" * DEPTH + "1" + "]" * DEPTH + "\n"
+    module = parso.parse(code)
+    atom = module.children[0].children[0].children[2]
+
+    assert get_first_leaf(atom).start_pos == (1, 4)
+    assert get_last_leaf(atom).start_pos == (1, 4 + 2 * DEPTH)
+
+
+def test_code_and_leaf_for_position_with_deep_nesting():
+
+    code = "x = " + "[" * DEPTH + "1" + "]" * DEPTH + "\n"
+    module = parso.parse(code)
+
+    assert get_code(module) == code
+    assert get_leaf_for_position(module, (1, 4 + DEPTH + 1)).value == "1"
+    assert get_leaf_for_position(module, (1, 2 * DEPTH + 5)).value == "]"
+
+
+def iter_leaves(module):
+    # module.get_code() is recursive in parso
+    for node in SyntaxTreeVisitor(module)(module):
+        if not hasattr(node, "children"):
+            yield node
+
+
+def test_find_fmt_off_regions():
+
+    code = (
+        "x = 1\n"
+        "# fmt: off\n"
+        "def foo():\n"
+        "    y = 2\n"
+        "    # fmt: on\n"
+        "    z = 3\n"
+        "# fmt: on\n"
+        "w = 4\n"
+        "if w:\n"
+        "    # fmt: off\n"
+        "    v = 5\n"
+    )
+    module = parso.parse(code)
+
+    regions = find_fmt_off_regions(module, code)
+
+    # the `fmt: on` inside the disabled function is ignored
+    assert [line for line in range(1, 12) if regions.contains(line)] == [3, 4, 5, 6, 7, 11]
+
+
+def test_find_fmt_off_regions_without_fmt_comments():
+
+    code = "x = 1\n"
+
+    assert not find_fmt_off_regions(parso.parse(code), code)
@@ -0,0 +1,43 @@
+import pytest
+
+from globality_black.config import InvalidConfigError, get_features, get_sort_imports
+from globality_black.constants import ALL_FEATURES, Feature
+
+
+def test_get_features(tmp_path):
+
+    (tmp_path / "pyproject.toml").write_text(
+        '[tool.black]\nline-length = 100\n\n[tool.globality-black]\ndisable = ["tuples"]\n'
+    )
+    path = tmp_path / "module.py"
+    path.write_text("x = 1\n")
+
+    assert get_features(path) == ALL_FEATURES - {Feature.TUPLES}
+    assert get_features(path, disabled=["blank-lines"]) == {
+        Feature.DOTTED_CHAINS,
+        Feature.COMPREHENSIONS,
+    }
+
+    with pytest.raises(InvalidConfigError, match="features are: blank-lines"):
+        get_features(path, disabled=["blank_lines"])
+
+
+@pytest.mark.parametrize(
+    "pyproject, sort_imports",
+    [
+        ("[tool.black]\nline-length = 100\n", False),
+        ("[tool.globality-black]\nsort-imports = true\n", True),
+        ('[tool.globality-black]\nsort-imports = "yes"\n', None),
+    ],
+)
+def test_get_sort_imports(tmp_path, pyproject, sort_imports):
+
+    (tmp_path / "pyproject.toml").write_text(pyproject)
+    path = tmp_path / "module.py"
+    path.write_text("x = 1\n")
+
+    if sort_imports is None:
+        with pytest.raises(InvalidConfigError, match="sort-imports must be true or false"):
+            get_sort_imports(path)
+    else:
+        assert get_sort_imports(path) == sort_imports
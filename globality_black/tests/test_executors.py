@@ -0,0 +1,60 @@
+import multiprocessing as mp
+import sys
+
+import pytest
+
+from globality_black.constants import Executor
+from globality_black.executors import (
+    FORMAT_BYTES_PER_SECOND,
+    get_process_executor,
+    iter_in_threads,
+    resolve_executor,
+    select_executor,
+)
+
+
+@pytest.fixture
+def eight_cpus(monkeypatch):
+    monkeypatch.setattr(mp, "cpu_count", lambda: 8)
+
+
+def test_select_executor(eight_cpus):
+
+    process_executor = get_process_executor()
+    tiny_files = [200] * 6
+    huge_files = [10 * FORMAT_BYTES_PER_SECOND] * 4
+
+    assert select_executor(tiny_files) == (Executor.SERIAL, 1)
+    assert select_executor(huge_files) == (process_executor, 7)
+    assert select_executor(huge_files, workers=2) == (process_executor, 2)
+    assert select_executor(huge_files, workers=1) == (Executor.SERIAL, 1)
+    # only processes can be interrupted
+    assert select_executor(tiny_files, timeout=10) == (process_executor, 7)
+
+
+def test_select_executor_free_threaded(eight_cpus, monkeypatch):
+
+    monkeypatch.setattr(sys, "_is_gil_enabled", lambda: False, raising=False)
+    huge_files = [10 * FORMAT_BYTES_PER_SECOND] * 4
+
+    assert select_executor(huge_files) == (Executor.THREAD, 8)
+    assert select_executor(huge_files, timeout=10) == (get_process_executor(), 7)
+
+
+def test_resolve_executor_does_not_fork_with_threads(eight_cpus):
+
+    huge_files = [10 * FORMAT_BYTES_PER_SECOND] * 4
+
+    assert resolve_executor(Executor.FORK, huge_files) == (Executor.FORK, 7)
+    assert resolve_executor(Executor.FORK, huge_files, threads=True) == (Executor.FORKSERVER, 7)
+    assert resolve_executor(Executor.AUTO, huge_files, threads=True)[0] != Executor.FORK
+
+
+@pytest.mark.parametrize("ordered", (True, False))
+def test_iter_in_threads(ordered):
+
+    results = list(iter_in_threads(lambda item: item * item, [1, 2, 3], workers=2, ordered=ordered))
+
+    assert sorted(results) == [(1, 1), (2, 4), (3, 9)]
+    if ordered:
+        assert results == [(1, 1), (2, 4), (3, 9)]
@@ -0,0 +1,92 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import globality_black
+from globality_black.flake8_plugin import GlobalityBlackChecker, get_first_different_line
+from globality_black.output_store import OutputStore
+from globality_black.tests.fixtures import get_fixture_path
+
+
+def run_checker(path, store_path=None):
+    GlobalityBlackChecker.store_path = store_path
+    try:
+        lines = path.read_text().splitlines(keepends=True)
+        return [error[:3] for error in GlobalityBlackChecker(None, lines, str(path)).run()]
+    finally:
+        GlobalityBlackChecker.store_path = None
+
+
+def test_checker_reports_first_different_line(tmp_path):
+
+    path = tmp_path / "tuples.py"
+    path.write_text(get_fixture_path("tuples_input.txt").read_text())
+
+    assert run_checker(path) == [(12, 0, "GB100 file would be reformatted by globality-black")]
+
+    path.write_text(get_fixture_path("tuples_output.txt").read_text())
+    assert run_checker(path) == []
+
+
+def test_checker_reports_failures(tmp_path):
+
+    path = tmp_path / "invalid.py"
+    path.write_text("x = (\n")
+
+    [(line, _, message)] = run_checker(path)
+
+    assert line == 1
+    assert message.startswith("GB001 globality-black failed to format the file")
+
+
+def test_checker_with_output_store(tmp_path):
+
+    path = tmp_path / "tuples.py"
+    path.write_text(get_fixture_path("tuples_input.txt").read_text())
+    store_path = tmp_path / "store.db"
+
+    first_errors = run_checker(path, store_path)
+    assert OutputStore(store_path).get_size() > 0
+    assert run_checker(path, store_path) == first_errors
+
+
+@pytest.mark.parametrize(
+    "input_lines, output_lines, line",
+    [
+        (["a\n", "b\n"], ["a\n", "c\n"], 2),
+        (["a\n", "b\n"], ["a\n", "b\n", "\n"], 2),
+        (["a\n", "b\n", "\n"], ["a\n", "b\n"], 3),
+        ([], ["\n"], 1),
+    ],
+)
+def test_get_first_different_line(input_lines, output_lines, line):
+    assert get_first_different_line(input_lines, output_lines) == line
+
+
+def test_flake8_run(tmp_path):
+    pytest.importorskip("flake8")
+
+    (tmp_path / "tuples.py").write_text(get_fixture_path("tuples_input.txt").read_text())
+    (tmp_path / "tuples_output.py").write_text(get_fixture_path("tuples_output.txt").read_text())
+    (tmp_path / "setup.cfg").write_text(
+        "[flake8]\n"
+        "select = GB\n"
+        "[flake8:local-plugins]\n"
+        "extension =\n"
+        "    GB = globality_black.flake8_plugin:GlobalityBlackChecker\n"
+        f"paths = {Path(globality_black.__file__).parent.parent}\n"
+    )
+
+    result = subprocess.run(
+        [sys.executable, "-m", "flake8", "tuples.py", "tuples_output.py"],
+        cwd=tmp_path,
+        capture_output=True,
+        text=True,
+    )
+
+    assert result.stdout == (
+        "tuples.py:12:1: GB100 file would be reformatted by globality-black\n"
+    ), result.stderr
+    assert result.returncode == 1
@@ -0,0 +1,51 @@
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from globality_black.git_source import GitBlobReader, GitError, list_git_files
+
+
+def git(repo_path: Path, *args: str):
+    subprocess.run(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+        cwd=repo_path,
+        check=True,
+        capture_output=True,
+    )
+
+
+@pytest.fixture
+def repo_path(tmp_path, monkeypatch):
+    git(tmp_path, "init", "-q")
+    (tmp_path / "package").mkdir()
+    (tmp_path / "package" / "module.py").write_text("x = 1\n")
+    (tmp_path / "README.md").write_text("readme\n")
+    git(tmp_path, "add", ".")
+    git(tmp_path, "commit", "-q", "-m", "first")
+
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def test_list_and_read_git_files(repo_path):
+
+    # staged and unstaged changes
+    (repo_path / "package" / "module.py").write_text("x = 2\n")
+    (repo_path / "other.py").write_text("y = 1\n")
+    git(repo_path, "add", "other.py")
+
+    commit_files = list_git_files("HEAD")
+    index_files = list_git_files(":")
+    assert [file.path for file in commit_files] == [Path("package/module.py")]
+    assert [file.path for file in index_files] == [Path("other.py"), Path("package/module.py")]
+    assert list_git_files(":", ["package"]) == commit_files
+
+    with GitBlobReader(commit_files + index_files) as reader:
+        assert reader.read(Path("package/module.py")) == "x = 1\n"
+        assert reader.read(Path("other.py")) == "y = 1\n"
+
+
+def test_list_git_files_invalid_revision(repo_path):
+    with pytest.raises(GitError, match="git ls-tree failed"):
+        list_git_files("unknown")
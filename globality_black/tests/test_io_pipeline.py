@@ -0,0 +1,39 @@
+from pathlib import Path
+
+from globality_black.io_pipeline import IOPipeline
+
+
+def test_io_pipeline(tmp_path):
+
+    paths = [tmp_path / f"module_{index}.py" for index in range(5)]
+    for index, path in enumerate(paths):
+        path.write_text(f"x = {index}\n")
+    paths[3].write_bytes(b"\xff\n")
+
+    with IOPipeline(paths, io_workers=2, lookahead=2, trace=True) as pipeline:
+        # read ahead right away, and as files are requested
+        assert sorted(pipeline.reads) == [0, 1]
+        assert pipeline.read(paths[0]) == (paths[0], "x = 0\n", None)
+        assert sorted(pipeline.reads) == [1, 2]
+
+        sources = [pipeline.read(path) for path in paths[1:]]
+        assert [source.code for source in sources] == ["x = 1\n", "x = 2\n", None, "x = 4\n"]
+        assert "can't decode" in sources[2].error
+        pipeline.wait(pipeline.write(paths[0], "x = 5\n"))
+
+    assert paths[0].read_text() == "x = 5\n"
+    assert pipeline.stats.files_read == 5
+    assert pipeline.stats.files_written == 1
+    assert 0 <= pipeline.stats.overlap <= 1
+    assert {recorded.name for recorded in pipeline.spans} >= {"prefetch", "write back"}
+
+
+def test_io_pipeline_reads_with_path_read_text_at_run_time(tmp_path, monkeypatch):
+    """Path.read_text is looked up when reading, so patching it (e.g. in benchmarks) applies"""
+
+    path = tmp_path / "module.py"
+    path.write_text("x = 0\n")
+    monkeypatch.setattr(Path, "read_text", lambda self: "patched\n")
+
+    with IOPipeline([path], io_workers=1, lookahead=1) as pipeline:
+        assert pipeline.read(path).code == "patched\n"
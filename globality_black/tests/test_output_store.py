@@ -0,0 +1,102 @@
+import black
+
+from globality_black.constants import PostProcessingEngine, PreProcessingEngine
+from globality_black.output_store import (
+    FORMATTER_MODULES,
+    OutputStore,
+    get_entry_size,
+    get_formatter_version,
+    get_hash,
+    get_store_key,
+)
+
+
+def test_store_get_and_put(tmp_path):
+
+    store = OutputStore(tmp_path / "store.db")
+    store.put("changed", "x=1\n", "x = 1\n")
+    store.put("unchanged", "x = 1\n", "x = 1\n")
+
+    assert store.get("changed", "x=1\n") == "x = 1\n"
+    # outputs identical to their input are stored without the code
+    assert store.get("unchanged", "x = 1\n") == "x = 1\n"
+    assert store.get_size() == (
+        get_entry_size("changed", get_hash("x = 1\n"), "x = 1\n")
+        + get_entry_size("unchanged", get_hash("x = 1\n"), None)
+    )
+    assert store.get("missing", "y = 2\n") is None
+
+    # only outputs checked in safe mode are reused in safe mode
+    assert store.get("changed", "x=1\n", verified=True) is None
+    store.put("changed", "x=1\n", "x = 1\n", verified=True)
+    assert store.get("changed", "x=1\n", verified=True) == "x = 1\n"
+
+    # the store is shared with other connections (e.g. other workers)
+    assert OutputStore(tmp_path / "store.db").get("changed", "x=1\n") == "x = 1\n"
+
+
+def test_store_evicts_least_recently_used(tmp_path):
+
+    entry_size = get_entry_size("key_0", get_hash("output 0\n"), "output 0\n")
+    store = OutputStore(tmp_path / "store.db", max_size=3 * entry_size)
+    for index in range(3):
+        store.put(f"key_{index}", "", f"output {index}\n")
+    # last used: key_2, key_0, key_1
+    store.get("key_0", "")
+
+    store.put("key_3", "", "output 3\n")
+
+    assert store.get_size() == 3 * entry_size
+    assert store.get("key_1", "") is None
+    assert [store.get(f"key_{index}", "") for index in (0, 2, 3)] == [
+        "output 0\n",
+        "output 2\n",
+        "output 3\n",
+    ]
+
+
+def test_store_counts_unchanged_outputs(tmp_path):
+
+    entry_size = get_entry_size("key_0", get_hash("x = 0\n"), None)
+    store = OutputStore(tmp_path / "store.db", max_size=2 * entry_size)
+    for index in range(3):
+        store.put(f"key_{index}", f"x = {index}\n", f"x = {index}\n")
+    # replacing an entry does not count it twice
+    store.put("key_2", "x = 2\n", "x = 2\n")
+
+    assert store.get_size() == 2 * entry_size
+    assert store.get("key_0", "x = 0\n") is None
+    # the total is kept in the store, for other connections
+    assert OutputStore(tmp_path / "store.db").get_size() == 2 * entry_size
+
+
+def test_store_key_depends_on_mode():
+
+    code = "x = 1\n"
+    mode = black.Mode(line_length=100)
+
+    assert get_store_key(code, mode) == get_store_key(code, black.Mode(line_length=100))
+    assert get_store_key(code, mode) != get_store_key(code, black.Mode(line_length=80))
+    assert get_store_key(code, mode) != get_store_key("x = 2\n", mode)
+
+
+def test_store_key_depends_on_engines():
+
+    code = "x = 1\n"
+    mode = black.Mode(line_length=100)
+    tokenize = PreProcessingEngine.TOKENIZE
+
+    assert get_store_key(code, mode) != get_store_key(code, mode, pre_engine=tokenize)
+    assert get_store_key(code, mode) != get_store_key(
+        code,
+        mode,
+        post_engine=PostProcessingEngine.BLIB2TO3,
+    )
+
+
+def test_formatter_version_only_depends_on_output_modules():
+
+    # e.g. changing the CLI keeps the stored outputs
+    assert "globality_black.cli" not in FORMATTER_MODULES
+    assert "globality_black.reformat_text" in FORMATTER_MODULES
+    assert get_formatter_version().startswith(f"{black.__version__}-")
@@ -0,0 +1,35 @@
+"""
+Inputs found slow or crashing by benchmarks/fuzz.py, which must be formatted within budget
+"""
+import time
+
+import black
+import pytest
+
+from globality_black.constants import DEFAULT_BLACK_LINE_LENGTH
+from globality_black.executors import FORMAT_BYTES_PER_SECOND
+from globality_black.reformat_text import reformat_text
+from globality_black.tests.fixtures import get_fixture_path
+
+
+# more lenient than benchmarks/fuzz.py, as CI machines are slower and noisier
+BUDGET_FACTOR = 20
+OVERHEAD_SECONDS = 1.0
+
+
+@pytest.mark.parametrize(
+    "path",
+    sorted(get_fixture_path("performance").glob("*.txt")),
+    ids=lambda path: path.stem,
+)
+def test_performance_fixture(path):
+
+    input_code = path.read_text()
+
+    start = time.perf_counter()
+    output_code = reformat_text(input_code, black.Mode(line_length=DEFAULT_BLACK_LINE_LENGTH))
+    seconds = time.perf_counter() - start
+
+    # black can multiply the size of deeply nested code with indentation
+    size = max(len(input_code), len(output_code))
+    assert seconds <= BUDGET_FACTOR * size / FORMAT_BYTES_PER_SECOND + OVERHEAD_SECONDS
@@ -1,9 +1,25 @@
+import black
 import pytest
 
 from globality_black.black_handler import get_black_mode
-from globality_black.reformat_text import reformat_text
+from globality_black.common import set_leaf_prefix
+from globality_black.constants import (
+    ALL_FEATURES,
+    Feature,
+    PostProcessingEngine,
+    PreProcessingEngine,
+)
+from globality_black.parse_cache import ParseCache
+from globality_black.reformat_text import (
+    BlackError,
+    UnsafeReformatError,
+    assert_safe_reformat,
+    cover_with_parso,
+    reformat_text,
+)
 from globality_black.tests import show_diff
 from globality_black.tests.fixtures import get_fixture_path
+from globality_black.tokenize_cover import TokenizeError, cover_with_tokenize
 
 
 @pytest.mark.parametrize(
@@ -16,13 +32,199 @@ from globality_black.tests.fixtures import get_fixture_path
         "tuples",
     ],
 )
-def test_reformat_text(feature):
+@pytest.mark.parametrize("post_engine", tuple(PostProcessingEngine))
+@pytest.mark.parametrize("pre_engine", tuple(PreProcessingEngine))
+def test_reformat_text(feature, post_engine, pre_engine):
 
     path = get_fixture_path(f"{feature}_input.txt")
     expected_output = get_fixture_path(f"{feature}_output.txt").read_text()
 
     black_mode = get_black_mode(path)
-    output = reformat_text(path.read_text(), black_mode)
+    output = reformat_text(
+        path.read_text(),
+        black_mode,
+        post_engine=post_engine,
+        pre_engine=pre_engine,
+    )
 
     diff = show_diff(output, expected_output)  # noqa here to help debug
     assert expected_output == output
+
+
+@pytest.mark.parametrize(
+    "feature",
+    [
+        "blank_lines",
+        "fmt_off",
+        "comprehensions",
+        "dotted_chains",
+        "tuples",
+    ],
+)
+def test_reformat_text_safe_mode(feature):
+
+    path = get_fixture_path(f"{feature}_input.txt")
+    expected_output = get_fixture_path(f"{feature}_output.txt").read_text()
+
+    output = reformat_text(path.read_text(), get_black_mode(path), safe=True)
+
+    assert expected_output == output
+
+
+def test_assert_safe_reformat_detects_non_equivalent_code():
+
+    black_mode = get_black_mode(get_fixture_path("tuples_input.txt"))
+
+    with pytest.raises(UnsafeReformatError, match="not equivalent"):
+        assert_safe_reformat("x = 1\n", "x = 2\n", black_mode)
+
+
+def test_assert_safe_reformat_detects_unstable_code():
+
+    black_mode = get_black_mode(get_fixture_path("tuples_input.txt"))
+
+    with pytest.raises(UnsafeReformatError, match="not stable"):
+        assert_safe_reformat("x = [1,2]\n", "x = [1,2]\n\n", black_mode)
+
+
+def test_post_engines_agree_on_fmt_on_before_dedent():
+    """
+    blib2to3 keeps comments found before a dedent in a DEDENT leaf, whereas parso moves them to
+    the next statement. Both engines must agree on where formatting is enabled again
+    """
+
+    code = (
+        "def foo():\n"
+        "    # fmt: off\n"
+        "    x = {i: i for i in range(3)}\n"
+        "    # fmt: on\n"
+        "y = {i: i for i in range(3)}\n"
+    )
+    black_mode = get_black_mode(get_fixture_path("tuples_input.txt"))
+
+    outputs = [
+        reformat_text(code, black_mode, post_engine=post_engine)
+        for post_engine in PostProcessingEngine
+    ]
+
+    assert outputs[0] == outputs[1]
+    assert "y = {\n    i: i\n    for i in range(3)\n}\n" in outputs[0]
+
+
+@pytest.mark.parametrize(
+    "fixture",
+    [
+        "blank_lines_input.txt",
+        "fmt_off_input.txt",
+        "comprehensions_input.txt",
+        "dotted_chains_input.txt",
+        "tuples_input.txt",
+        "blank_lines_output.txt",
+        "fmt_off_output.txt",
+        "comprehensions_output.txt",
+        "dotted_chains_output.txt",
+        "tuples_output.txt",
+    ],
+)
+def test_pre_engines_agree(fixture):
+
+    code = get_fixture_path(fixture).read_text()
+
+    assert cover_with_tokenize(code) == cover_with_parso(code)
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "with (\n    open(x) as f,\n    open(y) as g,\n):\n    pass\n",
+        "match x:\n    case (1,):\n        pass\n",
+        "try:\n    pass\nexcept* (A, B):\n    pass\n",
+        "def f[T](x: T):\n    pass\n",
+        "x = y[*a]\n",
+        # unmatched brackets, reported by black
+        ")\n",
+        "x = [1]]\n",
+    ],
+)
+def test_tokenize_engine_falls_back_on_syntax_not_supported_by_parso(code):
+
+    with pytest.raises(TokenizeError):
+        cover_with_tokenize(code)
+
+
+@pytest.mark.parametrize("code", [")\n", "]]\n"])
+def test_tokenize_engine_reports_unmatched_brackets_as_black_errors(code):
+
+    with pytest.raises(BlackError):
+        reformat_text(code, black.Mode(), pre_engine=PreProcessingEngine.TOKENIZE)
+
+
+def test_reformat_text_with_cache_key():
+    """
+    Formatting successive edits of the same buffer reparses it incrementally, with the same output
+    as formatting from scratch
+    """
+
+    path = get_fixture_path("blank_lines_input.txt")
+    black_mode = get_black_mode(path)
+    lines = path.read_text().split("\n")
+
+    for index in (30, 10, 10, 50):
+        lines.insert(index, "")
+        code = "\n".join(lines)
+        output = reformat_text(code, black_mode, cache_key="buffer-id")
+
+        assert output == reformat_text(code, black_mode)
+
+
+def test_parse_cache_restores_prefixes_and_is_bounded():
+
+    parse_cache = ParseCache(max_size=2)
+    code = "x = foo(\n    a,\n\n    b,\n)\n"
+
+    with parse_cache.parse(code, "a") as module:
+        cached_module = module
+        set_leaf_prefix(module.get_first_leaf(), "# modified\n")
+        assert module.get_code() != code
+
+    with parse_cache.parse(code, "a") as module:
+        assert module is cached_module
+        assert module.get_code() == code
+
+    for cache_key in ("b", "c"):
+        with parse_cache.parse(code, cache_key):
+            pass
+
+    assert list(parse_cache.keys) == ["b", "c"]
+
+
+@pytest.mark.parametrize("disabled_feature", tuple(Feature))
+def test_reformat_text_with_disabled_feature(disabled_feature):
+    """
+    Disabling a feature changes the output of its fixture, the same way for all engines.
+    Disabling all of them is black
+    """
+
+    path = get_fixture_path(f"{disabled_feature.value.replace('-', '_')}_input.txt")
+    code = path.read_text()
+    black_mode = get_black_mode(path)
+    features = ALL_FEATURES - {disabled_feature}
+
+    outputs = {
+        reformat_text(
+            code,
+            black_mode,
+            post_engine=post_engine,
+            pre_engine=pre_engine,
+            features=features,
+        )
+        for post_engine in PostProcessingEngine
+        for pre_engine in PreProcessingEngine
+    }
+
+    assert len(outputs) == 1
+    assert outputs != {reformat_text(code, black_mode)}
+    assert reformat_text(code, black_mode, features=frozenset()) == black.format_str(
+        code,
+        mode=black_mode,
+    )
@@ -0,0 +1,56 @@
+import pytest
+
+from globality_black.sharding import parse_shard, select_shard
+from globality_black.summary import get_path_key
+
+
+@pytest.fixture
+def paths(tmp_path):
+    # one big file and 6 small ones
+    sizes = [600, 100, 100, 100, 100, 100, 100]
+    paths = []
+    for index, size in enumerate(sizes):
+        path = tmp_path / f"file_{index}.py"
+        path.write_text("x" * size)
+        paths.append(path)
+    return paths
+
+
+def test_select_shard_balances_by_size(paths):
+
+    shards = [select_shard(paths, index, 2) for index in (1, 2)]
+
+    assert sorted(shards[0] + shards[1]) == sorted(paths)
+    assert sorted(len(shard) for shard in shards) == [1, 6]
+    # deterministic
+    assert shards == [select_shard(paths, index, 2) for index in (1, 2)]
+
+
+def test_select_shard_balances_by_given_sizes(tmp_path):
+
+    # e.g. files read from git, not on disk
+    paths = [tmp_path / f"file_{index}.py" for index in range(4)]
+    sizes = dict(zip(paths, [300, 100, 100, 100]))
+
+    shards = [select_shard(paths, index, 2, sizes=sizes) for index in (1, 2)]
+
+    assert [paths[0]] in shards
+
+
+def test_select_shard_balances_by_recorded_duration(paths):
+
+    # the big file was quick, the first small one slow
+    durations = {get_path_key(path): 1.0 for path in paths}
+    durations[get_path_key(paths[0])] = 0.1
+    durations[get_path_key(paths[1])] = 6.0
+
+    shards = [select_shard(paths, index, 2, durations) for index in (1, 2)]
+
+    assert [paths[1]] in shards
+
+
+@pytest.mark.parametrize("value", ["1", "0/2", "3/2", "a/b"])
+def test_parse_shard_invalid(value):
+
+    with pytest.raises(ValueError):
+        parse_shard(value)
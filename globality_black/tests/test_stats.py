@@ -0,0 +1,126 @@
+import black
+import pytest
+
+from globality_black.constants import PostProcessingEngine, PreProcessingEngine
+from globality_black.reformat_text import reformat_text
+from globality_black.stats import (
+    BLACK_BYTES_IN,
+    BLACK_BYTES_OUT,
+    COMPREHENSIONS_EXPLODED,
+    GET_CODE_CALLS,
+    INDENTATION_LEAF_LOOKUPS,
+    VISITOR_NODES,
+    VISITOR_TRAVERSALS,
+    count,
+    format_counters,
+    record_counters,
+)
+
+
+BLACK_MODE = black.Mode(line_length=100)
+
+BLOCK = """
+def function_{index}(values):
+    result = {{value: value for value in values if value}}
+    point = (
+        values,
+    )
+    items = [
+        1,
+
+        2,
+    ]
+    return (
+        values
+        .copy()
+        .items()
+    )
+"""
+
+
+def get_code(blocks):
+    return "".join(BLOCK.format(index=index) for index in range(blocks))
+
+
+def count_work(code, **kwargs):
+    with record_counters() as counters:
+        output_code = reformat_text(code, BLACK_MODE, **kwargs)
+    return counters, output_code
+
+
+def test_counts_are_only_recorded_within_record_counters():
+
+    count("ignored")
+
+    with record_counters() as counters:
+        count("outer", 2)
+        with record_counters() as inner_counters:
+            count("inner")
+        count("outer")
+
+    assert counters == {"outer": 3}
+    assert inner_counters == {"inner": 1}
+
+
+def test_work_grows_linearly_with_the_input():
+
+    small_counters, _ = count_work(get_code(10))
+    large_counters, output_code = count_work(get_code(40))
+
+    # a bounded number of traversals per block, each visiting a bounded number of nodes
+    assert large_counters[VISITOR_NODES] <= 4.1 * small_counters[VISITOR_NODES]
+    assert large_counters[VISITOR_TRAVERSALS] <= 4.1 * small_counters[VISITOR_TRAVERSALS]
+
+    # the whole tree is turned back into code once before black, and once after
+    assert large_counters[GET_CODE_CALLS] == small_counters[GET_CODE_CALLS] == 2
+
+    # one sentinel per line to keep, and a bounded number of lookups per comprehension
+    assert large_counters["sentinels.BLANK_LINE_TOKEN"] == 40
+    assert large_counters["sentinels.TUPLE_TOKEN"] == 40
+    assert large_counters["sentinels.DOTTED_CHAIN_TOKEN"] == 2 * 40
+    assert large_counters[COMPREHENSIONS_EXPLODED] == 40
+    assert large_counters[INDENTATION_LEAF_LOOKUPS] <= 3 * 40
+
+    # sentinels go through black
+    assert large_counters[BLACK_BYTES_IN] > len(get_code(40).encode())
+    assert large_counters[BLACK_BYTES_OUT] > 0
+    assert output_code.count("BLANK_LINE_TOKEN") == 0
+
+
+@pytest.mark.parametrize(
+    "post_engine, pre_engine",
+    [
+        (PostProcessingEngine.BLIB2TO3, PreProcessingEngine.PARSO),
+        (PostProcessingEngine.PARSO, PreProcessingEngine.TOKENIZE),
+    ],
+)
+def test_engines_do_the_same_formatting_work(post_engine, pre_engine):
+
+    code = get_code(5)
+    counters, output_code = count_work(code)
+    engine_counters, engine_output_code = count_work(
+        code,
+        post_engine=post_engine,
+        pre_engine=pre_engine,
+    )
+
+    assert engine_output_code == output_code
+    for name in [
+        COMPREHENSIONS_EXPLODED,
+        BLACK_BYTES_IN,
+        BLACK_BYTES_OUT,
+        "sentinels.BLANK_LINE_TOKEN",
+        "sentinels.TUPLE_TOKEN",
+        "sentinels.DOTTED_CHAIN_TOKEN",
+    ]:
+        assert engine_counters[name] == counters[name]
+
+
+def test_format_counters():
+
+    assert format_counters({}, 0) == "No work counted"
+    assert format_counters({"visitor.nodes": 30, "get_code.calls": 4}, 2).splitlines() == [
+        "counter                total    per file",
+        "get_code.calls             4         2.0",
+        "visitor.nodes             30        15.0",
+    ]
@@ -0,0 +1,52 @@
+import json
+
+from globality_black.trace import (
+    get_worker_id,
+    record_spans,
+    span,
+    write_trace,
+)
+
+
+def test_spans_are_only_recorded_within_record_spans():
+
+    with span("ignored", size=1) as args:
+        args["status"] = "unchanged"
+    assert args == {"size": 1, "status": "unchanged"}
+
+    with record_spans() as spans:
+        with span("file", size=1) as args:
+            with record_spans() as inner_spans:
+                with span("inner"):
+                    pass
+            with span("parse"):
+                pass
+            args["status"] = "modified"
+
+    assert [recorded.name for recorded in inner_spans] == ["inner"]
+    assert [recorded.name for recorded in spans] == ["parse", "file"]
+    assert spans[1].args == {"size": 1, "status": "modified"}
+    assert spans[1].worker == get_worker_id()
+    assert spans[1].start <= spans[0].start
+    assert spans[0].seconds <= spans[1].seconds
+
+
+def test_write_trace(tmp_path):
+
+    with record_spans() as spans:
+        with span("file", path="a.py"):
+            pass
+    other_span = spans[0]._replace(worker="other", start=spans[0].start + 1)
+
+    path = tmp_path / "run.json"
+    write_trace(path, [other_span, *spans], spans[0].start, get_worker_id())
+    events = json.loads(path.read_text())["traceEvents"]
+
+    assert [(event["ph"], event["tid"], event["ts"]) for event in events[:2]] == [
+        ("X", 0, 0),
+        ("X", 1, 1e6),
+    ]
+    assert events[0]["args"] == {"path": "a.py"}
+    assert {
+        event["tid"]: event["args"]["name"] for event in events if event["name"] == "thread_name"
+    } == {0: "main", 1: "worker 1"}
@@ -0,0 +1,46 @@
+import os
+import time
+
+import pytest
+
+from globality_black.workers import WorkerFailure, WorkerPool
+
+
+def square(item):
+    if item == "hang":
+        time.sleep(60)
+    if item == "crash":
+        os._exit(3)
+    if item == "raise":
+        raise ValueError("Invalid item")
+    return item * item
+
+
+@pytest.mark.parametrize("ordered", (True, False))
+def test_worker_pool_isolates_timeouts_and_crashes(ordered):
+
+    items = [1, "hang", 2, "crash", 3, 4]
+    pool = WorkerPool(square, workers=2, timeout=1)
+
+    start = time.perf_counter()
+    results = dict(pool.imap(items, ordered=ordered))
+
+    assert time.perf_counter() - start < 10
+    assert [results[item] for item in (1, 2, 3, 4)] == [1, 4, 9, 16]
+    assert isinstance(results["hang"], WorkerFailure)
+    assert results["hang"].message == "Timed out after 1s"
+    assert results["crash"].message == "Worker died (exit code 3)"
+    if ordered:
+        assert list(results) == items
+
+
+def test_worker_pool_reports_errors():
+
+    pool = WorkerPool(square, workers=1)
+
+    results = list(pool.imap([1, "raise", 2]))
+
+    assert results[0] == (1, 1)
+    assert isinstance(results[1][1], WorkerFailure)
+    assert results[1][1].message == "ValueError: Invalid item"
+    assert results[2] == (2, 4)
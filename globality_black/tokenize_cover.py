@@ -0,0 +1,470 @@
+"""
+Pre-processing engine based on the stdlib `tokenize` stream, as an alternative to building a full
+parso tree just to cover blank lines, dotted chains and size one tuples
+
+The covering steps only need to know, for each token:
+ - its prefix, i.e. the text (whitespace, comments) between the previous token and this one
+ - whether it belongs to an `atom` (a bracketed expression) or an `atom_expr` (a primary followed
+ by trailers, e.g. `df.assign(x=1)`), as parso would parse it
+ - whether it is in a `fmt: off` region
+
+We get all of this in a single linear pass over the tokens, tracking a stack of brackets and
+the chain of trailers at each bracket depth, and then insert the same sentinels as the parso
+engine (see blank_lines.py, dotted_chains.py and tuples.py):
+
+    parso engine                      tokenize engine
+    atom                              bracket not opening parameters, class bases or imports
+    atom_expr                         primary followed by trailers (`.name`, `(...)`, `[...]`)
+    size one tuple                    `(` atom whose last token before `)` is a comma
+    fmt: off / fmt: on                statement level state machine, see `FmtOnOffTracker`
+
+If the code cannot be tokenized, or uses syntax that parso can only parse with error recovery
+(e.g. match statements, `except*`, type parameters or `as` inside a parenthesized `with`), for
+which we cannot replicate the tree parso would build, TokenizeError is raised so the caller can
+fall back to parso. Same for unmatched closing brackets.
+
+Both engines then insert the same sentinels, except where parso fails to tokenize valid code and
+recovers with error nodes, where it covers nothing, e.g. raw f-strings with a backslash before a
+doubled brace (parso 0.8). There, this engine covers the lines as for any other code
+"""
+import io
+import keyword
+import re
+import tokenize
+from typing import (
+    FrozenSet,
+    List,
+    Optional,
+    Tuple,
+)
+
+from globality_black.blank_lines import add_token_if_line_to_keep
+from globality_black.constants import ALL_FEATURES, Feature
+from globality_black.dotted_chains import (
+    NEW_LINE_AND_INDENT_REGEX,
+    get_new_prefix as get_new_dotted_chain_prefix,
+    starts_with_dot,
+)
+from globality_black.tuples import get_new_prefix as get_new_tuple_prefix
+
+
+OPENING_BRACKETS = {"(", "[", "{"}
+CLOSING_BRACKETS = {")", "]", "}"}
+CLAUSE_KEYWORDS = {"else", "elif", "except", "finally"}
+SOFT_KEYWORD_STATEMENTS = {"match", "case"}
+KEYWORD_ATOMS = {"None", "True", "False", "..."}
+HARD_KEYWORDS = set(keyword.kwlist) - KEYWORD_ATOMS
+
+# f-strings are split in several tokens from python 3.12
+FSTRING_START = getattr(tokenize, "FSTRING_START", None)
+FSTRING_END = getattr(tokenize, "FSTRING_END", None)
+IGNORED_TOKEN_TYPES = {tokenize.COMMENT, tokenize.NL, tokenize.INDENT, tokenize.DEDENT}
+
+
+class TokenizeError(Exception):
+    pass
+
+
+class BracketFrame:
+    """
+    State for one bracket depth. The kind of the bracket opening it is one of:
+     - ATOM: `(`, `[` or `{` starting an expression (parso atom)
+     - TRAILER: `(` or `[` after a primary, i.e. a call or subscript (part of an atom_expr)
+     - OTHER: parameters of a def, bases of a class or names in an import
+    """
+
+    ATOM, TRAILER, OTHER = "atom", "trailer", "other"
+
+    def __init__(
+        self,
+        kind: Optional[str],
+        open_index: int,
+        in_atom: bool,
+        is_subscript: bool = False,
+    ):
+        self.kind = kind
+        self.is_subscript = is_subscript
+        self.open_index = open_index
+        self.in_atom = in_atom
+
+        # whether a trailer can follow the last token, i.e. it ends a primary or a trailer
+        self.can_trail = False
+        self.expects_trailer_name = False
+        self.last_was_string = False
+        self.primary_start: Optional[int] = None
+        self.pending_await: Optional[int] = None
+        # index of the first token of each child of the current atom_expr (if any)
+        self.chain: Optional[List[int]] = None
+
+
+class FmtOnOffTracker:
+    """
+    Replicate the `fmt: off` / `fmt: on` semantics of common.find_fmt_off_regions, which checks
+    the prefix of statements (and function / class definitions) while traversing the tree,
+    skipping whole subtrees when off. Hence, a `fmt: on` inside a block skipped as a whole is
+    ignored. In terms of logical lines:
+     - a statement is reached if its enclosing block was entered
+     - a block is entered if the line opening it (e.g. `if x:`, `else:`) was enabled
+     - decorators and the decorated definition form one node, the toggle is only checked on the
+     `def` / `class` line, and only if the decorators were enabled
+    """
+
+    def __init__(self, check_fmt_on_off: bool):
+        self.check_fmt_on_off = check_fmt_on_off
+        self.fmt_off = False
+        self.blocks_entered = [True]
+        self.line_enabled = True
+        self.in_decorators = False
+        self.decorators_enabled = False
+
+    def indent(self):
+        self.blocks_entered.append(self.line_enabled)
+
+    def dedent(self):
+        self.blocks_entered.pop()
+
+    def start_line(self, first_token: str, prefix: str) -> bool:
+        reached = self.blocks_entered[-1]
+
+        if first_token == "@":
+            if not self.in_decorators:
+                self.in_decorators = True
+                self.decorators_enabled = reached and not self.fmt_off
+            self.line_enabled = self.decorators_enabled
+            return self.line_enabled
+
+        if self.in_decorators:
+            # the decorated definition is only reached if the decorators were enabled
+            self.in_decorators = False
+            reached = self.decorators_enabled
+
+        if reached and first_token not in CLAUSE_KEYWORDS and self.check_fmt_on_off:
+            if "fmt: off" in prefix:
+                self.fmt_off = True
+            if "fmt: on" in prefix:
+                self.fmt_off = False
+
+        self.line_enabled = reached and not self.fmt_off
+        return self.line_enabled
+
+
+def cover_with_tokenize(code: str, features: FrozenSet[Feature] = ALL_FEATURES) -> str:
+    """
+    Return `code` with the blank lines, dotted chains and size one tuples covered, for those
+    enabled in `features`
+    """
+
+    coverer = TokenCoverer(code)
+    try:
+        for token in iter_tokens(code, coverer.fmt_tracker):
+            coverer.visit(*token)
+    except (tokenize.TokenError, SyntaxError) as e:
+        raise TokenizeError(e)
+
+    return coverer.get_covered_code(features)
+
+
+def iter_tokens(code: str, fmt_tracker: FmtOnOffTracker):
+    """
+    Yield (type, string, start offset, end offset, start position) for the significant tokens
+    of `code`, i.e. skipping comments and non-logical new lines, a whole f-string being one token
+    """
+
+    line_offsets = [0] + [match.end() for match in re.finditer("\n", code)] + [len(code)]
+    fstring_depth, fstring_start = 0, 0
+
+    for token_type, string, start, end, _ in tokenize.generate_tokens(io.StringIO(code).readline):
+        if token_type in IGNORED_TOKEN_TYPES:
+            if token_type == tokenize.INDENT:
+                fmt_tracker.indent()
+            elif token_type == tokenize.DEDENT:
+                fmt_tracker.dedent()
+            continue
+
+        if token_type == tokenize.ERRORTOKEN:
+            raise TokenizeError(f"Cannot tokenize {string!r} at {start}")
+
+        start_offset = line_offsets[start[0] - 1] + start[1]
+        end_offset = line_offsets[end[0] - 1] + end[1]
+
+        if token_type == FSTRING_START:
+            if fstring_depth == 0:
+                fstring_start = start_offset
+            fstring_depth += 1
+            continue
+        if fstring_depth:
+            if token_type != FSTRING_END:
+                continue
+            fstring_depth -= 1
+            if fstring_depth:
+                continue
+            token_type, start_offset = tokenize.STRING, fstring_start
+            string = code[start_offset:end_offset]
+
+        yield token_type, string, start_offset, end_offset, start
+
+
+class TokenCoverer:
+    """
+    Visit the significant tokens in order, recording what the covering steps need (see the
+    module docstring), and insert the sentinels at the end
+    """
+
+    def __init__(self, code: str):
+        self.code = code
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+        self.strings: List[str] = []
+        self.in_atom: List[bool] = []
+        self.enabled: List[bool] = []
+        self.covered_ranges: List[Tuple[int, int]] = []
+        self.atom_exprs: List[List[int]] = []
+        self.tuples: List[int] = []
+
+        self.frames = [BracketFrame(None, -1, in_atom=False)]
+        self.fmt_tracker = FmtOnOffTracker(check_fmt_on_off="fmt:" in code)
+        self.line_start, self.line_enabled, self.in_import = True, True, False
+        self.first_string, self.previous_string = "", ""
+        self.defclass_name_index: Optional[int] = None
+
+    def visit(self, token_type: int, string: str, start_offset: int, end_offset: int, start):
+        index = len(self.starts)
+        frame = self.frames[-1]
+
+        if self.line_start and token_type not in (tokenize.NEWLINE, tokenize.ENDMARKER):
+            previous_end = self.ends[-1] if self.ends else 0
+            self.line_enabled = self.fmt_tracker.start_line(
+                string,
+                self.code[previous_end:start_offset],
+            )
+            self.in_import = string in ("import", "from")
+            self.first_string = string
+            self.line_start = False
+
+        self.starts.append(start_offset)
+        self.ends.append(end_offset)
+        self.strings.append(string)
+        self.enabled.append(self.line_enabled)
+        self.in_atom.append(frame.in_atom)
+
+        after_defclass_name = self.defclass_name_index == index - 1
+        if is_unsupported_by_parso(
+            string, self.previous_string, self.first_string, frame, after_defclass_name,
+        ):
+            raise TokenizeError(f"Syntax not supported by parso at {start}")
+
+        if token_type in (tokenize.NEWLINE, tokenize.ENDMARKER):
+            self.end_chain(frame, index)
+            self.line_start, self.in_import = True, False
+
+        elif string in OPENING_BRACKETS and token_type == tokenize.OP:
+            self.visit_opening_bracket(string, index, frame, after_defclass_name)
+
+        elif string in CLOSING_BRACKETS and token_type == tokenize.OP:
+            self.visit_closing_bracket(string, index)
+
+        elif string == "." and frame.can_trail:
+            frame.chain = frame.chain or [frame.primary_start]  # type: ignore
+            frame.chain.append(index)
+            frame.can_trail, frame.expects_trailer_name = False, True
+
+        elif token_type == tokenize.NAME and frame.expects_trailer_name:
+            frame.can_trail, frame.expects_trailer_name = True, False
+
+        elif string == "await":
+            self.end_chain(frame, index)
+            frame.pending_await = index
+
+        elif is_primary(token_type, string) and not self.in_import:
+            self.visit_primary(token_type, index, frame)
+
+        else:
+            self.end_chain(frame, index)
+
+        self.previous_string = string
+
+    def visit_opening_bracket(
+        self,
+        string: str,
+        index: int,
+        frame: BracketFrame,
+        after_defclass_name: bool,
+    ):
+        if self.in_import or after_defclass_name:
+            kind = BracketFrame.OTHER
+        elif frame.can_trail and string != "{":
+            kind = BracketFrame.TRAILER
+            frame.chain = frame.chain or [frame.primary_start]  # type: ignore
+            frame.chain.append(index)
+        else:
+            kind = BracketFrame.ATOM
+            self.end_chain(frame, index)
+            start_primary(frame, index)
+
+        self.in_atom[index] = frame.in_atom or kind != BracketFrame.OTHER
+        is_subscript = kind == BracketFrame.TRAILER and string == "["
+        self.frames.append(BracketFrame(kind, index, self.in_atom[index], is_subscript))
+
+    def visit_closing_bracket(self, string: str, index: int):
+        if len(self.frames) == 1:
+            # black reports the syntax error
+            raise TokenizeError(f"Unmatched {string!r}")
+
+        inner = self.frames.pop()
+        self.end_chain(inner, index)
+        self.in_atom[index] = inner.in_atom
+        is_tuple = (
+            inner.kind == BracketFrame.ATOM
+            and string == ")"
+            and inner.open_index != index - 1
+            and self.strings[index - 1] == ","
+        )
+        if is_tuple:
+            self.tuples.append(inner.open_index)
+
+        frame = self.frames[-1]
+        frame.can_trail = inner.kind != BracketFrame.OTHER
+        frame.last_was_string = False
+
+    def visit_primary(self, token_type: int, index: int, frame: BracketFrame):
+        if self.previous_string in ("def", "class"):
+            self.end_chain(frame, index)
+            self.defclass_name_index = index
+        elif token_type == tokenize.STRING and frame.last_was_string:
+            # implicit concatenation, same primary
+            pass
+        else:
+            self.end_chain(frame, index)
+            start_primary(frame, index)
+            frame.can_trail = True
+            frame.last_was_string = token_type == tokenize.STRING
+
+    def end_chain(self, frame: BracketFrame, end_index: int):
+        if frame.chain is not None:
+            self.atom_exprs.append(frame.chain)
+            self.covered_ranges.append((frame.chain[0], end_index))
+        frame.chain = None
+        frame.can_trail = False
+        frame.expects_trailer_name = False
+        frame.last_was_string = False
+
+    def get_covered_code(self, features: FrozenSet[Feature] = ALL_FEATURES) -> str:
+        code, strings, enabled = self.code, self.strings, self.enabled
+        prefixes = [
+            code[previous_end:start]
+            for previous_end, start in zip([0] + self.ends[:-1], self.starts)
+        ]
+        in_atom = mark_covered_ranges(self.in_atom, self.covered_ranges)
+
+        # blank lines
+        if Feature.BLANK_LINES in features:
+            for index, prefix in enumerate(prefixes):
+                if in_atom[index] and enabled[index] and prefix.count("\n") > 1:
+                    prefixes[index] = add_token_if_line_to_keep(prefix)
+
+        # dotted chains
+        if Feature.DOTTED_CHAINS in features:
+            for chain in self.atom_exprs:
+                if enabled[chain[0]] and is_dotted_chain(chain, prefixes, strings):
+                    self.cover_dotted_chain(chain, prefixes)
+
+        # size one tuples
+        if Feature.TUPLES in features:
+            for open_index in self.tuples:
+                if enabled[open_index]:
+                    prefixes[open_index + 1] = get_new_tuple_prefix(prefixes[open_index + 1])
+
+        return "".join(
+            prefix + code[start:end]
+            for prefix, start, end in zip(prefixes, self.starts, self.ends)
+        )
+
+    def cover_dotted_chain(self, chain: List[int], prefixes: List[str]):
+        for index in chain[1:]:
+            if starts_with_dot(prefixes[index], self.strings[index]):
+                prefixes[index] = get_new_dotted_chain_prefix(prefixes[index])
+
+
+def is_unsupported_by_parso(
+    string: str,
+    previous_string: str,
+    first_string: str,
+    frame: BracketFrame,
+    after_defclass_name: bool,
+) -> bool:
+    """
+    Whether the token is part of a construct that parso only parses with error recovery
+    """
+
+    if string == ":" and first_string in SOFT_KEYWORD_STATEMENTS and frame.kind is None:
+        # `match x:` / `case y:` (an annotated `match: int = 1` simply falls back to parso)
+        return True
+    if previous_string == "type" and first_string == "type" and frame.kind is None:
+        # `type X = int`
+        return string.isidentifier()
+    if string == "as":
+        # `with (open(x) as f, open(y) as g):`
+        return frame.kind in (BracketFrame.ATOM, BracketFrame.TRAILER)
+    if string == "*":
+        # `except* E`, `x[*a]`, `def f(*args: *Ts)`
+        if previous_string == "except":
+            return True
+        if frame.is_subscript and previous_string in ("[", ","):
+            return True
+        return frame.kind == BracketFrame.OTHER and previous_string == ":"
+    # `def f[T](x: T)`, `class A[T]:`
+    return string == "[" and after_defclass_name
+
+
+def start_primary(frame: BracketFrame, index: int):
+    """
+    A primary starts at `index`. If preceded by `await`, this is an atom_expr already
+    """
+
+    if frame.pending_await is not None:
+        frame.primary_start = frame.pending_await
+        frame.chain = [frame.pending_await, index]
+        frame.pending_await = None
+    else:
+        frame.primary_start = index
+        frame.chain = None
+
+
+def is_primary(token_type: int, string: str) -> bool:
+    if token_type == tokenize.NAME:
+        return string not in HARD_KEYWORDS
+    return token_type in (tokenize.NUMBER, tokenize.STRING) or string == "..."
+
+
+def mark_covered_ranges(in_atom: List[bool], ranges) -> List[bool]:
+    """
+    Tokens of an atom_expr outside brackets (e.g. `x` and `.y` in `x.y`) are also in an atom
+    """
+
+    delta = [0] * (len(in_atom) + 1)
+    for start, end in ranges:
+        delta[start] += 1
+        delta[end] -= 1
+
+    covered, depth = [], 0
+    for index, value in enumerate(in_atom):
+        depth += delta[index]
+        covered.append(value or depth > 0)
+    return covered
+
+
+def is_dotted_chain(chain: List[int], prefixes: List[str], strings: List[str]) -> bool:
+    """
+    Same as dotted_chains.is_dotted_chain, with `chain` the first token of each child
+    """
+
+    if not NEW_LINE_AND_INDENT_REGEX.match(prefixes[chain[0]]):
+        return False
+
+    for index in chain[1:]:
+        prefix = prefixes[index]
+        if NEW_LINE_AND_INDENT_REGEX.match(prefix + strings[index]):
+            if not starts_with_dot(prefix, strings[index]):
+                return False
+
+    return True
@@ -0,0 +1,112 @@
+"""
+Timeline of a run in the Chrome trace-event format, to be loaded in chrome://tracing or
+https://ui.perfetto.dev, see --trace-out
+
+Each file is processed within `record_spans`, collecting the spans opened with `span` in the same
+thread (read, parse, each cover pass, black, ...). Spans travel back to the main process with the
+result of the file, tagged with the worker (process and thread) they ran in, and are written as
+one track per worker. Gaps between the spans of a track show a starved (or warming up) worker.
+
+Outside `record_spans`, `span` only checks a thread-local, so instrumented code costs nothing
+when not tracing. Times come from time.perf_counter, a clock shared by the processes of a
+machine (CLOCK_MONOTONIC on Linux), so spans of different workers are comparable.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+)
+
+
+# all tracks are shown as threads of a single process
+TRACE_PID = 1
+
+
+class Span(NamedTuple):
+    name: str
+    start: float
+    seconds: float
+    # process and thread, see get_worker_id
+    worker: str
+    args: Dict[str, Any]
+
+
+LOCAL = threading.local()
+
+
+@contextmanager
+def span(name: str, **args) -> Iterator[Dict[str, Any]]:
+    """
+    Record the time spent in the context as a span, if recording spans in this thread. Yield the
+    arguments of the span, which can be completed within the context
+    """
+
+    spans = getattr(LOCAL, "spans", None)
+    if spans is None:
+        yield args
+        return
+
+    start = time.perf_counter()
+    try:
+        yield args
+    finally:
+        spans.append(Span(name, start, time.perf_counter() - start, get_worker_id(), args))
+
+
+@contextmanager
+def record_spans() -> Iterator[List[Span]]:
+    """Collect the spans of this thread within the context, in the order they end"""
+
+    previous_spans = getattr(LOCAL, "spans", None)
+    spans: List[Span] = []
+    LOCAL.spans = spans
+    try:
+        yield spans
+    finally:
+        LOCAL.spans = previous_spans
+
+
+def get_worker_id() -> str:
+    return f"{os.getpid()}-{threading.get_ident()}"
+
+
+def write_trace(path: Path, spans: Iterable[Span], start: float, main_worker: str):
+    """
+    Write the spans as trace events, with times relative to `start`. The track of `main_worker`
+    is shown first, followed by the others in order of appearance
+    """
+
+    tracks = {main_worker: 0}
+    events: List[Dict[str, Any]] = []
+    for recorded in sorted(spans, key=lambda recorded: recorded.start):
+        events.append({
+            "name": recorded.name,
+            "cat": "globality-black",
+            "ph": "X",
+            "ts": round((recorded.start - start) * 1e6, 3),
+            "dur": round(recorded.seconds * 1e6, 3),
+            "pid": TRACE_PID,
+            "tid": tracks.setdefault(recorded.worker, len(tracks)),
+            "args": recorded.args,
+        })
+
+    events.append(get_metadata_event("process_name", 0, name="globality-black"))
+    for tid in tracks.values():
+        track_name = f"worker {tid}" if tid else "main"
+        events.append(get_metadata_event("thread_name", tid, name=track_name))
+        events.append(get_metadata_event("thread_sort_index", tid, sort_index=tid))
+
+    path.write_text(json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}))
+
+
+def get_metadata_event(event_name: str, tid: int, **args) -> Dict[str, Any]:
+    return {"name": event_name, "ph": "M", "pid": TRACE_PID, "tid": tid, "args": args}
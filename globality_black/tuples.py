@@ -9,13 +9,19 @@ See examples in the test cases of tuples_input and tuple_output
 """
 import re
 
-from parso.python.tree import PythonNode
-
-from globality_black.common import apply_function_to_tree_prefixes
+from parso.python.tree import Module, PythonNode
+from parso.tree import NodeOrLeaf
+
+from globality_black.common import (
+    apply_function_to_tree_prefixes,
+    get_first_leaf,
+    get_last_leaf,
+    set_leaf_prefix,
+)
 from globality_black.constants import TUPLE_TOKEN
 
 
-def cover_tuple_if_needed(candidate: PythonNode):
+def cover_tuple_if_needed(candidate: PythonNode) -> None:
     """
     Check if it is a tuple to cover if so, cover it
     module: contains all python code in this file
@@ -31,24 +37,24 @@ def is_size_one_exploded_tuple(atom: PythonNode) -> bool:
     Assert whether the given atom is a tuple to cover
 
     """
-    # children must be 3  ["(", "item", ")"] and the item must end with a comma (to be a tuple)
+    # children must be 3  ["(", "item", ")"] and the item must end with a comma (to be a tuple),
+    # i.e. its last leaf is a comma (no other leaf value ends with one)
     return (
         len(atom.children) == 3
         and atom.children[0] == "("
-        and atom.children[1].get_code().endswith(",")
+        and get_last_leaf(atom.children[1]).value == ","
     )
 
 
-def cover_tuple(candidate):
+def cover_tuple(candidate: PythonNode) -> None:
     """
     Just modify the prefix of the first child, which is the one element in this tuple
     """
-    node = candidate.children[1]
-    prefix = node.get_first_leaf().prefix
-    node.get_first_leaf().prefix = get_new_prefix(prefix)
+    leaf = get_first_leaf(candidate.children[1])
+    set_leaf_prefix(leaf, get_new_prefix(leaf.prefix))
 
 
-def get_new_prefix(prefix):
+def get_new_prefix(prefix: str) -> str:
     """Add a token to avoid line merging"""
 
     return re.sub(
@@ -58,7 +64,7 @@ def get_new_prefix(prefix):
     )
 
 
-def uncover_tuple(module, root):
+def uncover_tuple(module: Module, root: NodeOrLeaf) -> None:
     """In this case we can apply the function to all lines"""
     apply_function_to_tree_prefixes(
         module,
@@ -67,7 +73,7 @@ def uncover_tuple(module, root):
     )
 
 
-def remove_token_from_covered_tuple(prefix):
+def remove_token_from_covered_tuple(prefix: str) -> str:
     """Remove extra lines with TUPLE_TOKEN added in pre-processing"""
 
     return re.sub(
@@ -0,0 +1,219 @@
+"""
+Pool of worker processes isolating each file from the others
+
+Unlike multiprocessing.Pool, a worker which dies (e.g. killed by the OOM killer), takes longer
+than the timeout or raises an error on one item does not take down the whole run: the item is
+reported as a `WorkerFailure` (the worker being replaced unless it raised), the other items being
+processed as usual. To that end, each worker only receives one item at a time.
+"""
+import multiprocessing as mp
+import time
+from collections import deque
+from multiprocessing.connection import Connection, wait
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    cast,
+)
+
+
+# seconds to wait for a worker to exit before killing it
+JOIN_TIMEOUT = 1.0
+
+
+class WorkerFailure(NamedTuple):
+    message: str
+    seconds: float
+
+
+class Worker:
+    def __init__(self, function: Callable, context, initializer: Optional[Callable] = None):
+        self.connection, worker_connection = context.Pipe()
+        self.process = context.Process(
+            target=run_worker,
+            args=(function, worker_connection, initializer),
+            daemon=True,
+        )
+        self.process.start()
+        worker_connection.close()
+        # index of the item being processed, and when it was sent
+        self.task: Optional[int] = None
+        self.start = 0.0
+
+    def send(self, index: int, item: Any):
+        self.task, self.start = index, time.perf_counter()
+        self.connection.send((index, item))
+
+    def stop(self):
+        if self.task is None and self.process.is_alive():
+            try:
+                self.connection.send(None)
+            except OSError:
+                pass
+            self.process.join(JOIN_TIMEOUT)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.connection.close()
+
+
+def run_worker(function: Callable, connection: Connection, initializer: Optional[Callable]):
+    if initializer is not None:
+        initializer()
+
+    while True:
+        task = connection.recv()
+        if task is None:
+            return
+        index, item = task
+        try:
+            connection.send((index, function(item), None))
+        except Exception as e:
+            # only the message, since the exception may not be picklable
+            connection.send((index, None, f"{type(e).__name__}: {e}"))
+
+
+class WorkerPool:
+    def __init__(
+        self,
+        function: Callable,
+        workers: int,
+        timeout: Optional[float] = None,
+        context=None,
+        initializer: Optional[Callable] = None,
+    ):
+        """
+        Apply `function` with `workers` processes, giving up on items taking more than `timeout`
+        seconds. Each worker calls `initializer` (if any) once when started
+        """
+
+        self.function = function
+        self.workers = workers
+        self.timeout = timeout
+        self.context = context or mp.get_context()
+        self.initializer = initializer
+
+    def imap(
+        self,
+        items: Iterable,
+        ordered: bool = True,
+        prepare: Optional[Callable] = None,
+    ) -> Iterator[Tuple[Any, Any]]:
+        """
+        Yield (item, result) for all items, in order or as soon as available. The result is a
+        WorkerFailure if the worker died, timed out or raised an error. Closing the iterator
+        before the end kills the workers
+
+        If given, `prepare` is applied to each item in this process right before sending it to a
+        worker, e.g. to load its data as late as possible
+        """
+
+        items = list(items)
+        pending = deque(range(len(items)))
+        done: Dict[int, Any] = {}
+        next_index = 0
+        workers = [
+            self.start_worker()
+            for _ in range(min(self.workers, len(items)))
+        ]
+
+        try:
+            for worker in workers:
+                self.send_next(worker, pending, items, prepare)
+
+            while any(worker.task is not None for worker in workers):
+                for index, result in self.wait_results(workers):
+                    if not ordered:
+                        yield items[index], result
+                    else:
+                        done[index] = result
+                    worker = next(worker for worker in workers if worker.task is None)
+                    self.send_next(worker, pending, items, prepare)
+
+                while next_index in done:
+                    yield items[next_index], done.pop(next_index)
+                    next_index += 1
+        finally:
+            for worker in workers:
+                worker.stop()
+
+    def send_next(
+        self,
+        worker: Worker,
+        pending: deque,
+        items: List,
+        prepare: Optional[Callable] = None,
+    ):
+        if pending:
+            index = pending.popleft()
+            item = items[index]
+            worker.send(index, prepare(item) if prepare is not None else item)
+
+    def wait_results(self, workers: List[Worker]) -> List[Tuple[int, Any]]:
+        """
+        Wait for at least one busy worker to finish, die or time out, and return the results of
+        all of them. Dead and timed out workers are replaced in `workers`, while workers which
+        raised an error are reused
+        """
+
+        busy_workers = [worker for worker in workers if worker.task is not None]
+        ready = wait(
+            [worker.connection for worker in busy_workers]
+            + [worker.process.sentinel for worker in busy_workers],
+            timeout=self.get_wait_timeout(busy_workers),
+        )
+
+        results = []
+        now = time.perf_counter()
+        for worker in busy_workers:
+            index, seconds = cast(int, worker.task), now - worker.start
+            if worker.connection in ready or worker.process.sentinel in ready:
+                result = self.receive(worker, seconds)
+                # workers which raised an error are still alive, and reused
+                dead = not worker.process.is_alive()
+            elif self.timeout is not None and seconds >= self.timeout:
+                result = WorkerFailure(f"Timed out after {self.timeout:g}s", seconds)
+                dead = True
+            else:
+                continue
+
+            if dead:
+                workers[workers.index(worker)] = self.replace(worker)
+            worker.task = None
+            results.append((index, result))
+
+        return results
+
+    def receive(self, worker: Worker, seconds: float) -> Any:
+        try:
+            if worker.connection.poll():
+                _, result, error = worker.connection.recv()
+                if error is not None:
+                    return WorkerFailure(error, seconds)
+                return result
+        except (EOFError, OSError):
+            pass
+
+        worker.process.join()
+        return WorkerFailure(f"Worker died (exit code {worker.process.exitcode})", seconds)
+
+    def replace(self, worker: Worker) -> Worker:
+        # still busy, hence killed right away
+        worker.stop()
+        return self.start_worker()
+
+    def start_worker(self) -> Worker:
+        return Worker(self.function, self.context, self.initializer)
+
+    def get_wait_timeout(self, busy_workers: List[Worker]) -> Optional[float]:
+        if self.timeout is None:
+            return None
+        first_deadline = min(worker.start for worker in busy_workers) + self.timeout
+        return max(first_deadline - time.perf_counter(), 0.0)
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 """The setup script."""
+import os
 
 from setuptools import find_packages, setup
 
@@ -14,6 +15,25 @@ with open("HISTORY.rst") as history_file:
 project = "globality-black"
 version = "0.1.0"
 
+# Pre/post-processing modules compiled with mypyc with GLOBALITY_BLACK_USE_MYPYC=1, e.g.
+# `GLOBALITY_BLACK_USE_MYPYC=1 pip wheel --no-build-isolation .` with mypy installed. The pure
+# Python modules are still installed, and used wherever the compiled ones are not
+MYPYC_MODULES = [
+    "globality_black/common.py",
+    "globality_black/blank_lines.py",
+    "globality_black/dotted_chains.py",
+    "globality_black/tuples.py",
+    "globality_black/comprehensions.py",
+    "globality_black/reformat_text.py",
+]
+
+if os.getenv("GLOBALITY_BLACK_USE_MYPYC") == "1":
+    from mypyc.build import mypycify
+
+    ext_modules = mypycify(["--config-file=mypy.ini", *MYPYC_MODULES])
+else:
+    ext_modules = []
+
 setup(
     name=project,
     author="Globality AI",
@@ -34,6 +54,10 @@ setup(
     entry_points={
         "console_scripts": [
             "globality-black = globality_black.cli:main",
+            "globality-black-merge-summaries = globality_black.cli:merge_summaries",
+        ],
+        "flake8.extension": [
+            "GB = globality_black.flake8_plugin:GlobalityBlackChecker",
         ],
     },
     install_requires=[
@@ -42,11 +66,15 @@ setup(
         "pytest>=3",
         "black>=22.1.0",
         "pexpect",
+        "tomli; python_version < '3.11'",
     ],
     extras_require={
         "jupyter": [
             "jupyterlab-code-formatter",
         ],
+        "isort": [
+            "isort>=5",
+        ],
         "lint": [
             "flake8-isort>=4.1.1",
             "flake8-print>=4.0.0",
@@ -63,7 +91,10 @@ setup(
         ],
     },
     include_package_data=True,
-    packages=find_packages(exclude=["*.tests", "*.tests.*", "tests.*", "tests"]),
+    packages=find_packages(
+        exclude=["*.tests", "*.tests.*", "tests.*", "tests", "benchmarks", "benchmarks.*"],
+    ),
     test_suite="tests",
     zip_safe=False,
+    ext_modules=ext_modules,
 )